@@ -0,0 +1,330 @@
+"""
+大数据量测试数据生成器
+
+在本地 PostgreSQL 中按线上的分布特征批量生成 users / messages / daily_sign_ins / points_history，
+并据此推导 command_stats、user_points、bot_counters 和物化排行榜，用于发现 schema 与 SQL 的规模退化。
+数据全部在服务端用 generate_series 生成，不经过 Python。
+
+分布：
+- 活跃度偏斜：第 i 个用户被选中的概率按 power(random(), skew) 集中在编号小的用户上，
+  skew=3 时约 1% 的用户产生 20% 的消息
+- 时间偏斜：消息和签到集中在最近的日子
+- 签到日期按用户去重，连续签到奖励与 sign_in_user 的规则一致
+
+用法（在仓库根目录）：
+    python -m benchmarks.datagen --dsn postgresql://postgres@127.0.0.1/bench --users 1000000 --messages 20000000
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+BASE_USER_ID = 100_000_000
+
+FIRST_NAMES = ['小明', 'Alice', 'Bob', '王伟', '李娜', 'Ivan', 'Maria', '张伟', 'Chen', 'Sam']
+LANGUAGES = ['zh-hans', 'en', 'ru', 'es', 'fa']
+COMMANDS = ['/start', '/help', '/sign', '/points', '/rank', '/stats', '/ping', '/echo hi']
+TEXTS = ['你好', 'hello', '现在几点', '谢谢', '今天天气怎么样', '哈哈', 'ok', '你是谁']
+
+# 按活跃度偏斜随机选一个用户（参数：用户数、偏斜指数）
+SKEWED_USER = f"{BASE_USER_ID} + 1 + floor(%(users)s * power(random(), %(skew)s))::bigint"
+
+# 与 sign_in_user 相同的连续签到分组：同一用户连续的日期落在同一组
+SIGN_IN_ISLANDS = """
+    SELECT id, user_id, sign_date, created_at,
+           sign_date - (ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY sign_date))::int AS grp
+    FROM daily_sign_ins
+"""
+
+
+class Step:
+    """打印每个生成步骤的耗时"""
+
+    def __init__(self, title: str):
+        self.title = title
+
+    def __enter__(self):
+        print(f"⏳ {self.title}...", flush=True)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if exc[0] is None:
+            print(f"✅ {self.title} ({time.perf_counter() - self.started:.1f}s)", flush=True)
+
+
+def _batches(total: int, batch_size: int):
+    done = 0
+    while done < total:
+        size = min(batch_size, total - done)
+        yield done, size
+        done += size
+
+
+def _next_month(month: date) -> date:
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _month_starts(first: date, last: date):
+    month = first.replace(day=1)
+    while month <= last:
+        yield month
+        month = _next_month(month)
+
+
+def create_history_partitions(conn, days: int):
+    """为历史数据建好月度分区；与 messages_legacy 重叠的月份跳过"""
+    from psycopg2 import errors
+    cursor = conn.cursor()
+    cursor.execute("SELECT CURRENT_DATE - %s, CURRENT_DATE", (days,))
+    first, last = cursor.fetchone()
+    for month in _month_starts(first, last):
+        name = f"messages_{month:%Y%m}"
+        cursor.execute("SAVEPOINT partition")
+        try:
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF messages FOR VALUES FROM (%s) TO (%s)",
+                (month, _next_month(month))
+            )
+            cursor.execute("RELEASE SAVEPOINT partition")
+        except errors.InvalidObjectDefinition:
+            cursor.execute("ROLLBACK TO SAVEPOINT partition")
+    conn.commit()
+
+
+def reset(conn):
+    cursor = conn.cursor()
+    cursor.execute("TRUNCATE users, messages, command_stats, points_history, user_points, daily_sign_ins CASCADE")
+    cursor.execute("UPDATE bot_counters SET total_users = 0, total_messages = 0, total_commands = 0, "
+                   "last_message_time = NULL")
+    conn.commit()
+
+
+def generate(conn, users: int, messages: int, sign_ins: int, adjustments: int,
+             days: int = 180, skew: float = 3.0, batch_size: int = 1_000_000, seed: float = 0.42):
+    """生成数据；调用前 schema 必须已由 DatabaseManager 初始化"""
+    params = {'users': users, 'skew': skew, 'days': days}
+    cursor = conn.cursor()
+    cursor.execute("SELECT setseed(%s)", (seed,))
+
+    with Step(f"users × {users:,}"):
+        # 用户数由触发器逐行维护，批量导入时关闭，最后统一重算
+        cursor.execute("ALTER TABLE users DISABLE TRIGGER trg_users_bot_counters")
+        for offset, size in _batches(users, batch_size):
+            cursor.execute(f"""
+                INSERT INTO users (telegram_id, username, first_name, language_code, created_at, last_active)
+                SELECT {BASE_USER_ID} + g,
+                       CASE WHEN random() < 0.7 THEN 'user' || g END,
+                       (%(names)s::text[])[1 + floor(random() * %(name_count)s)::int],
+                       (%(languages)s::text[])[1 + floor(random() * %(language_count)s)::int],
+                       NOW() - random() * %(days)s * INTERVAL '1 day',
+                       NOW()
+                FROM generate_series(%(first)s, %(last)s) g
+            """, dict(params, first=offset + 1, last=offset + size,
+                      names=FIRST_NAMES, name_count=len(FIRST_NAMES),
+                      languages=LANGUAGES, language_count=len(LANGUAGES)))
+            conn.commit()
+        cursor.execute("ALTER TABLE users ENABLE TRIGGER trg_users_bot_counters")
+        conn.commit()
+
+    with Step(f"messages × {messages:,}"):
+        create_history_partitions(conn, days)
+        for offset, size in _batches(messages, batch_size):
+            cursor.execute(f"""
+                INSERT INTO messages (user_id, chat_id, text, is_command, created_at)
+                SELECT u, u,
+                       CASE WHEN c THEN (%(commands)s::text[])[1 + floor(random() * %(command_count)s)::int]
+                            ELSE (%(texts)s::text[])[1 + floor(random() * %(text_count)s)::int] END,
+                       c,
+                       NOW() - power(random(), 2) * %(days)s * INTERVAL '1 day'
+                FROM (
+                    SELECT {SKEWED_USER} AS u, random() < 0.25 AS c
+                    FROM generate_series(1, %(size)s)
+                ) s
+            """, dict(params, size=size, commands=COMMANDS, command_count=len(COMMANDS),
+                      texts=TEXTS, text_count=len(TEXTS)))
+            conn.commit()
+            print(f"   {offset + size:,}/{messages:,}", flush=True)
+
+    with Step("command_stats 与用户活跃度"):
+        cursor.execute("""
+            INSERT INTO command_stats (user_id, command, use_count, last_used_at)
+            SELECT user_id, split_part(text, ' ', 1), COUNT(*), MAX(created_at)
+            FROM messages WHERE is_command
+            GROUP BY 1, 2
+            ON CONFLICT (user_id, command) DO UPDATE SET
+                use_count = command_stats.use_count + EXCLUDED.use_count,
+                last_used_at = GREATEST(command_stats.last_used_at, EXCLUDED.last_used_at)
+        """)
+        cursor.execute("""
+            UPDATE users u SET message_count = m.cnt, last_active = m.last
+            FROM (SELECT user_id, COUNT(*) AS cnt, MAX(created_at) AS last FROM messages GROUP BY user_id) m
+            WHERE u.telegram_id = m.user_id
+        """)
+        conn.commit()
+
+    with Step(f"daily_sign_ins × ~{sign_ins:,}"):
+        for offset, size in _batches(sign_ins, batch_size):
+            # 同一用户同一天的重复抽样被唯一约束去掉，实际行数略少于目标
+            cursor.execute(f"""
+                INSERT INTO daily_sign_ins (user_id, sign_date, points_awarded, created_at)
+                SELECT u, d, 1, d + random() * INTERVAL '1 day'
+                FROM (
+                    SELECT {SKEWED_USER} AS u,
+                           CURRENT_DATE - floor(power(random(), 1.5) * %(days)s)::int AS d
+                    FROM generate_series(1, %(size)s)
+                ) s
+                ON CONFLICT (user_id, sign_date) DO NOTHING
+            """, dict(params, size=size))
+            conn.commit()
+        # 连续签到奖励：连续3天额外1分，连续7天额外2分
+        cursor.execute(f"""
+            WITH streaks AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, grp ORDER BY sign_date) AS streak
+                FROM ({SIGN_IN_ISLANDS}) islands
+            )
+            UPDATE daily_sign_ins d
+            SET points_awarded = 1 + CASE WHEN s.streak >= 7 THEN 2 ELSE 1 END
+            FROM streaks s
+            WHERE d.id = s.id AND s.streak >= 3
+        """)
+        conn.commit()
+
+    with Step(f"points_history（签到 + {adjustments:,} 条管理员调整）"):
+        cursor.execute(f"""
+            WITH streaks AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, grp ORDER BY sign_date) AS streak
+                FROM ({SIGN_IN_ISLANDS}) islands
+            )
+            INSERT INTO points_history (user_id, points_change, reason, description, created_at)
+            SELECT d.user_id, d.points_awarded,
+                   CASE WHEN d.points_awarded > 1 THEN 'sign_in_streak_' || s.streak ELSE 'sign_in' END,
+                   '每日签到', d.created_at
+            FROM daily_sign_ins d JOIN streaks s ON s.id = d.id
+        """)
+        if adjustments:
+            cursor.execute(f"""
+                INSERT INTO points_history (user_id, points_change, reason, description, created_at)
+                SELECT {SKEWED_USER},
+                       (ARRAY[-50, -10, 5, 10, 20, 100])[1 + floor(random() * 6)::int],
+                       '管理员调整', '数据生成', NOW() - random() * %(days)s * INTERVAL '1 day'
+                FROM generate_series(1, %(adjustments)s)
+            """, dict(params, adjustments=adjustments))
+        conn.commit()
+
+    with Step("user_points 与签到位图"):
+        cursor.execute(f"""
+            WITH runs AS (
+                SELECT user_id, grp, COUNT(*) AS len, MAX(sign_date) AS last_date, MAX(created_at) AS last_at
+                FROM ({SIGN_IN_ISLANDS}) islands
+                GROUP BY user_id, grp
+            ),
+            sign_in_summary AS (
+                SELECT user_id,
+                       SUM(len) AS sign_in_count,
+                       MAX(last_at) AS last_sign_in,
+                       (ARRAY_AGG(len ORDER BY last_date DESC))[1] AS sign_in_streak,
+                       MAX(len) AS max_streak
+                FROM runs GROUP BY user_id
+            ),
+            totals AS (
+                SELECT user_id, SUM(points_change) AS total_points FROM points_history GROUP BY user_id
+            )
+            INSERT INTO user_points (user_id, total_points, sign_in_count, last_sign_in, sign_in_streak, max_streak)
+            SELECT t.user_id, t.total_points, COALESCE(s.sign_in_count, 0), s.last_sign_in,
+                   COALESCE(s.sign_in_streak, 0), COALESCE(s.max_streak, 0)
+            FROM totals t LEFT JOIN sign_in_summary s ON s.user_id = t.user_id
+        """)
+        # 签到位图由 daily_sign_ins 重建，与线上升级时的路径相同
+        cursor.execute("SELECT backfill_sign_in_bits()")
+        conn.commit()
+
+    with Step("bot_counters 与物化排行榜"):
+        # 计数器分片求和读取：总数写在 1 号分片，其余分片清零
+        cursor.execute("UPDATE bot_counters SET total_users = 0, total_messages = 0, total_commands = 0, "
+                       "last_message_time = NULL WHERE id <> 1")
+        cursor.execute("""
+            UPDATE bot_counters SET
+                total_users = (SELECT COUNT(*) FROM users),
+                total_messages = m.total,
+                total_commands = m.commands,
+                last_message_time = m.last,
+                updated_at = NOW()
+            FROM (SELECT COUNT(*) AS total, COUNT(*) FILTER (WHERE is_command) AS commands,
+                         MAX(created_at) AS last FROM messages) m
+            WHERE id = 1
+        """)
+        cursor.execute("REFRESH MATERIALIZED VIEW leaderboard_ranks")
+        cursor.execute("UPDATE leaderboard_refresh SET refreshed_at = NOW() WHERE id = 1")
+        conn.commit()
+
+    with Step("VACUUM ANALYZE"):
+        conn.autocommit = True
+        try:
+            cursor.execute("VACUUM ANALYZE")
+        finally:
+            conn.autocommit = False
+
+
+def connect_schema(dsn: str):
+    """用 DatabaseManager 建好 schema（与线上相同的初始化路径），返回 DatabaseManager"""
+    # 数据库配置在导入 database 模块时读取
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('DB_SSLMODE', 'disable')
+    from database import DatabaseManager
+    DatabaseManager.initialize()
+    return DatabaseManager
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--sign-ins', type=int, default=500_000, help="签到行数目标（去重后略少）")
+    parser.add_argument('--adjustments', type=int, default=10_000, help="管理员积分调整条数")
+    parser.add_argument('--days', type=int, default=180, help="历史跨度（天）")
+    parser.add_argument('--skew', type=float, default=3.0, help="活跃度偏斜指数，越大越集中")
+    parser.add_argument('--batch-size', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=float, default=0.42, help="随机种子（-1 到 1）")
+
+
+def generate_from_options(manager, options):
+    conn = manager.get_connection()
+    try:
+        generate(conn, options.users, options.messages, options.sign_ins, options.adjustments,
+                 options.days, options.skew, options.batch_size, options.seed)
+    finally:
+        manager.return_connection(conn)
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="生成大数据量测试数据")
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help="目标数据库（默认 BENCH_DATABASE_URL），切勿指向线上库")
+    parser.add_argument('--reset', action='store_true', help="先清空已有数据")
+    add_arguments(parser)
+    options = parser.parse_args(argv)
+    if not options.dsn:
+        parser.error("需要 --dsn 或 BENCH_DATABASE_URL")
+
+    manager = connect_schema(options.dsn)
+    try:
+        conn = manager.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM users)")
+            if cursor.fetchone()[0]:
+                if not options.reset:
+                    print("❌ users 表已有数据，使用 --reset 清空后再生成")
+                    return 1
+                reset(conn)
+            conn.commit()
+        finally:
+            manager.return_connection(conn)
+        generate_from_options(manager, options)
+    finally:
+        manager.close_all_connections()
+
+
+if __name__ == '__main__':
+    sys.exit(run())
@@ -0,0 +1,194 @@
+"""
+基准测试用的假对象：构造 Update、记录发送调用的 Bot 以及内存版 DB_MANAGER
+"""
+import asyncio
+import itertools
+from datetime import datetime, date, timedelta
+from types import SimpleNamespace
+from telegram import Chat, Message, MessageEntity, Update, User
+from leaderboard import LeaderboardIndex
+from signhistory import SignInHistory
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+class StubBot:
+    """
+    代替 telegram.Bot：只记录 send_message 调用，不发网络请求
+    send_latency 可模拟 Bot API 往返时间
+    """
+
+    def __init__(self, send_latency: float = 0.0):
+        self.send_latency = send_latency
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        self.sent.append((chat_id, text))
+        return None
+
+
+def make_update(bot: StubBot, text: str, user_id: int, first_name: str = 'Bench',
+                username: str = None) -> Update:
+    """构造一个私聊文本消息更新；以 / 开头时带上 bot_command 实体"""
+    user = User(id=user_id, first_name=first_name, is_bot=False,
+                username=username or f'user{user_id}', language_code='zh-hans')
+    chat = Chat(id=user_id, type=Chat.PRIVATE)
+    entities = None
+    if text.startswith('/'):
+        entities = [MessageEntity(type=MessageEntity.BOT_COMMAND, offset=0, length=len(text.split()[0]))]
+    message = Message(message_id=next(_message_ids), date=datetime.now(), chat=chat,
+                      from_user=user, text=text, entities=entities)
+    for obj in (user, chat, message):
+        obj.set_bot(bot)
+    return Update(update_id=next(_update_ids), message=message)
+
+
+def make_context(bot: StubBot, text: str):
+    """处理器只用到 context.args 和 context.bot"""
+    return SimpleNamespace(args=text.split()[1:], bot=bot)
+
+
+class InMemoryDBManager:
+    """
+    与 AsyncDatabaseManager 接口一致的内存实现，用于把处理器自身开销与数据库开销分开测量
+    只覆盖 main.py 用到的方法
+    """
+
+    MESSAGE_FLUSH_INTERVAL = 2
+    LEADERBOARD_MODE = 'memory'
+
+    def __init__(self):
+        self.users = {}
+        self.messages = 0
+        self.commands = 0
+        self.last_message_time = None
+        self.command_counts = {}
+        # user_id -> {total_points, sign_in_count, sign_in_streak, max_streak, last_sign_in}
+        self.points = {}
+        self.sign_ins = {}
+        self.history = {}
+        self.leaderboard = LeaderboardIndex()
+
+    async def flush(self):
+        pass
+
+    async def ping(self):
+        return True
+
+    def pool_stats(self):
+        return None
+
+    def close_all_connections(self):
+        pass
+
+    async def save_user(self, user_data: dict):
+        self.users.setdefault(user_data['id'], dict(user_data, join_date=datetime.now()))
+        return user_data['id']
+
+    async def save_message(self, telegram_id: int, chat_id: int, text: str, is_command: bool = False):
+        self.messages += 1
+        self.commands += is_command
+        self.last_message_time = datetime.now()
+
+    async def update_command_stats(self, telegram_id: int, command: str):
+        counts = self.command_counts.setdefault(telegram_id, {})
+        counts[command] = counts.get(command, 0) + 1
+
+    async def get_user_stats(self, telegram_id: int):
+        user = self.users.get(telegram_id)
+        if user is None:
+            return None
+        counts = self.command_counts.get(telegram_id, {})
+        return {
+            'telegram_id': telegram_id,
+            'username': user.get('username'),
+            'join_date': user['join_date'],
+            'message_count': self.messages,
+            'command_counts': dict(counts),
+            'last_command_used': next(iter(counts), None),
+            'last_command_time': self.last_message_time,
+        }
+
+    async def get_bot_stats(self):
+        return {
+            'total_users': len(self.users),
+            'total_messages': self.messages,
+            'total_commands': self.commands,
+            'last_message_time': self.last_message_time,
+        }
+
+    def _state(self, telegram_id: int) -> dict:
+        return self.points.setdefault(telegram_id, {
+            'total_points': 0, 'sign_in_count': 0, 'sign_in_streak': 0,
+            'max_streak': 0, 'last_sign_in': None,
+        })
+
+    def _record(self, telegram_id: int, change: int, reason: str):
+        history = self.history.setdefault(telegram_id, [])
+        history.insert(0, {'points_change': change, 'reason': reason, 'description': reason,
+                           'time_str': datetime.now().strftime('%m-%d %H:%M')})
+        del history[5:]
+
+    async def daily_sign_in(self, telegram_id: int, username: str = None, first_name: str = None):
+        state = self._state(telegram_id)
+        today = date.today()
+        days = self.sign_ins.setdefault(telegram_id, set())
+        if today in days:
+            return False, "今天已经签到过了", dict(state, current_streak=state['sign_in_streak'],
+                                                   signed_in_today=True)
+
+        streak = state['sign_in_streak'] + 1 if today - timedelta(days=1) in days else 1
+        awarded = 1 + (1 if streak >= 3 else 0) + (2 if streak >= 7 else 0)
+        days.add(today)
+        state.update(total_points=state['total_points'] + awarded,
+                     sign_in_count=state['sign_in_count'] + 1,
+                     sign_in_streak=streak, max_streak=max(state['max_streak'], streak),
+                     last_sign_in=datetime.now())
+        self._record(telegram_id, awarded, 'sign_in')
+        self.leaderboard.update(telegram_id, username=username, first_name=first_name, **state)
+        return True, "签到成功", dict(state, points_awarded=awarded, current_streak=streak,
+                                       signed_in_today=True, rank=self.leaderboard.rank(telegram_id))
+
+    async def get_user_points_info(self, telegram_id: int):
+        state = self.points.get(telegram_id)
+        if state is None:
+            return None
+        days = self.sign_ins.get(telegram_id, ())
+        end = max(days, default=None)
+        history = SignInHistory(sum(1 << (end - day).days for day in days), end)
+        today = date.today()
+        return dict(state,
+                    current_streak=history.streak(today),
+                    signed_in_today=history.signed(today),
+                    sign_in_history=history,
+                    today=today,
+                    recent_transactions=list(self.history.get(telegram_id, [])),
+                    rank=self.leaderboard.rank(telegram_id))
+
+    async def get_user_rank(self, telegram_id: int):
+        state = self.points.get(telegram_id)
+        if state is None:
+            return None
+        return {'rank': self.leaderboard.rank(telegram_id), 'total_points': state['total_points']}
+
+    async def leaderboard_version(self):
+        return ('memory', self.leaderboard.version)
+
+    async def get_top_users(self, limit: int = 10):
+        return self.leaderboard.top(limit)
+
+    async def add_points_to_user(self, telegram_id: int, points: int, reason: str = "管理员调整"):
+        state = self._state(telegram_id)
+        state['total_points'] += points
+        self._record(telegram_id, points, reason)
+        self.leaderboard.update(telegram_id, **state)
+        return True, "积分调整成功", dict(state, user_id=telegram_id)
+
+    async def set_user_points(self, telegram_id: int, points: int):
+        state = self._state(telegram_id)
+        state['total_points'] = points
+        self.leaderboard.update(telegram_id, **state)
+        return True, "积分设置成功", dict(state, user_id=telegram_id)
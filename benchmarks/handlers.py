@@ -0,0 +1,209 @@
+"""
+处理器基准测试
+
+用构造的 Update 和只记录发送的 StubBot 直接调用 main.py 中的处理器，
+分别在内存版 DB_MANAGER 和本地 PostgreSQL 上测量每个处理器的吞吐与延迟，结果写成 JSON 便于跨提交对比。
+
+用法（在仓库根目录）：
+    python -m benchmarks.handlers                       # 两种模式都跑
+    python -m benchmarks.handlers --mode memory -n 2000
+    python -m benchmarks.handlers --compare 旧.json 新.json
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+# main.py 导入时要求 TOKEN
+os.environ.setdefault('TOKEN', '0:benchmark')
+
+import main
+from benchmarks.fakes import StubBot, InMemoryDBManager, make_update, make_context
+from benchmarks.postgres import local_postgres
+from benchmarks import report
+
+
+ADMIN_ID = 8318755495
+BASE_USER_ID = 10_000_000
+
+SMART_REPLY_TEXTS = ['你好', '现在几点', '今天几号', '谢谢', '今天天气怎么样', '随便说点什么']
+
+# (名称, 处理器, 消息文本；{uid} 会替换为目标用户ID, 是否以管理员身份发送)
+SCENARIOS = [
+    ('start', main.start, '/start', False),
+    ('help', main.help_command, '/help', False),
+    ('ping', main.ping, '/ping', False),
+    ('stats', main.user_stats, '/stats', False),
+    ('admin', main.admin_stats, '/admin', False),
+    ('echo', main.echo_command, '/echo hello benchmark', False),
+    ('sign', main.sign_in_command, '/sign', False),
+    ('points', main.points_command, '/points', False),
+    ('calendar', main.calendar_command, '/calendar', False),
+    ('rank', main.rank_command, '/rank', False),
+    ('addpoints', main.add_points_command, '/addpoints {uid} 5 benchmark', True),
+    ('setpoints', main.set_points_command, '/setpoints {uid} 100', True),
+    ('smart_reply', main.smart_reply, None, False),
+]
+
+
+def _summarize(latencies: list, elapsed: float, sends: int, errors: int, flush_seconds: float) -> dict:
+    summary = report.summarize(latencies, elapsed)
+    summary.update({
+        'sends_per_call': round(sends / len(latencies), 2),
+        # 处理器吞掉异常后回复的 "❌ ..." 条数，非零说明测到的是错误路径
+        'error_replies': errors,
+        'flush_ms': round(flush_seconds * 1000, 3),
+    })
+    return summary
+
+
+async def _dispatch(bot, handler, text, user_id):
+    """与 Application 一致：命令先经过 group -1 的命令统计，再进入处理器"""
+    update = make_update(bot, text, user_id)
+    context = make_context(bot, text)
+    if text.startswith('/'):
+        await main.track_command(update, context)
+    await handler(update, context)
+
+
+async def _run_scenario(bot, handler, template, as_admin, iterations, concurrency, users, warmup):
+    counter = iter(range(warmup + iterations))
+    latencies = []
+
+    def message_for(i):
+        if template is None:
+            return SMART_REPLY_TEXTS[i % len(SMART_REPLY_TEXTS)]
+        return template.format(uid=BASE_USER_ID + i % users)
+
+    async def worker():
+        for i in counter:
+            user_id = ADMIN_ID if as_admin else BASE_USER_ID + i % users
+            started = time.perf_counter()
+            await _dispatch(bot, handler, message_for(i), user_id)
+            if i >= warmup:
+                latencies.append(time.perf_counter() - started)
+
+    sent_before = len(bot.sent)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    # 写缓冲的落库时间单独统计，不计入处理器延迟
+    flush_started = time.perf_counter()
+    await main.DB_MANAGER.flush()
+    flush_seconds = time.perf_counter() - flush_started
+
+    # 预热调用也会发送，按总调用数折算；预热部分计入吞吐时间，影响可以忽略
+    sent = bot.sent[sent_before:]
+    sends = len(sent) * iterations / (warmup + iterations)
+    errors = sum(1 for _, text in sent if text.lstrip().startswith('❌'))
+    return _summarize(latencies, elapsed, sends, errors, flush_seconds)
+
+
+async def _seed(users: int):
+    """预先注册用户并让一半用户签到，使 /rank、/points 有数据可查"""
+    for i in range(users):
+        user_id = BASE_USER_ID + i
+        await main.DB_MANAGER.save_user({
+            'id': user_id, 'username': f'user{user_id}', 'first_name': 'Bench',
+            'last_name': None, 'language_code': 'zh-hans', 'is_bot': False,
+        })
+        if i % 2 == 0:
+            await main.DB_MANAGER.daily_sign_in(user_id, f'user{user_id}', 'Bench')
+    await main.DB_MANAGER.save_user({
+        'id': ADMIN_ID, 'username': 'admin', 'first_name': 'Admin',
+        'last_name': None, 'language_code': 'zh-hans', 'is_bot': False,
+    })
+    await main.DB_MANAGER.flush()
+
+
+async def _run_all(options) -> dict:
+    bot = StubBot(send_latency=options.send_latency / 1000)
+    # 正常启动时由 main() 根据已注册的处理器填充
+    main.TRACKED_COMMANDS = frozenset(
+        template.split()[0][1:] for _, _, template, _ in SCENARIOS if template
+    )
+    await _seed(options.users)
+
+    results = {}
+    for name, handler, template, as_admin in SCENARIOS:
+        if options.only and name not in options.only:
+            continue
+        results[name] = await _run_scenario(
+            bot, handler, template, as_admin,
+            options.iterations, options.concurrency, options.users, options.warmup
+        )
+        print(f"  {name:<12} {results[name]['throughput']:>9} ops/s  "
+              f"p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+              f"p99 {results[name]['p99_ms']:>8} ms"
+              + (f"  ⚠️ {results[name]['error_replies']} 条错误回复" if results[name]['error_replies'] else ''))
+    return results
+
+
+def run_memory(options) -> dict:
+    print("🧪 内存 DB_MANAGER")
+    main.DATABASE_URL = 'memory://benchmark'
+    main.DB_MANAGER = InMemoryDBManager()
+    return asyncio.run(_run_all(options))
+
+
+def run_postgres(options) -> dict:
+    print("🐘 PostgreSQL")
+    with local_postgres() as dsn:
+        # 数据库配置在导入 database 模块时读取
+        os.environ['DATABASE_URL'] = dsn
+        os.environ.setdefault('DB_SSLMODE', 'disable')
+        from database import AsyncDatabaseManager
+
+        async def run():
+            AsyncDatabaseManager.initialize()
+            try:
+                return await _run_all(options)
+            finally:
+                await AsyncDatabaseManager.flush()
+
+        main.DATABASE_URL = dsn
+        main.DB_MANAGER = AsyncDatabaseManager
+        try:
+            return asyncio.run(run())
+        finally:
+            AsyncDatabaseManager.close_all_connections()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="main.py 处理器基准测试")
+    parser.add_argument('--mode', choices=['memory', 'postgres', 'all'], default='all')
+    parser.add_argument('-n', '--iterations', type=int, default=500, help="每个处理器的计时调用次数")
+    parser.add_argument('--warmup', type=int, default=50, help="每个处理器的预热调用次数")
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help="并发调用数")
+    parser.add_argument('--users', type=int, default=1000, help="模拟的用户数")
+    parser.add_argument('--send-latency', type=float, default=0.0, help="模拟 Bot API 往返时间（毫秒）")
+    parser.add_argument('--only', nargs='*', help="只测试这些处理器")
+    parser.add_argument('-o', '--output', help="结果 JSON 路径（默认写入 benchmarks/results/）")
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="对比两个结果文件")
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    options = parse_args(argv)
+    if options.compare:
+        report.compare(*options.compare)
+        return
+
+    # 处理器的逐条 info 日志会主导耗时，基准测试时关闭
+    logging.disable(logging.INFO)
+
+    runs = {}
+    if options.mode in ('memory', 'all'):
+        runs['memory'] = run_memory(options)
+    if options.mode in ('postgres', 'all'):
+        runs['postgres'] = run_postgres(options)
+
+    report.save('handlers', {key: value for key, value in vars(options).items()
+                             if key not in ('compare', 'output')}, runs, options.output)
+
+
+if __name__ == '__main__':
+    sys.exit(run())
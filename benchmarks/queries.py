@@ -0,0 +1,296 @@
+"""
+DatabaseManager 查询基准与执行计划
+
+对每个 DatabaseManager 查询：
+1. 在热点用户与长尾用户上各计时若干次（写操作以“空跑”方式执行：不提交，归还连接时回滚，数据集保持不变）
+2. 记录该方法实际发出的 SQL，在同一事务里逐条 EXPLAIN (ANALYZE, BUFFERS) 后回滚；
+   服务器允许加载 auto_explain 时，plpgsql 函数（sign_in_user）内部语句的计划也一并收集
+3. 标出在大表上的顺序扫描，结果写成 JSON，可用 python -m benchmarks.report 旧.json 新.json 对比
+
+用法（在仓库根目录）：
+    python -m benchmarks.queries --dsn postgresql://... -n 50        # 使用 datagen 生成好的库
+    python -m benchmarks.queries --generate --users 200000 --messages 2000000   # 临时库中先生成数据
+"""
+import argparse
+import os
+import sys
+import time
+import psycopg2
+from benchmarks import report
+from benchmarks.datagen import add_arguments, connect_schema, generate_from_options
+from benchmarks.postgres import local_postgres
+
+# 顺序扫描超过这么多行时在结果中告警
+SEQ_SCAN_WARN_ROWS = 10_000
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'VALUES')
+
+
+def make_capturing_connection(base):
+    """
+    基于 DatabaseManager 的连接类派生：
+    - capture 不为 None 时记录每条执行的 SQL（参数已代入）
+    - dry_run 为真时 commit 不生效，连接归还连接池时整个事务回滚
+    """
+    cursor_classes = {}
+
+    def capturing_cursor(factory):
+        if factory not in cursor_classes:
+            class CapturingCursor(factory):
+                def execute(self, query, vars=None):
+                    capture = self.connection.capture
+                    if capture is not None:
+                        sql = self.mogrify(query, vars)
+                        capture.append(sql.decode() if isinstance(sql, bytes) else sql)
+                    return super().execute(query, vars)
+            cursor_classes[factory] = CapturingCursor
+        return cursor_classes[factory]
+
+    class CapturingConnection(base):
+        capture = None
+        dry_run = False
+
+        def cursor(self, *args, **kwargs):
+            factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = capturing_cursor(factory)
+            return super().cursor(*args, **kwargs)
+
+        def commit(self):
+            if not CapturingConnection.dry_run:
+                super().commit()
+
+    return CapturingConnection
+
+
+def _sample_users(manager, hot: int, cold: int) -> dict:
+    """消息最多的用户与随机的普通用户"""
+    conn = manager.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT telegram_id FROM users ORDER BY message_count DESC LIMIT %s", (hot,))
+        hot_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT telegram_id FROM users TABLESAMPLE SYSTEM (1) LIMIT %s", (cold,))
+        cold_ids = [row[0] for row in cursor.fetchall()]
+        if not cold_ids:
+            cursor.execute("SELECT telegram_id FROM users ORDER BY random() LIMIT %s", (cold,))
+            cold_ids = [row[0] for row in cursor.fetchall()]
+        return {'hot': hot_ids, 'cold': cold_ids}
+    finally:
+        manager.return_connection(conn)
+
+
+def build_cases(manager):
+    """(用例名, 调用函数(user_id), 是否写操作, 每轮重复次数的缩放)"""
+
+    def points_summary_view(user_id):
+        # v_user_points_summary 已不在读路径上，保留计时以免视图定义退化后无人察觉
+        conn = manager.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM v_user_points_summary WHERE telegram_id = %s", (user_id,))
+            return cursor.fetchone()
+        finally:
+            manager.return_connection(conn)
+
+    def message_batch(user_id):
+        rows = [(user_id, user_id, 'benchmark', i % 4 == 0, 0.0) for i in range(200)]
+        return manager.save_messages_batch(rows)
+
+    return [
+        ('get_top_users', lambda uid: manager.get_top_users(10), False, 1),
+        ('get_top_users_materialized', lambda uid: manager.get_top_users_materialized(10), False, 1),
+        ('get_user_points_info[count_rank]', lambda uid: manager.get_user_points_info(uid, rank_source='count'), False, 1),
+        ('get_user_points_info[materialized]', lambda uid: manager.get_user_points_info(uid, rank_source='materialized'), False, 1),
+        ('get_user_rank_materialized', manager.get_user_rank_materialized, False, 1),
+        ('v_user_points_summary', points_summary_view, False, 1),
+        ('get_bot_stats', lambda uid: manager.get_bot_stats(), False, 1),
+        ('get_user_stats', manager.get_user_stats, False, 1),
+        ('daily_sign_in', lambda uid: manager.daily_sign_in(uid, f'user{uid}', 'Bench', with_rank=False), True, 1),
+        ('daily_sign_in[rank]', lambda uid: manager.daily_sign_in(uid, f'user{uid}', 'Bench', with_rank=True), True, 1),
+        ('save_user', lambda uid: manager.save_user({
+            'id': uid, 'username': f'renamed{uid}', 'first_name': 'Bench', 'last_name': None,
+            'language_code': 'en', 'is_bot': False}), True, 1),
+        ('save_messages_batch[200]', message_batch, True, 1),
+        ('add_points_to_user', lambda uid: manager.add_points_to_user(uid, 5, 'benchmark'), True, 1),
+        ('refresh_leaderboard', lambda uid: manager.refresh_leaderboard(), True, 0.1),
+        ('load_leaderboard', lambda uid: manager.load_leaderboard(), False, 0.1),
+    ]
+
+
+def time_case(connection_class, func, is_write: bool, user_ids: list, iterations: int) -> dict:
+    connection_class.dry_run = is_write
+    try:
+        latencies = []
+        started = time.perf_counter()
+        for i in range(iterations):
+            call_started = time.perf_counter()
+            func(user_ids[i % len(user_ids)])
+            latencies.append(time.perf_counter() - call_started)
+        return report.summarize(latencies, time.perf_counter() - started)
+    finally:
+        connection_class.dry_run = False
+
+
+def _walk_plan(node, found: list):
+    if node.get('Node Type') == 'Seq Scan':
+        rows = node.get('Actual Rows', 0) * node.get('Actual Loops', 1) + node.get('Rows Removed by Filter', 0)
+        if rows >= SEQ_SCAN_WARN_ROWS:
+            found.append({'relation': node.get('Relation Name'), 'rows_scanned': rows})
+    for child in node.get('Plans', []):
+        _walk_plan(child, found)
+
+
+def explain_case(manager, connection_class, func, user_id) -> list:
+    """记录方法发出的 SQL，并在回滚的事务中逐条 EXPLAIN ANALYZE"""
+    statements = []
+    connection_class.capture = statements
+    connection_class.dry_run = True
+    # 预处理语句以 EXECUTE 名字 的形式出现，EXPLAIN 需要原始 SQL
+    prepared = manager._statements.enabled
+    manager._statements.enabled = False
+    try:
+        func(user_id)
+    finally:
+        connection_class.capture = None
+        connection_class.dry_run = False
+        manager._statements.enabled = prepared
+
+    conn = manager.get_connection()
+    plans = []
+    try:
+        cursor = conn.cursor()
+        nested = _enable_auto_explain(cursor)
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(EXPLAINABLE):
+                continue
+            del conn.notices[:]
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql)
+            plan = cursor.fetchone()[0][0]
+            seq_scans = []
+            _walk_plan(plan['Plan'], seq_scans)
+            entry = {
+                'sql': ' '.join(sql.split())[:500],
+                'planning_ms': plan.get('Planning Time'),
+                'execution_ms': plan.get('Execution Time'),
+                'seq_scans': seq_scans,
+                'plan': plan['Plan'],
+            }
+            if nested:
+                entry['nested_plans'] = [notice.strip() for notice in conn.notices if 'duration:' in notice]
+            plans.append(entry)
+    finally:
+        conn.rollback()
+        manager.return_connection(conn)
+    return plans
+
+
+def _enable_auto_explain(cursor) -> bool:
+    """plpgsql 函数内部语句的计划只能靠 auto_explain 以通知形式取回；需要超级用户"""
+    try:
+        cursor.execute("SAVEPOINT auto_explain")
+        cursor.execute("LOAD 'auto_explain'")
+        cursor.execute("SET LOCAL auto_explain.log_min_duration = 0")
+        cursor.execute("SET LOCAL auto_explain.log_analyze = on")
+        cursor.execute("SET LOCAL auto_explain.log_nested_statements = on")
+        cursor.execute("SET LOCAL client_min_messages = log")
+        cursor.execute("RELEASE SAVEPOINT auto_explain")
+        return True
+    except psycopg2.Error:
+        cursor.execute("ROLLBACK TO SAVEPOINT auto_explain")
+        return False
+
+
+def table_sizes(manager) -> dict:
+    conn = manager.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT relname, reltuples::bigint
+            FROM pg_class
+            WHERE relname IN ('users', 'messages', 'points_history', 'user_points',
+                              'daily_sign_ins', 'command_stats', 'leaderboard_ranks')
+        """)
+        sizes = dict(cursor.fetchall())
+        # 分区表的 reltuples 为 -1，改为统计各分区之和
+        cursor.execute("""
+            SELECT COALESCE(SUM(c.reltuples), 0)::bigint FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = 'messages'::regclass
+        """)
+        sizes['messages'] = cursor.fetchone()[0]
+        return sizes
+    finally:
+        manager.return_connection(conn)
+
+
+def benchmark(options, dsn: str):
+    # 连接类在 initialize 时传给连接池，必须在建池前替换
+    os.environ['DATABASE_URL'] = dsn
+    os.environ.setdefault('DB_SSLMODE', 'disable')
+    from database import DatabaseManager
+    connection_class = make_capturing_connection(DatabaseManager.CONNECTION_FACTORY)
+    DatabaseManager.CONNECTION_FACTORY = connection_class
+
+    manager = connect_schema(dsn)
+    try:
+        if options.generate:
+            generate_from_options(manager, options)
+
+        sizes = table_sizes(manager)
+        print("📦 数据规模: " + ', '.join(f"{name}={count:,}" for name, count in sorted(sizes.items())))
+
+        users = _sample_users(manager, options.hot_users, options.cold_users)
+        runs, plans = {}, {}
+        for name, func, is_write, scale in build_cases(manager):
+            if options.only and name not in options.only:
+                continue
+            iterations = max(1, int(options.iterations * scale))
+            for group, user_ids in users.items():
+                if not user_ids:
+                    continue
+                result = time_case(connection_class, func, is_write, user_ids, iterations)
+                runs.setdefault(group, {})[name] = result
+                print(f"  {name:<36} {group:<4} p50 {result['p50_ms']:>9} ms  p95 {result['p95_ms']:>9} ms")
+
+            sample = (users['hot'] or users['cold'])[0]
+            plans[name] = explain_case(manager, connection_class, func, sample)
+            for entry in plans[name]:
+                for scan in entry['seq_scans']:
+                    print(f"    ⚠️ 顺序扫描 {scan['relation']}（{scan['rows_scanned']:,} 行）")
+    finally:
+        manager.close_all_connections()
+
+    return runs, plans, sizes
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DatabaseManager 查询基准与执行计划")
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help="已有数据的数据库；不指定时启动临时数据库（需配合 --generate）")
+    parser.add_argument('--generate', action='store_true', help="先用 datagen 生成数据")
+    parser.add_argument('-n', '--iterations', type=int, default=50, help="每个用例在每组用户上的调用次数")
+    parser.add_argument('--hot-users', type=int, default=20)
+    parser.add_argument('--cold-users', type=int, default=200)
+    parser.add_argument('--only', nargs='*', help="只测试这些用例")
+    parser.add_argument('-o', '--output', help="结果 JSON 路径（默认写入 benchmarks/results/）")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    options = parse_args(argv)
+
+    if options.dsn:
+        runs, plans, sizes = benchmark(options, options.dsn)
+    else:
+        if not options.generate:
+            print("⚠️ 临时数据库是空的，自动开启 --generate")
+            options.generate = True
+        with local_postgres() as dsn:
+            runs, plans, sizes = benchmark(options, dsn)
+
+    report.save('queries', {key: value for key, value in vars(options).items() if key not in ('dsn', 'output')},
+                runs, options.output, table_sizes=sizes, plans=plans)
+
+
+if __name__ == '__main__':
+    sys.exit(run())
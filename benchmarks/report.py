@@ -0,0 +1,95 @@
+"""
+基准测试结果的统计、保存与对比（各基准脚本共用）
+
+对比两次结果：
+    python -m benchmarks.report 旧.json 新.json
+
+结果文件格式：
+    {"revision": ..., "created_at": ..., "runs": {运行名: {用例名: {"throughput", "p50_ms", "p95_ms", ...}}}, ...}
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def percentile(ordered: list, q: float) -> float:
+    """已排序样本的分位数（最近秩法）"""
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    """把一组耗时（秒）汇总成吞吐与分位数（毫秒）"""
+    ordered = sorted(latencies)
+    return {
+        'calls': len(ordered),
+        'throughput': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def save(prefix: str, options: dict, runs: dict, path: str = None, **extra) -> str:
+    """写入结果 JSON，默认路径为 benchmarks/results/<prefix>-<时间>-<提交>.json"""
+    revision = git_revision()
+    result = {
+        'revision': revision,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': options,
+        'runs': runs,
+        **extra,
+    }
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{prefix}-{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    with open(path, 'w') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2, default=str)
+    print(f"✅ 结果已写入 {path}")
+    return path
+
+
+def compare(base_path: str, new_path: str):
+    """逐个用例对比两次结果的吞吐与 p50/p95"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    def change(old, cur):
+        return f"{(cur - old) / old * 100:+.1f}%" if old and cur is not None else 'n/a'
+
+    print(f"对比 {base['revision']} → {new['revision']}")
+    for run, cases in new['runs'].items():
+        old_cases = base['runs'].get(run, {})
+        print(f"\n[{run}]")
+        print(f"{'case':<28}{'ops/s':>12}{'p50':>12}{'p95':>12}")
+        for name, cur in cases.items():
+            old = old_cases.get(name)
+            if old is None:
+                print(f"{name:<28}{'(新增)':>12}")
+                continue
+            print(f"{name:<28}{change(old['throughput'], cur['throughput']):>12}"
+                  f"{change(old['p50_ms'], cur['p50_ms']):>12}{change(old['p95_ms'], cur['p95_ms']):>12}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit("用法: python -m benchmarks.report BASE.json NEW.json")
+    compare(sys.argv[1], sys.argv[2])
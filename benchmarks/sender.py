@@ -0,0 +1,176 @@
+"""
+发送调度器基准测试
+
+在本地启动一个模拟 Bot API（与 Telegram 一样限制全局约 30 条/秒、每个聊天约 1 条/秒，超限返回 429 + retry_after），
+用真实的 ExtBot 发出一批突发消息：交互回复与批量推送混合，分别在「不限流」和 SendScheduler 下运行，
+统计送达数、服务端返回的 429 次数以及各优先级的发送延迟。
+
+用法（在仓库根目录）：
+    python -m benchmarks.sender
+    python -m benchmarks.sender --interactive 300 --bulk 600 --chats 200
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qs
+
+from telegram.error import RetryAfter
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+from webserver import HTTPServer, Response
+from sender import SendScheduler, BULK, INTERACTIVE
+from benchmarks import report
+
+TOKEN = '0:benchmark'
+
+
+class FakeBotAPI:
+    """
+    模拟 Bot API：只实现 getMe、setWebhook、deleteWebhook 与 sendMessage
+    用滑动窗口计数模拟 Telegram 的全局与单聊天限制
+    """
+
+    def __init__(self, port: int, global_rate: int = 30, chat_rate: int = 1,
+                 retry_after: int = 1, latency: float = 0.02):
+        self.server = HTTPServer('127.0.0.1', port)
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self._global = deque()
+        self._chats = defaultdict(deque)
+        self.delivered = 0
+        self.rejected = 0
+        # chat_id -> 已送达的消息文本（按送达顺序）
+        self.messages = defaultdict(list)
+        self.server.route('POST', f'/bot{TOKEN}/getMe', self._get_me)
+        self.server.route('POST', f'/bot{TOKEN}/setWebhook', self._true)
+        self.server.route('POST', f'/bot{TOKEN}/deleteWebhook', self._true)
+        self.server.route('POST', f'/bot{TOKEN}/sendMessage', self._send_message)
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.server.port}/bot'
+
+    @staticmethod
+    def _ok(result) -> Response:
+        return Response(200, json.dumps({'ok': True, 'result': result}), content_type='application/json')
+
+    async def _true(self, request):
+        return self._ok(True)
+
+    async def _get_me(self, request):
+        return self._ok({'id': 0, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'})
+
+    def _over_limit(self, window: deque, limit: int, now: float) -> bool:
+        while window and now - window[0] >= 1:
+            window.popleft()
+        return len(window) >= limit
+
+    async def _send_message(self, request):
+        params = {key: values[0] for key, values in parse_qs(request.body.decode()).items()}
+        chat_id = int(params['chat_id'])
+        await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        chat_window = self._chats[chat_id]
+        if self._over_limit(self._global, self.global_rate, now) or \
+                self._over_limit(chat_window, self.chat_rate, now):
+            self.rejected += 1
+            body = {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+            return Response(429, json.dumps(body), content_type='application/json')
+
+        self._global.append(now)
+        chat_window.append(now)
+        self.delivered += 1
+        text = json.loads(params['text']) if params['text'].startswith('"') else params['text']
+        self.messages[chat_id].append(text)
+        return self._ok({
+            'message_id': self.delivered,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        })
+
+
+async def _burst(bot, interactive: int, bulk: int, chats: int):
+    """同时发出 interactive 条交互回复（每个聊天轮流）和 bulk 条批量推送（每个聊天一条）"""
+    latencies = {INTERACTIVE: [], BULK: []}
+    failures = {INTERACTIVE: 0, BULK: 0}
+
+    async def send(chat_id, priority):
+        started = time.perf_counter()
+        try:
+            kwargs = {'rate_limit_args': priority} if bot.rate_limiter else {}
+            await bot.send_message(chat_id, f'{priority} message', **kwargs)
+        except RetryAfter:
+            failures[priority] += 1
+            return
+        latencies[priority].append(time.perf_counter() - started)
+
+    tasks = [send(1 + i % chats, INTERACTIVE) for i in range(interactive)]
+    tasks += [send(1_000_000 + i, BULK) for i in range(bulk)]
+    started = time.perf_counter()
+    await asyncio.gather(*tasks)
+    return latencies, failures, time.perf_counter() - started
+
+
+async def run(options) -> dict:
+    api = FakeBotAPI(options.port, retry_after=options.retry_after, latency=options.latency / 1000)
+    await api.server.start()
+    runs = {}
+    try:
+        for name, limiter in (('unlimited', None), ('scheduler', SendScheduler())):
+            api.delivered = api.rejected = 0
+            # 等服务端的滑动窗口清空，两轮互不影响
+            await asyncio.sleep(1.5)
+            bot = ExtBot(TOKEN, base_url=api.base_url, rate_limiter=limiter,
+                         request=HTTPXRequest(connection_pool_size=256))
+            async with bot:
+                latencies, failures, elapsed = await _burst(bot, options.interactive, options.bulk, options.chats)
+
+            print(f"\n🧪 {name}: 送达 {api.delivered} 条，服务端 429 {api.rejected} 次，耗时 {elapsed:.2f}s")
+            cases = {}
+            for priority in (INTERACTIVE, BULK):
+                if latencies[priority]:
+                    summary = report.summarize(latencies[priority], elapsed)
+                    summary['failed'] = failures[priority]
+                    cases[priority] = summary
+                    print(f"  {priority:<12} 成功 {summary['calls']:>5}  失败 {failures[priority]:>5}"
+                          f"  p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms")
+                else:
+                    print(f"  {priority:<12} 成功     0  失败 {failures[priority]:>5}")
+            cases['server'] = {'delivered': api.delivered, 'rejected': api.rejected, 'elapsed_s': round(elapsed, 3)}
+            runs[name] = cases
+    finally:
+        await api.server.stop()
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='发送调度器基准测试（本地模拟 Bot API）')
+    parser.add_argument('--interactive', type=int, default=200, help='交互回复条数')
+    parser.add_argument('--bulk', type=int, default=400, help='批量推送条数（每个聊天一条）')
+    parser.add_argument('--chats', type=int, default=100, help='交互回复分布的聊天数')
+    parser.add_argument('--latency', type=float, default=20, help='模拟 Bot API 处理时间（毫秒）')
+    parser.add_argument('--retry-after', type=int, default=1, help='429 响应中的 retry_after（秒）')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('BENCH_BOT_API_PORT', 18081)))
+    parser.add_argument('-o', '--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    runs = asyncio.run(run(options))
+    report.save('sender', vars(options), runs, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+午夜签到高峰基准测试
+
+在本地 PostgreSQL 上让一批用户同时调用 AsyncDatabaseManager.daily_sign_in，
+分别在逐个提交（SIGN_IN_BATCHING=0）和签到微批下运行，统计吞吐、延迟与提交的批次数。
+每轮使用一批新用户，各轮互不影响。
+
+用法（在仓库根目录）：
+    python -m benchmarks.signins
+    python -m benchmarks.signins --users 20000 --pool 4 --batch-size 1000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+from benchmarks.postgres import local_postgres
+from benchmarks import report
+
+BASE_USER_ID = 50_000_000
+
+
+async def _surge(manager, first_user: int, users: int):
+    latencies = []
+
+    async def sign_in(user_id):
+        started = time.perf_counter()
+        success, _, _ = await manager.daily_sign_in(user_id, f'user{user_id}', 'Bench')
+        latencies.append(time.perf_counter() - started)
+        return success
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(sign_in(first_user + i) for i in range(users)))
+    return latencies, sum(results), time.perf_counter() - started
+
+
+def run_case(name: str, batching: bool, first_user: int, options) -> dict:
+    from database import AsyncDatabaseManager
+
+    AsyncDatabaseManager.SIGN_IN_BATCHING = batching
+    AsyncDatabaseManager.SIGN_IN_BATCH_SIZE = options.batch_size
+    AsyncDatabaseManager.SIGN_IN_MAX_BATCHES = options.max_batches
+
+    async def run():
+        AsyncDatabaseManager.initialize()
+        try:
+            return await _surge(AsyncDatabaseManager, first_user, options.users)
+        finally:
+            await AsyncDatabaseManager.flush()
+
+    try:
+        latencies, succeeded, elapsed = asyncio.run(run())
+        batcher = AsyncDatabaseManager._sign_in_batcher
+    finally:
+        AsyncDatabaseManager.close_all_connections()
+
+    summary = report.summarize(latencies, elapsed)
+    summary.update({
+        'succeeded': succeeded,
+        'batches': batcher.batches if batcher is not None else succeeded,
+    })
+    print(f"  {name:<10} 成功 {succeeded:>6}/{options.users}  {summary['throughput']:>9} 次/秒  "
+          f"p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  "
+          f"批次 {summary['batches']:>6}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='签到高峰基准测试（本地 PostgreSQL）')
+    parser.add_argument('--users', type=int, default=5000, help='同时签到的用户数')
+    parser.add_argument('--pool', type=int, default=8, help='连接池最大连接数')
+    parser.add_argument('--batch-size', type=int, default=500, help='每批最多的用户数')
+    parser.add_argument('--max-batches', type=int, default=2, help='同时提交的批次数')
+    parser.add_argument('-o', '--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    options = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    runs = {}
+    with local_postgres() as dsn:
+        # 数据库配置在导入 database 模块时读取
+        os.environ['DATABASE_URL'] = dsn
+        os.environ.setdefault('DB_SSLMODE', 'disable')
+        os.environ['DB_POOL_MAX'] = str(options.pool)
+        # 排队的签到请求远多于连接数，逐个提交时不能因等待连接超时而失败
+        os.environ.setdefault('DB_POOL_TIMEOUT', '600')
+        print(f"🐘 {options.users} 个用户同时签到，连接池 {options.pool}")
+        for index, (name, batching) in enumerate((('single', False), ('batched', True))):
+            first_user = BASE_USER_ID + index * options.users
+            runs[name] = {'sign': run_case(name, batching, first_user, options)}
+    report.save('signins', vars(options), runs, options.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""
+多进程工作模式基准测试
+
+以 webhook 模式启动真实的 main.py（WORKERS=1 为单进程，大于 1 为主进程分发 + 工作进程），
+Bot API 指向本地模拟服务（不限流），向 webhook 并发推送一批更新，
+统计全部回复送达所需的时间，并检查同一用户的 /echo 回复顺序与发送顺序一致。
+无数据库运行，测的是更新解析、处理器、意图匹配与模板渲染等 CPU 开销随进程数的扩展情况。
+
+用法（在仓库根目录）：
+    python -m benchmarks.workers --workers 1 2 4
+    python -m benchmarks.workers --updates 20000 --users 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.sender import FakeBotAPI, TOKEN
+from benchmarks import report
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SMART_REPLY_TEXTS = ['你好', '现在几点', '今天几号', '谢谢', '今天天气怎么样', '随便说点什么']
+UNLIMITED = '1000000'
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'username': f'user{user_id}'}
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def workload(updates: int, users: int) -> list:
+    """交替发送 /echo 序号与普通消息；/echo 的回复用于检查每个用户的顺序"""
+    batch = []
+    for i in range(updates):
+        user_id = 1 + i % users
+        text = f'/echo {i}' if (i // users) % 2 == 0 else SMART_REPLY_TEXTS[i % len(SMART_REPLY_TEXTS)]
+        batch.append(make_update(i + 1, user_id, text))
+    return batch
+
+
+async def _wait_healthy(client, url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(url)).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} 在 {timeout:g} 秒内未就绪")
+
+
+def _out_of_order(api: FakeBotAPI) -> int:
+    """统计 /echo 回复序号不递增的用户数"""
+    bad = 0
+    for texts in api.messages.values():
+        sequence = [int(text.rsplit(' ', 1)[1]) for text in texts if text.startswith('🔊 回声: ')]
+        if sequence != sorted(sequence):
+            bad += 1
+    return bad
+
+
+async def run_one(api: FakeBotAPI, workers: int, options) -> dict:
+    api.delivered = 0
+    api.messages.clear()
+    env = {key: value for key, value in os.environ.items() if key != 'DATABASE_URL'}
+    env.update({
+        'TOKEN': TOKEN,
+        'BOT_MODE': 'webhook',
+        'WEBHOOK_URL': f'http://127.0.0.1:{options.ingress_port}',
+        'WEBHOOK_PATH': '/telegram',
+        'PORT': str(options.ingress_port),
+        'BOT_API_URL': api.base_url,
+        'WORKERS': str(workers),
+        # 只测处理能力：关闭发送限流与用户限流
+        'SEND_GLOBAL_RATE': UNLIMITED, 'SEND_GLOBAL_BURST': UNLIMITED,
+        'SEND_CHAT_RATE': UNLIMITED, 'SEND_CHAT_BURST': UNLIMITED,
+        'FLOOD_RATE': UNLIMITED, 'FLOOD_BURST': UNLIMITED,
+    })
+    bot = subprocess.Popen([sys.executable, 'main.py'], cwd=REPO_DIR, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    batch = workload(options.updates, options.users)
+    base = f'http://127.0.0.1:{options.ingress_port}'
+    try:
+        limits = httpx.Limits(max_connections=options.connections)
+        async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+            # HTTP 服务器先于工作进程启动，要等 /readyz 才能推送更新
+            await _wait_healthy(client, f'{base}/readyz', options.start_timeout)
+
+            started = time.perf_counter()
+
+            # 同一用户的更新固定走同一个连接，保证按发送顺序到达
+            async def post(connection):
+                for update in batch:
+                    if update['message']['from']['id'] % options.connections == connection:
+                        await client.post(f'{base}/telegram', json=update)
+
+            await asyncio.gather(*(post(connection) for connection in range(options.connections)))
+            accepted = time.perf_counter() - started
+            while api.delivered < len(batch) and time.perf_counter() - started < options.drain_timeout:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - started
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            bot.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+
+    result = {
+        'updates': len(batch),
+        'replies': api.delivered,
+        'throughput': round(api.delivered / elapsed, 1),
+        'accept_s': round(accepted, 3),
+        'elapsed_s': round(elapsed, 3),
+        'out_of_order_users': _out_of_order(api),
+        'exit_code': bot.returncode,
+    }
+    print(f"  workers={workers:<3} 回复 {result['replies']}/{result['updates']}  "
+          f"{result['throughput']:>8} 条/秒  耗时 {result['elapsed_s']:>7}s  "
+          f"乱序用户 {result['out_of_order_users']}  退出码 {result['exit_code']}")
+    return result
+
+
+async def run(options) -> dict:
+    api = FakeBotAPI(options.api_port, global_rate=10 ** 9, chat_rate=10 ** 9, latency=options.latency / 1000)
+    await api.server.start()
+    runs = {}
+    try:
+        print(f"🧪 {options.updates} 条更新，{options.users} 个用户（CPU 核数 {os.cpu_count()}）")
+        for workers in options.workers:
+            runs[f'workers={workers}'] = {'webhook': await run_one(api, workers, options)}
+    finally:
+        await api.server.stop()
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程工作模式基准测试（本地模拟 Bot API）')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='要测试的工作进程数')
+    parser.add_argument('--updates', type=int, default=5000, help='推送的更新数')
+    parser.add_argument('--users', type=int, default=500, help='模拟的用户数')
+    parser.add_argument('--connections', type=int, default=32, help='并发推送连接数')
+    parser.add_argument('--latency', type=float, default=20, help='模拟 Bot API 处理时间（毫秒）')
+    parser.add_argument('--start-timeout', type=float, default=60, help='等待机器人就绪的时间（秒）')
+    parser.add_argument('--drain-timeout', type=float, default=300, help='等待全部回复送达的时间（秒）')
+    parser.add_argument('--api-port', type=int, default=int(os.environ.get('BENCH_BOT_API_PORT', 18081)))
+    parser.add_argument('--ingress-port', type=int, default=int(os.environ.get('BENCH_INGRESS_PORT', 18080)))
+    parser.add_argument('-o', '--output', help='结果 JSON 路径（默认写入 benchmarks/results/）')
+    options = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    runs = asyncio.run(run(options))
+    # 与其他基准结果保持同样的结构，便于 report.compare
+    for cases in runs.values():
+        cases['webhook'].setdefault('p50_ms', None)
+        cases['webhook'].setdefault('p95_ms', None)
+    report.save('workers', vars(options), runs, options.output)
+
+
+if __name__ == '__main__':
+    main()
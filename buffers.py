@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class MessageBuffer:
+    """
+    消息写缓冲（write-behind）
+    消息先暂存在内存中，达到数量阈值或由定时任务触发时批量写入数据库
+    数据库不可用时整批放回缓冲区重试；因个别消息写不进去而失败时改为逐条写入，丢弃写不进去的消息
+    """
+
+    def __init__(self, flush_func, max_size: int = 200, max_pending: int = 10000, transient_errors=()):
+        # flush_func: 异步函数，接收一批消息行并负责写库
+        self._flush_func = flush_func
+        self._max_size = max_size
+        self._max_pending = max_pending
+        # 表示数据库暂时不可用的异常类型，出现时不逐条重写
+        self._transient_errors = tuple(transient_errors)
+        self._rows = []
+        # 每个用户尚未提交的消息数，包括正在写入的批次，提交或丢弃后才扣除
+        self._pending_per_user = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, telegram_id: int, chat_id: int, text: str, is_command: bool = False):
+        """加入一条消息；缓冲区满时在后台触发一次刷新"""
+        # 记录单调时钟时间，写库时换算成距今的秒数，避免应用与数据库时区不一致
+        self._rows.append((telegram_id, chat_id, text, is_command, time.monotonic()))
+        self._pending_per_user[telegram_id] = self._pending_per_user.get(telegram_id, 0) + 1
+
+        if len(self._rows) >= self._max_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def pending_count(self, telegram_id: int) -> int:
+        """某个用户尚未落库的消息数"""
+        return self._pending_per_user.get(telegram_id, 0)
+
+    def _settle(self, rows):
+        """这些消息已经提交或被丢弃，不再计入未落库条数"""
+        for row in rows:
+            left = self._pending_per_user[row[0]] - 1
+            if left:
+                self._pending_per_user[row[0]] = left
+            else:
+                del self._pending_per_user[row[0]]
+
+    def _requeue(self, rows):
+        """放回队首等待下次重试，超出上限时丢弃最旧的消息"""
+        self._rows = rows + self._rows
+        overflow = len(self._rows) - self._max_pending
+        if overflow > 0:
+            dropped, self._rows = self._rows[:overflow], self._rows[overflow:]
+            self._settle(dropped)
+            logger.warning(f"⚠️ 消息缓冲区超过 {self._max_pending} 条，丢弃最旧的 {overflow} 条消息")
+
+    async def flush(self) -> int:
+        """把缓冲区中的消息全部写入数据库，返回写入条数"""
+        async with self._flush_lock:
+            if not self._rows:
+                return 0
+
+            rows, self._rows = self._rows, []
+            try:
+                await self._flush_func(rows)
+            except self._transient_errors as e:
+                logger.error(f"❌ 批量写入消息失败，{len(rows)} 条消息放回缓冲区: {e}")
+                self._requeue(rows)
+                return 0
+            except Exception as e:
+                logger.error(f"❌ 批量写入 {len(rows)} 条消息失败，改为逐条写入: {e}")
+                return await self._flush_each(rows)
+            self._settle(rows)
+            return len(rows)
+
+    async def _flush_each(self, rows) -> int:
+        """逐条写入，写不进去的消息记录日志后丢弃，不再每次拖垮整批；数据库不可用时剩余消息放回缓冲区"""
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                await self._flush_func([row])
+            except self._transient_errors as e:
+                logger.error(f"❌ 逐条写入消息失败，剩余 {len(rows) - i} 条消息放回缓冲区: {e}")
+                self._requeue(rows[i:])
+                return written
+            except Exception as e:
+                logger.error(f"❌ 丢弃无法写入的消息（用户 {row[0]}，聊天 {row[1]}）: {e}")
+            else:
+                written += 1
+            self._settle([row])
+        return written
+
+
+class CommandCounter:
+    """
+    命令使用次数聚合器
+    按 (用户, 命令) 在内存中累加增量，定期一次性合并进数据库
+    """
+
+    def __init__(self, flush_func):
+        # flush_func: 异步函数，接收 [(telegram_id, command, count, queued_at), ...]
+        self._flush_func = flush_func
+        self._deltas = {}
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return sum(len(commands) for commands in self._deltas.values())
+
+    def increment(self, telegram_id: int, command: str):
+        """记录一次命令使用"""
+        commands = self._deltas.setdefault(telegram_id, {})
+        count, _ = commands.get(command, (0, None))
+        commands[command] = (count + 1, time.monotonic())
+
+    def pending_for_user(self, telegram_id: int) -> dict:
+        """某个用户尚未落库的增量：{command: (count, queued_at)}"""
+        return dict(self._deltas.get(telegram_id, {}))
+
+    async def flush(self) -> int:
+        """把累计的增量合并进数据库，返回合并的 (用户, 命令) 组数"""
+        async with self._flush_lock:
+            if not self._deltas:
+                return 0
+
+            deltas, self._deltas = self._deltas, {}
+            rows = [
+                (telegram_id, command, count, queued_at)
+                for telegram_id, commands in deltas.items()
+                for command, (count, queued_at) in commands.items()
+            ]
+
+            try:
+                await self._flush_func(rows)
+                return len(rows)
+            except Exception as e:
+                logger.error(f"❌ 合并命令统计失败，{len(rows)} 组增量放回内存: {e}")
+                # 与失败期间新产生的增量合并，等待下次重试
+                for telegram_id, command, count, queued_at in rows:
+                    commands = self._deltas.setdefault(telegram_id, {})
+                    new_count, new_queued_at = commands.get(command, (0, queued_at))
+                    commands[command] = (count + new_count, max(queued_at, new_queued_at))
+                return 0
+
+
+class ActivityTracker:
+    """
+    用户活跃时间合并器
+    同一用户的多次活跃只保留最近一次，定期批量更新 users.last_active
+    """
+
+    def __init__(self, flush_func):
+        # flush_func: 异步函数，接收 [(telegram_id, queued_at), ...]
+        self._flush_func = flush_func
+        self._last_seen = {}
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._last_seen)
+
+    def touch(self, telegram_id: int):
+        """记录一次活跃"""
+        self._last_seen[telegram_id] = time.monotonic()
+
+    async def flush(self) -> int:
+        """批量写入活跃时间，返回更新的用户数"""
+        async with self._flush_lock:
+            if not self._last_seen:
+                return 0
+
+            last_seen, self._last_seen = self._last_seen, {}
+            rows = list(last_seen.items())
+
+            try:
+                await self._flush_func(rows)
+                return len(rows)
+            except Exception as e:
+                logger.error(f"❌ 更新活跃时间失败，{len(rows)} 个用户放回内存: {e}")
+                for telegram_id, queued_at in rows:
+                    if telegram_id not in self._last_seen:
+                        self._last_seen[telegram_id] = queued_at
+                return 0
+
+
+class SignInBatcher:
+    """
+    签到微批处理
+    签到请求先进入内存队列，由后台任务按批提交；同时进行中的批次不超过 max_batches 个，
+    批次在途时新到的请求继续排队，下一批一次带走（最多 max_size 个用户）。
+    流量低时每个请求立即单独提交，不增加延迟；高峰时提交次数随批大小下降，
+    占用的数据库连接数固定为 max_batches。每个请求等待并拿到自己的结果
+    """
+
+    def __init__(self, commit_func, max_size: int = 500, max_batches: int = 2):
+        # commit_func: 异步函数，接收 [(telegram_id, username, first_name), ...]，
+        # 返回 {telegram_id: result}，result 含 success 与签到后的积分状态
+        self._commit_func = commit_func
+        self._max_size = max_size
+        self._max_batches = max_batches
+        # telegram_id -> (username, first_name, [future, ...])，保持到达顺序
+        self._pending = {}
+        self._running = set()
+        self.batches = 0
+        self.committed = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    async def submit(self, telegram_id: int, username: str = None, first_name: str = None) -> dict:
+        """排队等待签到，返回该用户的签到结果；所在批次失败时抛出异常"""
+        future = asyncio.get_running_loop().create_future()
+        entry = self._pending.get(telegram_id)
+        if entry is None:
+            self._pending[telegram_id] = (username, first_name, [future])
+        else:
+            entry[2].append(future)
+        self._schedule()
+        return await future
+
+    def _schedule(self):
+        while self._pending and len(self._running) < self._max_batches:
+            batch = {}
+            for telegram_id in list(self._pending)[:self._max_size]:
+                batch[telegram_id] = self._pending.pop(telegram_id)
+            task = asyncio.get_running_loop().create_task(self._commit(batch))
+            self._running.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self._running.discard(task)
+        self._schedule()
+
+    async def _commit(self, batch: dict):
+        requests = [(telegram_id, username, first_name)
+                    for telegram_id, (username, first_name, _) in batch.items()]
+        try:
+            results = await self._commit_func(requests)
+        except Exception as e:
+            for _, _, futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.committed += len(requests)
+        for telegram_id, (_, _, futures) in batch.items():
+            result = results.get(telegram_id)
+            for future in futures:
+                if future.done():
+                    continue
+                if result is None:
+                    future.set_exception(RuntimeError(f"批量签到没有返回用户 {telegram_id} 的结果"))
+                else:
+                    future.set_result(dict(result))
+                    # 同一批中同一用户的后续请求：第一次已签到成功，其余按重复签到返回
+                    result = dict(result, success=False, points_awarded=0)
@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    带过期时间的有界缓存
+    超过容量时淘汰最早写入的条目；只在事件循环线程中使用，不加锁
+    每个键有一个代号，invalidate 时递增：读取数据库前记下代号，写入时代号变了说明期间数据已变化，
+    放弃写入，避免慢的读取把旧值写回缓存
+    """
+
+    def __init__(self, ttl: float, maxsize: int = 10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        # 最近失效过的键 -> 失效时的全局序号；淘汰出去的键的代号取淘汰过的最大序号，保证只增不减
+        self._generations = OrderedDict()
+        self._tick = 0
+        self._evicted = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """读取未过期的值，不存在或已过期时返回 None"""
+        item = self._data.get(key)
+        if item is not None:
+            value, expires_at = item
+            if time.monotonic() < expires_at:
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return None
+
+    def generation(self, key) -> int:
+        """键的当前代号，在读取数据库之前取得"""
+        return self._generations.get(key, self._evicted)
+
+    def put(self, key, value, ttl: float = None, generation: int = None):
+        """写入一个值，ttl 为空时使用默认过期时间；给出 generation 时只在代号未变时写入"""
+        if generation is not None and generation != self.generation(key):
+            return
+        self._data.pop(key, None)
+        self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        """数据变化后主动失效，并使进行中的读取不再写入"""
+        self._data.pop(key, None)
+        self._tick += 1
+        self._generations.pop(key, None)
+        self._generations[key] = self._tick
+        while len(self._generations) > self.maxsize:
+            _, self._evicted = self._generations.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+        self._tick += 1
+        self._evicted = self._tick
+        self._generations.clear()
+
+
+class LRUCache:
+    """
+    有界 LRU 缓存：超过容量时淘汰最久未使用的条目
+    只在事件循环线程中使用，不加锁
+    """
+
+    def __init__(self, maxsize: int = 50000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        """读取值并标记为最近使用，不存在时返回 None"""
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+
+class VersionedCache:
+    """
+    按数据版本记忆计算结果：只保留最新版本的一份值，版本变化即视为失效
+    用于渲染好的排行榜等“数据不变则结果不变”的内容；只在事件循环线程中使用，不加锁
+    """
+
+    _MISSING = object()
+
+    def __init__(self):
+        self._version = self._MISSING
+        self._value = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, version, default=None):
+        """版本一致时返回缓存值，否则返回 default"""
+        if version == self._version:
+            self.hits += 1
+            return self._value
+        self.misses += 1
+        return default
+
+    def put(self, version, value):
+        self._version = version
+        self._value = value
+
+    def clear(self):
+        self._version = self._MISSING
+        self._value = None
@@ -0,0 +1,207 @@
+import threading
+import time
+import logging
+from collections import deque
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """等待空闲连接超时"""
+
+
+class ConnectionPool:
+    """
+    线程安全、带健康检查的 psycopg2 连接池
+    - 连接用尽时最多等待 timeout 秒，而不是立即报错
+    - 空闲超过 ping_interval 的连接取出前先 SELECT 1 探活
+    - 存活超过 max_lifetime 的连接归还时关闭重建
+    - stats() 提供占用/空闲/等待时间等统计
+    """
+
+    def __init__(self, minconn: int, maxconn: int, dsn: str, timeout: float = 5.0,
+                 max_lifetime: float = 1800.0, ping_interval: float = 30.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._dsn = dsn
+        self._connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        # 空闲连接: (conn, 最近归还时间)，后进先出，优先复用热连接
+        self._idle = deque()
+        # 所有打开的连接 -> 创建时间
+        self._created_at = {}
+        # 正在建立中的连接数（已占用名额）
+        self._opening = 0
+        self._closed = False
+
+        self._waiting = 0
+        self._wait_count = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._connections_created = 0
+        self._connections_recycled = 0
+        self._ping_failures = 0
+
+        for _ in range(minconn):
+            conn = self._connect()
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn, **self._connect_kwargs)
+        with self._cond:
+            self._created_at[conn] = time.monotonic()
+            self._connections_created += 1
+        return conn
+
+    def _discard(self, conn):
+        """关闭连接并释放名额（调用方持有锁）"""
+        self._created_at.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _expired(self, conn) -> bool:
+        return time.monotonic() - self._created_at.get(conn, 0) > self.max_lifetime
+
+    def _ping(self, conn) -> bool:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout: float = None):
+        """取出一个可用连接，超时抛出 PoolTimeout"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            candidate = None
+            reserve = False
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("连接池已关闭")
+
+                    if self._idle:
+                        candidate, returned_at = self._idle.pop()
+                        if self._expired(candidate):
+                            self._connections_recycled += 1
+                            self._discard(candidate)
+                            candidate = None
+                            continue
+                        break
+
+                    if len(self._created_at) + self._opening < self.maxconn:
+                        self._opening += 1
+                        reserve = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"等待数据库连接超时（{timeout} 秒）")
+                    if not waited:
+                        waited = True
+                        self._wait_count += 1
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if reserve:
+                try:
+                    conn = self._connect()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+                self._record_wait(started, waited)
+                return conn
+
+            # 探活在锁外进行，不阻塞其他线程
+            if time.monotonic() - returned_at > self.ping_interval and not self._ping(candidate):
+                logger.warning("⚠️ 数据库连接探活失败，已丢弃并重试")
+                with self._cond:
+                    self._ping_failures += 1
+                    self._discard(candidate)
+                continue
+
+            self._record_wait(started, waited)
+            return candidate
+
+    def _record_wait(self, started: float, waited: bool):
+        if not waited:
+            return
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._wait_time_total += elapsed
+            self._wait_time_max = max(self._wait_time_max, elapsed)
+
+    def putconn(self, conn, close: bool = False):
+        """归还连接；已断开、事务异常或超过最大存活时间的连接会被关闭"""
+        if not close and not conn.closed:
+            status = conn.info.transaction_status
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except Exception:
+                    close = True
+
+        with self._cond:
+            if self._closed or close or conn.closed:
+                self._discard(conn)
+            elif self._expired(conn):
+                self._connections_recycled += 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        """关闭所有空闲连接；借出的连接在归还时关闭"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        """连接池统计，供监控使用"""
+        with self._cond:
+            total = len(self._created_at)
+            idle = len(self._idle)
+            return {
+                'max': self.maxconn,
+                'total': total,
+                'idle': idle,
+                'in_use': total - idle,
+                'waiting': self._waiting,
+                'wait_count': self._wait_count,
+                'wait_time_total': self._wait_time_total,
+                'wait_time_max': self._wait_time_max,
+                'timeouts': self._timeouts,
+                'connections_created': self._connections_created,
+                'connections_recycled': self._connections_recycled,
+                'ping_failures': self._ping_failures,
+            }
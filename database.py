@@ -1,30 +1,153 @@
 import os
+import asyncio
+import random
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2 import errors
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError
 import logging
+import time
+from datetime import timedelta
+from buffers import MessageBuffer, CommandCounter, ActivityTracker, SignInBatcher
+from leaderboard import LeaderboardIndex
+from signhistory import SignInHistory
+from cache import TTLCache, LRUCache
+from connection_pool import ConnectionPool, PoolTimeout
+from metrics import REGISTRY, CallbackMetric, Histogram, DB_QUERY_DURATION, record_db_time
 
 logger = logging.getLogger(__name__)
 
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """记录本连接上已经 PREPARE 过的语句名；重连后是新对象，自然为空"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+class StatementRegistry:
+    """
+    热点 SQL 的服务端预处理语句注册表
+    每个连接第一次执行某条语句时 PREPARE，之后按名字 EXECUTE，省去数据库的解析与规划
+    事务模式的连接池（如 PgBouncer transaction 模式）不保留会话状态，需关闭后直接执行原始 SQL
+    """
+    
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        # 语句名 -> (PREPARE 用的 SQL, 参数个数)
+        self._statements = {}
+    
+    @staticmethod
+    def _to_positional(sql: str):
+        """把 psycopg2 的 %s 占位符依次改写成 $1, $2, ..."""
+        parts = sql.split('%s')
+        positional = parts[0] + ''.join(f'${i}{part}' for i, part in enumerate(parts[1:], start=1))
+        return positional, len(parts) - 1
+    
+    def execute(self, cursor, name: str, sql: str, params=()):
+        """
+        按名字执行 sql；未启用或连接不支持时退回普通执行
+        服务端会话被重置（DISCARD ALL 等）导致语句不存在时，回滚这一条语句后重新 PREPARE 并重试一次：
+        执行前没有进行中的事务时直接回滚整个事务；事务中途则在同一次请求里先建保存点，只回滚到保存点
+        """
+        conn = cursor.connection
+        prepared = getattr(conn, 'prepared_statements', None)
+        if not self.enabled or prepared is None:
+            cursor.execute(sql, params)
+            return
+        
+        statement = self._statements.get(name)
+        if statement is None:
+            statement = self._statements[name] = self._to_positional(sql)
+        positional_sql, param_count = statement
+        
+        idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        savepoint = '' if idle else 'SAVEPOINT statement_retry; '
+        if param_count:
+            execute_sql = f"{savepoint}EXECUTE {name} ({', '.join(['%s'] * param_count)})"
+        else:
+            execute_sql = f"{savepoint}EXECUTE {name}"
+        
+        for retry in (False, True):
+            if name not in prepared:
+                cursor.execute(f"PREPARE {name} AS {positional_sql}")
+                prepared.add(name)
+            try:
+                cursor.execute(execute_sql, params)
+                return
+            except errors.InvalidSqlStatementName:
+                # 本连接上的预处理语句都已失效
+                prepared.clear()
+                if retry:
+                    raise
+                if idle:
+                    conn.rollback()
+                else:
+                    cursor.execute("ROLLBACK TO SAVEPOINT statement_retry")
+                logger.warning(f"⚠️ 预处理语句 {name} 已失效，重新 PREPARE 后重试")
+
+
 class DatabaseManager:
     _connection_pool = None
+    _statements = StatementRegistry(
+        enabled=os.environ.get('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+    )
+    
+    # 物化排行榜刷新使用的 advisory lock，保证多个实例同一时间只有一个在刷新
+    LEADERBOARD_REFRESH_LOCK = 0x6C6472
+    # 分区维护使用的 advisory lock
+    PARTITION_MAINTENANCE_LOCK = 0x707274
+    # 建表脚本使用的 advisory lock，多个实例同时启动时依次执行 DDL
+    SCHEMA_LOCK = 0x736368
+    
+    # 全局计数器的分片行数：写入分散到多行，读取时求和
+    BOT_COUNTER_SHARDS = max(1, int(os.environ.get('BOT_COUNTER_SHARDS', 16)))
+    
+    # 消息分区：提前建好的月份数；保留月数为 0 表示永久保留
+    PARTITION_PREMAKE_MONTHS = int(os.environ.get('PARTITION_PREMAKE_MONTHS', 3))
+    MESSAGE_RETENTION_MONTHS = int(os.environ.get('MESSAGE_RETENTION_MONTHS', 0))
+    
+    # 连接池大小（异步层的线程数与最大连接数保持一致）
+    POOL_MIN_CONN = int(os.environ.get('DB_POOL_MIN', 1))
+    POOL_MAX_CONN = int(os.environ.get('DB_POOL_MAX', 20))
+    # 连接用尽时的最长等待时间、连接最大存活时间、空闲多久后取出前探活（秒）
+    POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    POOL_MAX_LIFETIME = float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800))
+    POOL_PING_INTERVAL = float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+    # 线上数据库要求 SSL；本地基准测试的临时数据库可设为 disable
+    SSL_MODE = os.environ.get('DB_SSLMODE', 'require')
+    # 连接类；查询基准测试会替换为记录 SQL 的子类
+    CONNECTION_FACTORY = PreparedConnection
     
     @classmethod
-    def initialize(cls):
-        """初始化数据库连接池"""
+    def initialize(cls, init_schema: bool = True):
+        """
+        初始化数据库连接池
+        init_schema 为 False 时不执行建表脚本（多进程时只由 0 号工作进程执行）
+        """
         try:
             database_url = os.environ.get('DATABASE_URL')
             if not database_url:
                 raise ValueError("DATABASE_URL环境变量未设置")
             
             # 解析Railway的DATABASE_URL
-            cls._connection_pool = psycopg2.pool.SimpleConnectionPool(
-                1, 20, database_url, sslmode='require'
+            # 异步层会在多个线程中并发取用连接，必须使用线程安全的连接池
+            cls._connection_pool = ConnectionPool(
+                cls.POOL_MIN_CONN, cls.POOL_MAX_CONN, database_url,
+                timeout=cls.POOL_TIMEOUT,
+                max_lifetime=cls.POOL_MAX_LIFETIME,
+                ping_interval=cls.POOL_PING_INTERVAL,
+                sslmode=cls.SSL_MODE,
+                connection_factory=cls.CONNECTION_FACTORY
             )
             logger.info("✅ 数据库连接池初始化成功")
             
             # 初始化表
-            cls._init_tables()
+            if init_schema:
+                cls._init_tables()
             
         except Exception as e:
             logger.error(f"❌ 数据库初始化失败: {e}")
@@ -48,15 +171,106 @@ class DatabaseManager:
             message_count INT DEFAULT 0
         );
         
-        -- 消息历史表
+        -- 消息历史表（按 created_at 月度分区，过期数据整分区删除）
+        -- 旧版本的非分区 messages 表改名为 messages_legacy，稍后作为历史分区挂载，无需搬迁数据
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_class 
+                       WHERE oid = to_regclass('messages') AND relkind = 'r') THEN
+                ALTER TABLE messages RENAME TO messages_legacy;
+                ALTER TABLE messages_legacy RENAME CONSTRAINT messages_pkey TO messages_legacy_pkey;
+                ALTER INDEX IF EXISTS idx_messages_user_id RENAME TO idx_messages_legacy_user_id;
+                ALTER INDEX IF EXISTS idx_messages_created_at RENAME TO idx_messages_legacy_created_at;
+                -- 序列继续给新表使用，不能随旧分区一起被删除
+                ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+                -- 分区键不能为空
+                UPDATE messages_legacy SET created_at = 'epoch' WHERE created_at IS NULL;
+                ALTER TABLE messages_legacy ALTER COLUMN created_at SET NOT NULL;
+            END IF;
+        END;
+        $$;
+        
+        CREATE SEQUENCE IF NOT EXISTS messages_id_seq;
+        
         CREATE TABLE IF NOT EXISTS messages (
-            id SERIAL PRIMARY KEY,
+            id INT NOT NULL DEFAULT nextval('messages_id_seq'),
             user_id BIGINT REFERENCES users(telegram_id) ON DELETE CASCADE,
             chat_id BIGINT NOT NULL,
             text TEXT,
             is_command BOOLEAN DEFAULT FALSE,
-            created_at TIMESTAMP DEFAULT NOW()
-        );
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+        
+        -- 旧数据覆盖到本月底，本月之后的数据进入新的月度分区
+        DO $$
+        BEGIN
+            IF to_regclass('messages_legacy') IS NOT NULL 
+               AND NOT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass('messages_legacy')) THEN
+                EXECUTE format(
+                    'ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+                    date_trunc('month', NOW()) + INTERVAL '1 month'
+                );
+            END IF;
+        END;
+        $$;
+        
+        -- 预建未来的月度分区：分区名形如 messages_202610
+        CREATE OR REPLACE FUNCTION ensure_monthly_partitions(p_parent TEXT, p_months_ahead INT)
+        RETURNS INT
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            v_month DATE := date_trunc('month', CURRENT_DATE);
+            v_name TEXT;
+            v_created INT := 0;
+        BEGIN
+            FOR i IN 0..p_months_ahead LOOP
+                v_name := p_parent || '_' || to_char(v_month, 'YYYYMM');
+                IF to_regclass(v_name) IS NULL THEN
+                    BEGIN
+                        EXECUTE format(
+                            'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                            v_name, p_parent, v_month, v_month + INTERVAL '1 month'
+                        );
+                        v_created := v_created + 1;
+                    EXCEPTION
+                        -- 该月已被其他分区（如 messages_legacy）覆盖，或其他实例刚刚建好
+                        WHEN invalid_object_definition OR duplicate_table THEN
+                            NULL;
+                    END;
+                END IF;
+                v_month := v_month + INTERVAL '1 month';
+            END LOOP;
+            RETURN v_created;
+        END;
+        $$;
+        
+        -- 分离并删除上界早于保留期的分区（元数据操作，不产生大量 DELETE）
+        CREATE OR REPLACE FUNCTION drop_expired_partitions(p_parent TEXT, p_retention_months INT)
+        RETURNS INT
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            v_cutoff TIMESTAMP := date_trunc('month', CURRENT_DATE) - make_interval(months => p_retention_months);
+            v_upper TIMESTAMP;
+            v_dropped INT := 0;
+            r RECORD;
+        BEGIN
+            FOR r IN
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) as bound
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = p_parent::regclass
+            LOOP
+                v_upper := substring(r.bound FROM 'TO \(''([^'']+)''\)')::timestamp;
+                IF v_upper IS NOT NULL AND v_upper <= v_cutoff THEN
+                    EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', p_parent, r.relname);
+                    EXECUTE format('DROP TABLE %I', r.relname);
+                    v_dropped := v_dropped + 1;
+                END IF;
+            END LOOP;
+            RETURN v_dropped;
+        END;
+        $$;
         
         -- 用户统计表
         CREATE TABLE IF NOT EXISTS user_stats (
@@ -68,6 +282,29 @@ class DatabaseManager:
             updated_at TIMESTAMP DEFAULT NOW()
         );
         
+        -- 命令统计表：每个用户每个命令一行，支持任意命令
+        CREATE TABLE IF NOT EXISTS command_stats (
+            user_id BIGINT NOT NULL REFERENCES users(telegram_id) ON DELETE CASCADE,
+            command VARCHAR(50) NOT NULL,
+            use_count INT NOT NULL DEFAULT 0,
+            last_used_at TIMESTAMP DEFAULT NOW(),
+            PRIMARY KEY (user_id, command)
+        );
+        
+        -- 迁移旧版 user_stats 中固定三列的计数：只在 command_stats 还是空表、user_stats 有数据时执行一次
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM command_stats) AND EXISTS (SELECT 1 FROM user_stats) THEN
+                INSERT INTO command_stats (user_id, command, use_count, last_used_at)
+                SELECT user_id, c.command, c.use_count, updated_at
+                FROM user_stats,
+                     LATERAL (VALUES ('/start', start_count), ('/help', help_count), ('/ping', ping_count)) AS c(command, use_count)
+                WHERE c.use_count > 0
+                ON CONFLICT (user_id, command) DO NOTHING;
+            END IF;
+        END;
+        $$;
+        
         -- ========== 新增积分相关表 ==========
         -- 积分记录表：记录所有积分变动
         CREATE TABLE IF NOT EXISTS points_history (
@@ -100,6 +337,60 @@ class DatabaseManager:
             UNIQUE(user_id, sign_date)  -- 确保每天只能有一条记录
         );
         
+        -- 签到历史位图：最右一位是 sign_in_bits_end 当天，往左每一位早一天，1 表示签到过
+        -- 与 daily_sign_ins 同步维护，连续天数、日历、今日是否已签到都从这一行得到
+        ALTER TABLE user_points 
+            ADD COLUMN IF NOT EXISTS sign_in_bits VARBIT,
+            ADD COLUMN IF NOT EXISTS sign_in_bits_end DATE;
+        
+        -- 在位图末尾追加 p_day 这一天（中间没签到的日子补 0）
+        CREATE OR REPLACE FUNCTION sign_in_bits_append(p_bits VARBIT, p_end DATE, p_day DATE)
+        RETURNS VARBIT
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT CASE
+                WHEN p_bits IS NULL OR p_end IS NULL THEN B'1'
+                WHEN p_day <= p_end THEN p_bits
+                ELSE p_bits || repeat('0', p_day - p_end - 1)::varbit || B'1'
+            END
+        $$;
+        
+        -- 截至位图最后一天的连续签到天数（末尾连续 1 的个数）
+        CREATE OR REPLACE FUNCTION sign_in_bits_streak(p_bits VARBIT)
+        RETURNS INT
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT COALESCE(length(p_bits) - length(rtrim(p_bits::text, '1')), 0)
+        $$;
+        
+        -- 从 daily_sign_ins 重建还没有位图的用户（升级前的数据、批量导入的数据），返回处理的用户数
+        CREATE OR REPLACE FUNCTION backfill_sign_in_bits()
+        RETURNS INT
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            v_users INT;
+        BEGIN
+            UPDATE user_points up
+            SET sign_in_bits = h.bits, sign_in_bits_end = h.last_date
+            FROM (
+                SELECT 
+                    r.user_id,
+                    r.last_date,
+                    string_agg(CASE WHEN d.user_id IS NULL THEN '0' ELSE '1' END, '' ORDER BY g.day)::varbit as bits
+                FROM (
+                    SELECT d.user_id, MIN(d.sign_date) as first_date, MAX(d.sign_date) as last_date
+                    FROM daily_sign_ins d
+                    JOIN user_points p ON p.user_id = d.user_id AND p.sign_in_bits IS NULL
+                    GROUP BY d.user_id
+                ) r
+                CROSS JOIN LATERAL generate_series(r.first_date, r.last_date, INTERVAL '1 day') AS g(day)
+                LEFT JOIN daily_sign_ins d ON d.user_id = r.user_id AND d.sign_date = g.day::date
+                GROUP BY r.user_id, r.last_date
+            ) h
+            WHERE up.user_id = h.user_id;
+            GET DIAGNOSTICS v_users = ROW_COUNT;
+            RETURN v_users;
+        END;
+        $$;
+        
         -- ========== 创建索引 ==========
         CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages(user_id);
         CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages(created_at);
@@ -125,13 +416,345 @@ class DatabaseManager:
              AND dsi.sign_date = CURRENT_DATE) as signed_in_today
         FROM users u
         LEFT JOIN user_points up ON u.telegram_id = up.user_id;
+        
+        -- ========== 全局计数器：/admin 常数时间读取 ==========
+        CREATE TABLE IF NOT EXISTS bot_counters (
+            id INT PRIMARY KEY DEFAULT 1,
+            total_users BIGINT NOT NULL DEFAULT 0,
+            total_messages BIGINT NOT NULL DEFAULT 0,
+            total_commands BIGINT NOT NULL DEFAULT 0,
+            last_message_time TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT NOW()
+        );
+        
+        -- 只在计数器行不存在时（首次部署）从现有数据统计一次，之后由写路径增量维护
+        INSERT INTO bot_counters (id, total_users, total_messages, total_commands, last_message_time)
+        SELECT 
+            1,
+            (SELECT COUNT(*) FROM users),
+            COUNT(*),
+            COUNT(*) FILTER (WHERE is_command),
+            MAX(created_at)
+        FROM messages
+        WHERE NOT EXISTS (SELECT 1 FROM bot_counters)
+        ON CONFLICT (id) DO NOTHING;
+        
+        -- 计数器拆成多行分片，并发写入分散到不同的行上，读取时求和；旧版本只允许 id = 1 一行
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_constraint
+                       WHERE conrelid = 'bot_counters'::regclass AND conname = 'bot_counters_id_check') THEN
+                ALTER TABLE bot_counters DROP CONSTRAINT bot_counters_id_check;
+            END IF;
+        END;
+        $$;
+        
+        INSERT INTO bot_counters (id)
+        SELECT generate_series(1, BOT_COUNTER_SHARDS)
+        ON CONFLICT (id) DO NOTHING;
+        
+        -- 用户数由触发器维护：users 的所有写入路径（/start、签到、管理员调整）都会经过
+        -- 按用户 ID 选择分片，同时注册的用户不会争用同一行
+        CREATE OR REPLACE FUNCTION bot_counters_track_users() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE bot_counters 
+                SET total_users = total_users + 1,
+                    updated_at = NOW()
+                WHERE id = 1 + abs(NEW.telegram_id) % BOT_COUNTER_SHARDS;
+            ELSE
+                UPDATE bot_counters 
+                SET total_users = total_users - 1,
+                    updated_at = NOW()
+                WHERE id = 1 + abs(OLD.telegram_id) % BOT_COUNTER_SHARDS;
+            END IF;
+            RETURN NULL;
+        END;
+        $$;
+        
+        -- 触发器只在不存在时创建：DROP/CREATE TRIGGER 会对 users 加 ACCESS EXCLUSIVE 锁
+        DO $$
+        BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_trigger
+                           WHERE tgrelid = 'users'::regclass AND tgname = 'trg_users_bot_counters') THEN
+                CREATE TRIGGER trg_users_bot_counters
+                    AFTER INSERT OR DELETE ON users
+                    FOR EACH ROW EXECUTE FUNCTION bot_counters_track_users();
+            END IF;
+        END;
+        $$;
+        
+        -- ========== 物化排行榜：多实例部署时共享的预计算排名 ==========
+        -- 旧版本在每一行带 refreshed_at，每次刷新都会改写整个视图；重建为不带该列的版本
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_attribute 
+                       WHERE attrelid = to_regclass('leaderboard_ranks') 
+                       AND attname = 'refreshed_at' AND NOT attisdropped) THEN
+                DROP MATERIALIZED VIEW leaderboard_ranks;
+            END IF;
+        END;
+        $$;
+        
+        -- rank 为同分同名次的排名，position 为排行榜上的位置
+        CREATE MATERIALIZED VIEW IF NOT EXISTS leaderboard_ranks AS
+        SELECT 
+            up.user_id,
+            u.username,
+            u.first_name,
+            up.total_points,
+            up.sign_in_count,
+            up.sign_in_streak,
+            up.last_sign_in,
+            RANK() OVER (ORDER BY up.total_points DESC) as rank,
+            ROW_NUMBER() OVER (ORDER BY up.total_points DESC, up.sign_in_streak DESC, up.user_id) as position
+        FROM user_points up
+        JOIN users u ON up.user_id = u.telegram_id;
+        
+        -- 最近一次刷新的时间，与 REFRESH 在同一事务中更新；视图行不变时 CONCURRENTLY 刷新不改写它们
+        CREATE TABLE IF NOT EXISTS leaderboard_refresh (
+            id INT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+            refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+        INSERT INTO leaderboard_refresh (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
+        
+        -- CONCURRENTLY 刷新需要唯一索引
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_leaderboard_ranks_user_id ON leaderboard_ranks(user_id);
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_ranks_position ON leaderboard_ranks(position);
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_ranks_points ON leaderboard_ranks(total_points);
+        
+        -- ========== 签到函数：一次调用完成整个签到流程 ==========
+        -- daily_sign_ins 的唯一约束负责并发去重：同一用户同时签到时，
+        -- 后到的 INSERT 会等待先到的事务提交，然后 DO NOTHING 返回“已签到”
+        CREATE OR REPLACE FUNCTION sign_in_user(
+            p_user_id BIGINT,
+            p_username VARCHAR,
+            p_first_name VARCHAR,
+            p_with_rank BOOLEAN DEFAULT TRUE
+        )
+        RETURNS TABLE (
+            success BOOLEAN,
+            points_awarded INT,
+            current_streak INT,
+            total_points INT,
+            sign_in_count INT,
+            last_sign_in TIMESTAMP,
+            rank BIGINT
+        )
+        LANGUAGE plpgsql AS $$
+        #variable_conflict use_column
+        DECLARE
+            v_streak INT;
+            v_bonus INT;
+            v_total INT;
+        BEGIN
+            -- 1. 确保用户存在于users表（资料未变化时不改写行，活跃时间由应用批量更新）
+            INSERT INTO users (telegram_id, username, first_name, last_active)
+            VALUES (p_user_id, p_username, p_first_name, NOW())
+            ON CONFLICT (telegram_id) 
+            DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_active = NOW()
+            WHERE users.username IS DISTINCT FROM EXCLUDED.username
+               OR users.first_name IS DISTINCT FROM EXCLUDED.first_name;
+            
+            -- 2. 计算连续签到天数（位图最后一天是昨天则在其末尾的连续天数上加一）
+            SELECT CASE WHEN up.sign_in_bits_end = CURRENT_DATE - 1 
+                        THEN sign_in_bits_streak(up.sign_in_bits) + 1 ELSE 1 END INTO v_streak
+            FROM user_points up WHERE up.user_id = p_user_id;
+            v_streak := COALESCE(v_streak, 1);
+            
+            -- 3. 连续签到奖励规则：连续3天额外1分，连续7天额外2分
+            v_bonus := CASE WHEN v_streak >= 7 THEN 2 WHEN v_streak >= 3 THEN 1 ELSE 0 END;
+            
+            -- 4. 插入签到记录，今天已签到则什么也不做
+            INSERT INTO daily_sign_ins (user_id, sign_date, points_awarded)
+            VALUES (p_user_id, CURRENT_DATE, 1 + v_bonus)
+            ON CONFLICT (user_id, sign_date) DO NOTHING;
+            
+            IF FOUND THEN
+                success := TRUE;
+                points_awarded := 1 + v_bonus;
+                
+                INSERT INTO points_history (user_id, points_change, reason, description)
+                VALUES (
+                    p_user_id,
+                    1 + v_bonus,
+                    CASE WHEN v_bonus > 0 THEN 'sign_in_streak_' || v_streak ELSE 'sign_in' END,
+                    '每日签到' || CASE WHEN v_bonus > 0 THEN '（连续' || v_streak || '天奖励+' || v_bonus || '）' ELSE '' END
+                );
+                
+                INSERT INTO user_points (user_id, total_points, sign_in_count, last_sign_in, sign_in_streak, max_streak,
+                                         sign_in_bits, sign_in_bits_end)
+                VALUES (p_user_id, 1 + v_bonus, 1, NOW(), v_streak, v_streak, B'1', CURRENT_DATE)
+                ON CONFLICT (user_id) 
+                DO UPDATE SET
+                    total_points = user_points.total_points + EXCLUDED.total_points,
+                    sign_in_count = user_points.sign_in_count + 1,
+                    last_sign_in = NOW(),
+                    sign_in_streak = EXCLUDED.sign_in_streak,
+                    max_streak = GREATEST(user_points.max_streak, EXCLUDED.sign_in_streak),
+                    sign_in_bits = sign_in_bits_append(user_points.sign_in_bits, user_points.sign_in_bits_end, CURRENT_DATE),
+                    sign_in_bits_end = CURRENT_DATE,
+                    updated_at = NOW();
+            ELSE
+                success := FALSE;
+                points_awarded := 0;
+            END IF;
+            
+            -- 5. 返回签到后的积分状态
+            SELECT COALESCE(up.total_points, 0), COALESCE(up.sign_in_streak, 0),
+                   COALESCE(up.sign_in_count, 0), up.last_sign_in
+            INTO total_points, current_streak, sign_in_count, last_sign_in
+            FROM (SELECT 1) AS one
+            LEFT JOIN user_points up ON up.user_id = p_user_id;
+            
+            IF p_with_rank THEN
+                v_total := total_points;
+                SELECT COUNT(*) + 1 INTO rank
+                FROM user_points up WHERE up.total_points > v_total;
+            END IF;
+            
+            RETURN NEXT;
+        END;
+        $$;
+
+        -- ========== 批量签到函数：一次调用为一批用户签到（签到高峰时使用） ==========
+        -- 规则与 sign_in_user 相同，每张表只执行一条多行语句；p_user_ids 中不能有重复的用户
+        -- 按 user_id 顺序加锁，多个批次并发提交时不会互相死锁
+        CREATE OR REPLACE FUNCTION sign_in_users_batch(
+            p_user_ids BIGINT[],
+            p_usernames VARCHAR[],
+            p_first_names VARCHAR[]
+        )
+        RETURNS TABLE (
+            user_id BIGINT,
+            success BOOLEAN,
+            points_awarded INT,
+            current_streak INT,
+            total_points INT,
+            sign_in_count INT,
+            last_sign_in TIMESTAMP
+        )
+        LANGUAGE plpgsql AS $$
+        #variable_conflict use_column
+        DECLARE
+            v_ids BIGINT[];
+            v_points_awarded INT[];
+            v_streaks INT[];
+            v_totals INT[];
+            v_counts INT[];
+            v_last_sign_ins TIMESTAMP[];
+        BEGIN
+            -- 1. 确保用户存在（资料未变化的用户不改写行）
+            INSERT INTO users (telegram_id, username, first_name, last_active)
+            SELECT b.user_id, b.username, b.first_name, NOW()
+            FROM unnest(p_user_ids, p_usernames, p_first_names) AS b(user_id, username, first_name)
+            ORDER BY b.user_id
+            ON CONFLICT (telegram_id)
+            DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_active = NOW()
+            WHERE users.username IS DISTINCT FROM EXCLUDED.username
+               OR users.first_name IS DISTINCT FROM EXCLUDED.first_name;
+
+            -- 2. 连续天数与奖励 → 3. 签到记录（今天已签到的用户被 DO NOTHING 跳过）
+            -- → 4. 积分记录与积分汇总只针对真正插入了签到记录的用户，签到后的状态先收集到数组里
+            WITH batch AS (
+                SELECT
+                    b.user_id,
+                    s.streak,
+                    CASE WHEN s.streak >= 7 THEN 2 WHEN s.streak >= 3 THEN 1 ELSE 0 END as bonus
+                FROM unnest(p_user_ids) AS b(user_id)
+                LEFT JOIN user_points up ON up.user_id = b.user_id
+                CROSS JOIN LATERAL (
+                    SELECT CASE WHEN up.sign_in_bits_end = CURRENT_DATE - 1 
+                                THEN sign_in_bits_streak(up.sign_in_bits) + 1 ELSE 1 END as streak
+                ) s
+            ),
+            signed AS (
+                INSERT INTO daily_sign_ins (user_id, sign_date, points_awarded)
+                SELECT user_id, CURRENT_DATE, 1 + bonus FROM batch ORDER BY user_id
+                ON CONFLICT (user_id, sign_date) DO NOTHING
+                RETURNING user_id
+            ),
+            awarded AS (
+                SELECT b.* FROM batch b JOIN signed s ON s.user_id = b.user_id
+            ),
+            history AS (
+                INSERT INTO points_history (user_id, points_change, reason, description)
+                SELECT
+                    user_id,
+                    1 + bonus,
+                    CASE WHEN bonus > 0 THEN 'sign_in_streak_' || streak ELSE 'sign_in' END,
+                    '每日签到' || CASE WHEN bonus > 0 THEN '（连续' || streak || '天奖励+' || bonus || '）' ELSE '' END
+                FROM awarded
+            ),
+            totals AS (
+                INSERT INTO user_points (user_id, total_points, sign_in_count, last_sign_in, sign_in_streak, max_streak,
+                                         sign_in_bits, sign_in_bits_end)
+                SELECT user_id, 1 + bonus, 1, NOW(), streak, streak, B'1', CURRENT_DATE FROM awarded ORDER BY user_id
+                ON CONFLICT (user_id)
+                DO UPDATE SET
+                    total_points = user_points.total_points + EXCLUDED.total_points,
+                    sign_in_count = user_points.sign_in_count + 1,
+                    last_sign_in = NOW(),
+                    sign_in_streak = EXCLUDED.sign_in_streak,
+                    max_streak = GREATEST(user_points.max_streak, EXCLUDED.sign_in_streak),
+                    sign_in_bits = sign_in_bits_append(user_points.sign_in_bits, user_points.sign_in_bits_end, CURRENT_DATE),
+                    sign_in_bits_end = CURRENT_DATE,
+                    updated_at = NOW()
+                RETURNING user_id, total_points, sign_in_count, last_sign_in, sign_in_streak
+            )
+            SELECT
+                array_agg(t.user_id),
+                array_agg(1 + a.bonus),
+                array_agg(t.sign_in_streak),
+                array_agg(t.total_points),
+                array_agg(t.sign_in_count),
+                array_agg(t.last_sign_in)
+            INTO v_ids, v_points_awarded, v_streaks, v_totals, v_counts, v_last_sign_ins
+            FROM totals t
+            JOIN awarded a ON a.user_id = t.user_id;
+
+            RETURN QUERY
+            SELECT s.user_id, TRUE, s.points_awarded, s.streak, s.total_points, s.sign_in_count, s.last_sign_in
+            FROM unnest(v_ids, v_points_awarded, v_streaks, v_totals, v_counts, v_last_sign_ins)
+                AS s(user_id, points_awarded, streak, total_points, sign_in_count, last_sign_in);
+
+            -- 5. 今天已签到的用户另起一条语句读取：上面语句的快照看不到与它并发提交的签到，
+            -- 那些用户在 daily_sign_ins 上冲突被跳过，读原表却会得到签到前的状态
+            RETURN QUERY
+            SELECT
+                b.user_id,
+                FALSE,
+                0,
+                COALESCE(up.sign_in_streak, 0),
+                COALESCE(up.total_points, 0),
+                COALESCE(up.sign_in_count, 0),
+                up.last_sign_in
+            FROM unnest(p_user_ids) AS b(user_id)
+            LEFT JOIN user_points up ON up.user_id = b.user_id
+            WHERE b.user_id <> ALL (COALESCE(v_ids, '{}'));
+        END;
+        $$;
         """
         
         conn = cls.get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(create_tables_sql)
+            # 事务级锁，提交或回滚时自动释放
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (cls.SCHEMA_LOCK,))
+            cursor.execute(create_tables_sql.replace('BOT_COUNTER_SHARDS', str(cls.BOT_COUNTER_SHARDS)))
+            cursor.execute("SELECT ensure_monthly_partitions('messages', %s)", (cls.PARTITION_PREMAKE_MONTHS,))
+            cursor.execute("SELECT backfill_sign_in_bits()")
+            backfilled = cursor.fetchone()[0]
             conn.commit()
+            if backfilled:
+                logger.info(f"✅ 已为 {backfilled} 个用户重建签到位图")
             logger.info("✅ 数据库表初始化成功（包含积分表）")
         except Exception as e:
             logger.error(f"❌ 创建积分表失败: {e}")
@@ -142,9 +765,9 @@ class DatabaseManager:
     
     @classmethod
     def get_connection(cls):
-        """从连接池获取连接"""
+        """从连接池获取连接（连接用尽时最多等待 POOL_TIMEOUT 秒）"""
         if cls._connection_pool is None:
-            cls.initialize()
+            raise RuntimeError("数据库连接池尚未初始化")
         return cls._connection_pool.getconn()
     
     @classmethod
@@ -153,6 +776,28 @@ class DatabaseManager:
         if cls._connection_pool:
             cls._connection_pool.putconn(conn)
     
+    @classmethod
+    def pool_stats(cls):
+        """连接池统计（占用、空闲、等待次数与时间等）"""
+        if cls._connection_pool is None:
+            return None
+        return cls._connection_pool.stats()
+    
+    @classmethod
+    def ping(cls, timeout: float = 2.0) -> bool:
+        """就绪检查：能否在 timeout 秒内取得连接并执行 SELECT 1"""
+        if cls._connection_pool is None:
+            return False
+        conn = cls._connection_pool.getconn(timeout=timeout)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            conn.rollback()
+            return True
+        finally:
+            cls.return_connection(conn)
+    
     @classmethod
     def close_all_connections(cls):
         """关闭所有连接"""
@@ -163,7 +808,7 @@ class DatabaseManager:
     # 用户相关操作
     @classmethod
     def save_user(cls, user_data: dict):
-        """保存或更新用户信息"""
+        """保存或更新用户信息（资料没有变化时不改写行，避免产生死元组）"""
         sql = """
         INSERT INTO users 
             (telegram_id, username, first_name, last_name, language_code, is_bot, last_active)
@@ -174,13 +819,16 @@ class DatabaseManager:
             first_name = EXCLUDED.first_name,
             last_name = EXCLUDED.last_name,
             last_active = NOW()
+        WHERE users.username IS DISTINCT FROM EXCLUDED.username
+           OR users.first_name IS DISTINCT FROM EXCLUDED.first_name
+           OR users.last_name IS DISTINCT FROM EXCLUDED.last_name
         RETURNING id;
         """
         
         conn = cls.get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(sql, (
+            cls._statements.execute(cursor, 'save_user', sql, (
                 user_data['id'],
                 user_data.get('username'),
                 user_data.get('first_name'),
@@ -188,8 +836,14 @@ class DatabaseManager:
                 user_data.get('language_code'),
                 user_data.get('is_bot', False)
             ))
+            result = cursor.fetchone()
+            if result is None:
+                # 资料未变化，没有发生写入
+                cls._statements.execute(cursor, 'get_user_id', 
+                                        "SELECT id FROM users WHERE telegram_id = %s", (user_data['id'],))
+                result = cursor.fetchone()
             conn.commit()
-            return cursor.fetchone()[0]
+            return result[0]
         finally:
             cls.return_connection(conn)
     
@@ -215,33 +869,139 @@ class DatabaseManager:
         finally:
             cls.return_connection(conn)
     
+    @classmethod
+    def save_messages_batch(cls, rows: list):
+        """
+        批量保存消息记录，并按用户聚合更新消息计数（一次提交）
+        rows: [(telegram_id, chat_id, text, is_command, age_seconds), ...]
+        age_seconds 为消息产生距今的秒数，created_at 以数据库时间换算
+        """
+        if not rows:
+            return 0
+        
+        # 不存在于 users 表的用户会被外键拒绝，这里直接过滤掉，避免整批失败
+        # 同一条语句里按实际写入的行更新全局计数器，随机选一个分片行，避免并发刷写排队等同一行锁
+        insert_sql = """
+        WITH inserted AS (
+            INSERT INTO messages (user_id, chat_id, text, is_command, created_at)
+            SELECT v.user_id, v.chat_id, v.text, v.is_command, NOW() - v.age * INTERVAL '1 second'
+            FROM (VALUES %s) AS v(user_id, chat_id, text, is_command, age)
+            JOIN users u ON u.telegram_id = v.user_id
+            RETURNING is_command, created_at
+        )
+        UPDATE bot_counters 
+        SET total_messages = total_messages + (SELECT COUNT(*) FROM inserted),
+            total_commands = total_commands + (SELECT COUNT(*) FROM inserted WHERE is_command),
+            last_message_time = GREATEST(last_message_time, (SELECT MAX(created_at) FROM inserted)),
+            updated_at = NOW()
+        WHERE id = COUNTER_SHARD
+        """.replace('COUNTER_SHARD', str(random.randint(1, cls.BOT_COUNTER_SHARDS)))
+        
+        update_sql = """
+        UPDATE users 
+        SET message_count = users.message_count + v.cnt,
+            last_active = GREATEST(users.last_active, NOW() - v.age * INTERVAL '1 second')
+        FROM (VALUES %s) AS v(telegram_id, cnt, age)
+        WHERE users.telegram_id = v.telegram_id
+        """
+        
+        # 每个用户只更新一次：累计条数，最近一条消息的时间
+        per_user = {}
+        for telegram_id, _, _, _, age in rows:
+            cnt, min_age = per_user.get(telegram_id, (0, age))
+            per_user[telegram_id] = (cnt + 1, min(min_age, age))
+        user_rows = [(telegram_id, cnt, age) for telegram_id, (cnt, age) in per_user.items()]
+        
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            execute_values(cursor, insert_sql, rows, page_size=len(rows))
+            execute_values(cursor, update_sql, user_rows, page_size=len(user_rows))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def touch_users(cls, rows: list):
+        """
+        批量更新用户最后活跃时间
+        rows: [(telegram_id, age_seconds), ...]，telegram_id 不重复
+        """
+        if not rows:
+            return 0
+        
+        sql = """
+        UPDATE users 
+        SET last_active = GREATEST(users.last_active, NOW() - v.age * INTERVAL '1 second')
+        FROM (VALUES %s) AS v(telegram_id, age)
+        WHERE users.telegram_id = v.telegram_id
+        """
+        
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            execute_values(cursor, sql, rows, page_size=len(rows))
+            conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
     @classmethod
     def update_command_stats(cls, telegram_id: int, command: str):
-        """更新命令使用统计"""
+        """更新命令使用统计（单次）"""
         sql = """
-        INSERT INTO user_stats (user_id, start_count, help_count, ping_count, last_command_used)
-        VALUES (
-            %s,
-            CASE WHEN %s = '/start' THEN 1 ELSE 0 END,
-            CASE WHEN %s = '/help' THEN 1 ELSE 0 END,
-            CASE WHEN %s = '/ping' THEN 1 ELSE 0 END,
-            %s
-        )
-        ON CONFLICT (user_id) 
+        INSERT INTO command_stats (user_id, command, use_count, last_used_at)
+        VALUES (%s, %s, 1, NOW())
+        ON CONFLICT (user_id, command) 
+        DO UPDATE SET
+            use_count = command_stats.use_count + 1,
+            last_used_at = NOW();
+        """
+        
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            cls._statements.execute(cursor, 'update_command_stats', sql, (telegram_id, command))
+            conn.commit()
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def merge_command_stats(cls, rows: list):
+        """
+        批量合并命令使用次数增量（一条语句）
+        rows: [(telegram_id, command, count, age_seconds), ...]，(telegram_id, command) 不重复
+        """
+        if not rows:
+            return 0
+        
+        sql = """
+        INSERT INTO command_stats (user_id, command, use_count, last_used_at)
+        SELECT v.user_id, v.command, v.cnt, NOW() - v.age * INTERVAL '1 second'
+        FROM (VALUES %s) AS v(user_id, command, cnt, age)
+        JOIN users u ON u.telegram_id = v.user_id
+        ON CONFLICT (user_id, command) 
         DO UPDATE SET
-            start_count = user_stats.start_count + CASE WHEN %s = '/start' THEN 1 ELSE 0 END,
-            help_count = user_stats.help_count + CASE WHEN %s = '/help' THEN 1 ELSE 0 END,
-            ping_count = user_stats.ping_count + CASE WHEN %s = '/ping' THEN 1 ELSE 0 END,
-            last_command_used = %s,
-            updated_at = NOW();
+            use_count = command_stats.use_count + EXCLUDED.use_count,
+            last_used_at = GREATEST(command_stats.last_used_at, EXCLUDED.last_used_at);
         """
         
         conn = cls.get_connection()
         try:
             cursor = conn.cursor()
-            cursor.execute(sql, (telegram_id, command, command, command, command, 
-                               command, command, command, command))
+            execute_values(cursor, sql, rows, page_size=len(rows))
             conn.commit()
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
         finally:
             cls.return_connection(conn)
     
@@ -255,20 +1015,29 @@ class DatabaseManager:
             u.first_name,
             u.message_count,
             u.created_at as join_date,
-            COALESCE(s.start_count, 0) as start_count,
-            COALESCE(s.help_count, 0) as help_count,
-            COALESCE(s.ping_count, 0) as ping_count,
-            s.last_command_used,
-            s.updated_at as last_command_time
+            COALESCE(
+                (SELECT json_object_agg(c.command, c.use_count) 
+                 FROM command_stats c WHERE c.user_id = u.telegram_id),
+                '{}'::json
+            ) as command_counts,
+            last_cmd.command as last_command_used,
+            last_cmd.last_used_at as last_command_time,
+            NOW()::timestamp as db_now
         FROM users u
-        LEFT JOIN user_stats s ON u.telegram_id = s.user_id
+        LEFT JOIN LATERAL (
+            SELECT command, last_used_at 
+            FROM command_stats 
+            WHERE user_id = u.telegram_id 
+            ORDER BY last_used_at DESC 
+            LIMIT 1
+        ) last_cmd ON TRUE
         WHERE u.telegram_id = %s;
         """
         
         conn = cls.get_connection()
         try:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(sql, (telegram_id,))
+            cls._statements.execute(cursor, 'get_user_stats', sql, (telegram_id,))
             result = cursor.fetchone()
             return dict(result) if result else None
         finally:
@@ -276,211 +1045,195 @@ class DatabaseManager:
     
     @classmethod
     def get_bot_stats(cls):
-        """获取机器人整体统计"""
+        """获取机器人整体统计（读取增量维护的全局计数器，与历史数据量无关）"""
         sql = """
         SELECT 
-            COUNT(DISTINCT telegram_id) as total_users,
-            COUNT(*) as total_messages,
-            SUM(CASE WHEN is_command THEN 1 ELSE 0 END) as total_commands,
-            MAX(created_at) as last_message_time
-        FROM messages;
+            COALESCE(SUM(total_users), 0)::bigint as total_users,
+            COALESCE(SUM(total_messages), 0)::bigint as total_messages,
+            COALESCE(SUM(total_commands), 0)::bigint as total_commands,
+            MAX(last_message_time) as last_message_time
+        FROM bot_counters;
         """
         
         conn = cls.get_connection()
         try:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(sql)
-            return dict(cursor.fetchone())
+            cls._statements.execute(cursor, 'get_bot_stats', sql)
+            result = cursor.fetchone()
+            if not result:
+                return {
+                    'total_users': 0,
+                    'total_messages': 0,
+                    'total_commands': 0,
+                    'last_message_time': None
+                }
+            return dict(result)
         finally:
             cls.return_connection(conn)
 
     # ========== 新增：积分相关方法 ==========
     
     @classmethod
-    def daily_sign_in(cls, telegram_id: int, username: str = None, first_name: str = None):
+    def daily_sign_in(cls, telegram_id: int, username: str = None, first_name: str = None,
+                      with_rank: bool = True):
         """
-        用户每日签到
-        返回: (success, message, points_awarded)
+        用户每日签到（一次往返，由 sign_in_user 函数在数据库端原子完成）
+        返回: (success, message, result)
+        result: points_awarded, current_streak, total_points, sign_in_count, last_sign_in, rank
+        with_rank=False 时不在数据库中计算排名（rank 为 None）
         """
         conn = cls.get_connection()
         try:
-            cursor = conn.cursor()
-            
-            # 1. 检查今天是否已经签到
-            cursor.execute("""
-                SELECT 1 FROM daily_sign_ins 
-                WHERE user_id = %s AND sign_date = CURRENT_DATE
-            """, (telegram_id,))
-            
-            if cursor.fetchone():
-                logger.info(f"用户 {telegram_id} 今天已经签到过了")
-                return False, "今天已经签到过了，请明天再来！", 0
-            
-            # 2. 获取昨天的签到记录，计算连续签到
-            cursor.execute("""
-                SELECT 1 FROM daily_sign_ins 
-                WHERE user_id = %s AND sign_date = CURRENT_DATE - INTERVAL '1 day'
-            """, (telegram_id,))
-            
-            signed_yesterday = cursor.fetchone() is not None
-            
-            # 3. 获取当前连续签到天数
-            current_streak = 0
-            cursor.execute("""
-                SELECT sign_in_streak FROM user_points 
-                WHERE user_id = %s
-            """, (telegram_id,))
-            result = cursor.fetchone()
-            current_streak = result[0] if result else 0
-            
-            # 4. 计算新的连续天数
-            new_streak = current_streak + 1 if signed_yesterday else 1
-            
-            # 5. 计算奖励积分（基础1分 + 连续签到奖励）
-            base_points = 1
-            streak_bonus = 0
-            
-            # 连续签到奖励规则
-            if new_streak >= 7:
-                streak_bonus = 2  # 连续7天额外2分
-            elif new_streak >= 3:
-                streak_bonus = 1  # 连续3天额外1分
-            
-            total_points = base_points + streak_bonus
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cls._statements.execute(cursor, 'sign_in_user', """
+                SELECT * FROM sign_in_user(%s, %s, %s, %s)
+            """, (telegram_id, username, first_name, with_rank))
+            result = dict(cursor.fetchone())
+            conn.commit()
+            return cls.sign_in_outcome(telegram_id, result)
             
-            # 6. 使用独立的连接执行签到操作，避免事务冲突
-            try:
-                # 6.1 插入签到记录
-                cursor.execute("""
-                    INSERT INTO daily_sign_ins (user_id, sign_date, points_awarded)
-                    VALUES (%s, CURRENT_DATE, %s)
-                """, (telegram_id, total_points))
-                
-                # 6.2 插入积分变动记录
-                reason = f'sign_in_streak_{new_streak}' if streak_bonus > 0 else 'sign_in'
-                description = f"每日签到" + (f"（连续{new_streak}天奖励+{streak_bonus}）" if streak_bonus > 0 else "")
-                
-                cursor.execute("""
-                    INSERT INTO points_history (user_id, points_change, reason, description)
-                    VALUES (%s, %s, %s, %s)
-                """, (telegram_id, total_points, reason, description))
-                
-                # 6.3 更新或插入用户积分汇总
-                cursor.execute("""
-                    INSERT INTO user_points (user_id, total_points, sign_in_count, last_sign_in, sign_in_streak, max_streak)
-                    VALUES (%s, %s, 1, NOW(), %s, %s)
-                    ON CONFLICT (user_id) 
-                    DO UPDATE SET
-                        total_points = user_points.total_points + EXCLUDED.total_points,
-                        sign_in_count = user_points.sign_in_count + 1,
-                        last_sign_in = NOW(),
-                        sign_in_streak = EXCLUDED.sign_in_streak,
-                        max_streak = GREATEST(user_points.max_streak, EXCLUDED.sign_in_streak),
-                        updated_at = NOW()
-                """, (telegram_id, total_points, new_streak, new_streak))
-                
-                # 6.4 确保用户存在于users表
-                cursor.execute("""
-                    INSERT INTO users (telegram_id, username, first_name, last_active)
-                    VALUES (%s, %s, %s, NOW())
-                    ON CONFLICT (telegram_id) 
-                    DO UPDATE SET
-                        username = EXCLUDED.username,
-                        first_name = EXCLUDED.first_name,
-                        last_active = NOW()
-                """, (telegram_id, username, first_name))
-                
-                conn.commit()
-                
-                logger.info(f"✅ 用户 {telegram_id} 签到成功，获得 {total_points} 积分，连续 {new_streak} 天")
-                return True, f"签到成功！获得 {total_points} 积分", total_points
-                
-            except Exception as e:
-                logger.error(f"❌ 签到操作失败: {e}")
-                conn.rollback()
-                return False, f"签到失败: {str(e)}", 0
-                
         except Exception as e:
-            logger.error(f"❌ 签到过程出错: {e}")
-            return False, f"签到失败: {str(e)}", 0
+            logger.error(f"❌ 签到操作失败: {e}")
+            conn.rollback()
+            return False, f"签到失败: {str(e)}", None
         finally:
             cls.return_connection(conn)
     
+    @staticmethod
+    def sign_in_outcome(telegram_id: int, result: dict):
+        """把签到函数返回的一行整理成 (success, message, result)"""
+        # 无论成功还是重复签到，今天都已签到
+        result['signed_in_today'] = True
+        
+        if not result.pop('success'):
+            logger.info(f"用户 {telegram_id} 今天已经签到过了")
+            return False, "今天已经签到过了，请明天再来！", result
+        
+        logger.info(f"✅ 用户 {telegram_id} 签到成功，获得 {result['points_awarded']} 积分，连续 {result['current_streak']} 天")
+        return True, f"签到成功！获得 {result['points_awarded']} 积分", result
+    
     @classmethod
-    def get_user_points_info(cls, telegram_id: int):
-        """获取用户积分详细信息"""
+    def daily_sign_in_batch(cls, requests: list, with_rank: bool = False):
+        """
+        一批用户在同一个事务中签到（sign_in_users_batch 函数，每张表一条多行语句）
+        requests: [(telegram_id, username, first_name), ...]，用户不能重复
+        返回: {telegram_id: result}，result 字段与 daily_sign_in 相同（含 success）；失败时抛出异常
+        with_rank=True 时同一事务中从物化排行榜批量读取排名，否则 rank 为 None
+        """
+        user_ids, usernames, first_names = (list(column) for column in zip(*requests))
         conn = cls.get_connection()
         try:
             cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cls._statements.execute(cursor, 'sign_in_users_batch', """
+                SELECT * FROM sign_in_users_batch(%s::bigint[], %s::varchar[], %s::varchar[])
+            """, (user_ids, usernames, first_names))
+            results = {row['user_id']: dict(row, rank=None) for row in cursor.fetchall()}
             
-            # 获取积分汇总信息
-            cursor.execute("""
-                SELECT * FROM v_user_points_summary 
-                WHERE telegram_id = %s
-            """, (telegram_id,))
+            if with_rank:
+                # 与 _materialized_rank 相同：不在榜中的用户按积分范围计数估算
+                cls._statements.execute(cursor, 'materialized_rank_batch', """
+                    SELECT b.user_id, COALESCE(
+                        lr.rank,
+                        (SELECT COUNT(*) + 1 FROM leaderboard_ranks 
+                         WHERE total_points > b.total_points)
+                    ) as rank
+                    FROM unnest(%s::bigint[], %s::int[]) AS b(user_id, total_points)
+                    LEFT JOIN leaderboard_ranks lr ON lr.user_id = b.user_id
+                """, (list(results), [result['total_points'] for result in results.values()]))
+                for row in cursor.fetchall():
+                    results[row['user_id']]['rank'] = row['rank']
             
-            summary = cursor.fetchone()
+            conn.commit()
+            return results
+        except Exception as e:
+            logger.error(f"❌ 批量签到失败（{len(requests)} 个用户）: {e}")
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
+    # 排名的三种来源：实时计数、物化排行榜、不计算（由调用方从内存索引补齐）
+    _POINTS_INFO_RANK_SQL = {
+        'count': """
+            (SELECT COUNT(*) + 1 FROM user_points 
+             WHERE total_points > COALESCE(up.total_points, 0))""",
+        'materialized': """
+            COALESCE(
+                (SELECT lr.rank FROM leaderboard_ranks lr WHERE lr.user_id = u.telegram_id),
+                (SELECT COUNT(*) + 1 FROM leaderboard_ranks lr 
+                 WHERE lr.total_points > COALESCE(up.total_points, 0)))""",
+        None: "NULL::bigint",
+    }
+    
+    @classmethod
+    def get_user_points_info(cls, telegram_id: int, rank_source: str = 'count'):
+        """
+        获取用户积分详细信息（一条语句：汇总与签到位图、最近5条积分记录、排名）
+        今日是否已签到、当前与最长连胜由签到位图计算，sign_in_history 供调用方渲染签到日历
+        today 为数据库的当前日期，day_remaining 为距当天结束的秒数，缓存不能跨过这一刻
+        rank_source: 'count' 实时计算排名，'materialized' 从物化排行榜读取，None 不计算
+        """
+        sql = """
+            SELECT 
+                u.telegram_id,
+                u.username,
+                u.first_name,
+                COALESCE(up.total_points, 0) as total_points,
+                COALESCE(up.sign_in_count, 0) as sign_in_count,
+                up.last_sign_in,
+                up.sign_in_bits::text as sign_in_bits,
+                up.sign_in_bits_end,
+                CURRENT_DATE as today,
+                EXTRACT(EPOCH FROM (CURRENT_DATE + 1)::timestamp - LOCALTIMESTAMP)::float8 as day_remaining,
+                COALESCE((
+                    SELECT json_agg(t ORDER BY t.created_at DESC)
+                    FROM (
+                        SELECT 
+                            points_change,
+                            reason,
+                            description,
+                            created_at,
+                            TO_CHAR(created_at, 'MM-DD HH24:MI') as time_str
+                        FROM points_history 
+                        WHERE user_id = u.telegram_id 
+                        ORDER BY created_at DESC 
+                        LIMIT 5
+                    ) t
+                ), '[]'::json) as recent_transactions,
+                RANK_SQL as rank
+            FROM users u
+            LEFT JOIN user_points up ON up.user_id = u.telegram_id
+            WHERE u.telegram_id = %s
+        """.replace('RANK_SQL', cls._POINTS_INFO_RANK_SQL[rank_source])
+        
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cls._statements.execute(cursor, f'points_info_{rank_source or "no_rank"}', sql, (telegram_id,))
+            result = cursor.fetchone()
             
-            if not summary:
+            if not result:
                 return {
                     'total_points': 0,
                     'signed_in_today': False,
                     'sign_in_count': 0,
                     'current_streak': 0,
                     'max_streak': 0,
-                    'last_sign_in': None
+                    'last_sign_in': None,
+                    'sign_in_history': SignInHistory(),
                 }
             
-            # 获取最近7天签到情况
-            cursor.execute("""
-                SELECT 
-                    sign_date,
-                    points_awarded,
-                    CASE 
-                        WHEN sign_date = CURRENT_DATE THEN 'today'
-                        WHEN sign_date = CURRENT_DATE - INTERVAL '1 day' THEN 'yesterday'
-                        ELSE TO_CHAR(sign_date, 'MM-DD')
-                    END as display_date
-                FROM daily_sign_ins 
-                WHERE user_id = %s 
-                AND sign_date >= CURRENT_DATE - INTERVAL '6 days'
-                ORDER BY sign_date DESC
-            """, (telegram_id,))
-            
-            recent_sign_ins = cursor.fetchall()
-            
-            # 获取最近5条积分记录
-            cursor.execute("""
-                SELECT 
-                    points_change,
-                    reason,
-                    description,
-                    created_at,
-                    TO_CHAR(created_at, 'MM-DD HH24:MI') as time_str
-                FROM points_history 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC 
-                LIMIT 5
-            """, (telegram_id,))
-            
-            recent_transactions = cursor.fetchall()
-            
-            # 计算排名（简化版）
-            cursor.execute("""
-                SELECT COUNT(*) + 1 as rank
-                FROM user_points 
-                WHERE total_points > (SELECT total_points FROM user_points WHERE user_id = %s)
-            """, (telegram_id,))
-            
-            rank_result = cursor.fetchone()
-            rank = rank_result['rank'] if rank_result else 1
-            
-            result = dict(summary)
-            result['recent_sign_ins'] = recent_sign_ins
-            result['recent_transactions'] = recent_transactions
-            result['rank'] = rank
-            
-            return result
+            # “今天”以数据库的 CURRENT_DATE 为准，与签到函数一致；today 保留给调用方渲染日历
+            info = dict(result)
+            today = info['today']
+            history = SignInHistory.from_row(info.pop('sign_in_bits'), info.pop('sign_in_bits_end'))
+            info.update(
+                sign_in_history=history,
+                signed_in_today=history.signed(today),
+                current_streak=history.streak(today),
+                max_streak=history.max_streak(),
+            )
+            return info
             
         except Exception as e:
             logger.error(f"❌ 获取积分信息失败: {e}")
@@ -519,11 +1272,220 @@ class DatabaseManager:
         finally:
             cls.return_connection(conn)
 
+    @classmethod
+    def load_leaderboard(cls):
+        """读取全部积分记录，用于构建内存排行榜索引"""
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT 
+                    up.user_id,
+                    u.username,
+                    u.first_name,
+                    up.total_points,
+                    up.sign_in_count,
+                    up.sign_in_streak,
+                    up.last_sign_in
+                FROM user_points up
+                JOIN users u ON up.user_id = u.telegram_id
+            """)
+            return cursor.fetchall()
+        finally:
+            cls.return_connection(conn)
+    
+    # ========== 消息分区维护 ==========
+    
+    @classmethod
+    def maintain_partitions(cls):
+        """
+        预建未来的消息分区，并删除超出保留期的分区
+        返回 (新建分区数, 删除分区数)；其他实例正在维护时返回 None
+        """
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (cls.PARTITION_MAINTENANCE_LOCK,))
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return None
+            
+            cursor.execute("SELECT ensure_monthly_partitions('messages', %s)", (cls.PARTITION_PREMAKE_MONTHS,))
+            created = cursor.fetchone()[0]
+            
+            dropped = 0
+            if cls.MESSAGE_RETENTION_MONTHS > 0:
+                cursor.execute("SELECT drop_expired_partitions('messages', %s)", (cls.MESSAGE_RETENTION_MONTHS,))
+                dropped = cursor.fetchone()[0]
+            
+            conn.commit()
+            if created or dropped:
+                logger.info(f"✅ 消息分区维护完成：新建 {created} 个，删除 {dropped} 个")
+            return created, dropped
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def expire_sign_in_streaks(cls):
+        """
+        把已经中断（昨天和今天都没有签到）的连续签到天数清零，返回被清零的用户ID
+        排行榜按 user_points.sign_in_streak 排序与显示，而这一列只在签到时改写
+        """
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE user_points 
+                SET sign_in_streak = 0,
+                    updated_at = NOW()
+                WHERE sign_in_streak <> 0 
+                  AND sign_in_bits_end < CURRENT_DATE - 1
+                RETURNING user_id
+            """)
+            user_ids = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return user_ids
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
+    # ========== 物化排行榜 ==========
+    
+    @classmethod
+    def refresh_leaderboard(cls):
+        """
+        并发刷新物化排行榜（不阻塞读取）
+        其他实例正在刷新时直接跳过，返回是否执行了刷新
+        """
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (cls.LEADERBOARD_REFRESH_LOCK,))
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return False
+            
+            cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY leaderboard_ranks")
+            cursor.execute("UPDATE leaderboard_refresh SET refreshed_at = NOW() WHERE id = 1")
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def get_leaderboard_age(cls):
+        """物化排行榜距上次刷新的秒数，没有刷新记录时返回 None"""
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT EXTRACT(EPOCH FROM NOW()::timestamp - refreshed_at)
+                FROM leaderboard_refresh 
+                WHERE id = 1
+            """)
+            result = cursor.fetchone()
+            return float(result[0]) if result else None
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def _materialized_rank(cls, cursor, telegram_id: int):
+        """
+        从物化排行榜读取排名
+        上次刷新后才有积分的用户不在榜中，用积分索引上的范围计数估算
+        """
+        cls._statements.execute(cursor, 'materialized_rank', """
+            SELECT COALESCE(
+                (SELECT rank FROM leaderboard_ranks WHERE user_id = %s),
+                (SELECT COUNT(*) + 1 FROM leaderboard_ranks 
+                 WHERE total_points > COALESCE(
+                     (SELECT total_points FROM user_points WHERE user_id = %s), 0))
+            ) as rank
+        """, (telegram_id, telegram_id))
+        result = cursor.fetchone()
+        return result['rank'] if isinstance(result, dict) else result[0]
+    
+    @classmethod
+    def get_user_rank_materialized(cls, telegram_id: int):
+        """从物化排行榜读取用户排名与积分"""
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            rank = cls._materialized_rank(cursor, telegram_id)
+            cursor.execute("""
+                SELECT total_points FROM user_points WHERE user_id = %s
+            """, (telegram_id,))
+            result = cursor.fetchone()
+            return {
+                'rank': rank,
+                'total_points': result['total_points'] if result else 0,
+            }
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def get_top_users_materialized(cls, limit: int = 10):
+        """从物化排行榜读取前 limit 名（按位置的索引扫描，不排序）"""
+        conn = cls.get_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT 
+                    user_id,
+                    username,
+                    first_name,
+                    total_points,
+                    sign_in_count,
+                    sign_in_streak,
+                    last_sign_in,
+                    position as rank
+                FROM leaderboard_ranks
+                WHERE position <= %s
+                ORDER BY position
+            """, (limit,))
+            return cursor.fetchall()
+        except Exception as e:
+            logger.error(f"❌ 获取排行榜失败: {e}")
+            return []
+        finally:
+            cls.return_connection(conn)
+    
+    @classmethod
+    def _fetch_points_state(cls, conn, telegram_id: int):
+        """在当前事务中读取用户的积分状态（供调用方同步排行榜索引）"""
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cls._statements.execute(cursor, 'points_state', """
+            SELECT 
+                up.user_id,
+                u.username,
+                u.first_name,
+                up.total_points,
+                up.sign_in_count,
+                up.sign_in_streak,
+                up.last_sign_in
+            FROM user_points up
+            JOIN users u ON up.user_id = u.telegram_id
+            WHERE up.user_id = %s
+        """, (telegram_id,))
+        result = cursor.fetchone()
+        return dict(result) if result else None
+
     # ========== 新增：积分管理方法 ==========
     
     @classmethod
     def add_points_to_user(cls, telegram_id: int, points: int, reason: str = "管理员调整"):
-        """为用户添加积分（可正可负）"""
+        """
+        为用户添加积分（可正可负）
+        返回: (success, message, state)，state 为调整后的积分状态
+        """
         conn = cls.get_connection()
         try:
             cursor = conn.cursor()
@@ -554,21 +1516,25 @@ class DatabaseManager:
             
             result = cursor.fetchone()
             new_total = result[0] if result else points
+            state = cls._fetch_points_state(conn, telegram_id)
             
             conn.commit()
             logger.info(f"✅ 管理员调整用户 {telegram_id} 积分 {points} 分，新总分: {new_total}")
-            return True, f"积分调整成功，新总分: {new_total} 分"
+            return True, f"积分调整成功，新总分: {new_total} 分", state
             
         except Exception as e:
             logger.error(f"❌ 调整积分失败: {e}")
             conn.rollback()
-            return False, f"调整积分失败: {str(e)}"
+            return False, f"调整积分失败: {str(e)}", None
         finally:
             cls.return_connection(conn)
     
     @classmethod
     def set_user_points(cls, telegram_id: int, points: int):
-        """直接设置用户积分（覆盖现有积分）"""
+        """
+        直接设置用户积分（覆盖现有积分）
+        返回: (success, message, state)，state 为设置后的积分状态
+        """
         conn = cls.get_connection()
         try:
             cursor = conn.cursor()
@@ -605,15 +1571,435 @@ class DatabaseManager:
                     total_points = EXCLUDED.total_points,
                     updated_at = NOW()
             """, (telegram_id, points))
+            state = cls._fetch_points_state(conn, telegram_id)
             
             conn.commit()
             logger.info(f"✅ 管理员设置用户 {telegram_id} 积分为 {points} 分")
-            return True, f"积分设置成功: {points} 分"
+            return True, f"积分设置成功: {points} 分", state
             
         except Exception as e:
             logger.error(f"❌ 设置积分失败: {e}")
             conn.rollback()
-            return False, f"设置积分失败: {str(e)}"
+            return False, f"设置积分失败: {str(e)}", None
         finally:
             cls.return_connection(conn)
 
+
+class AsyncDatabaseManager:
+    """
+    DatabaseManager 的异步版本
+    阻塞的 psycopg2 调用在专用线程池中执行，处理函数 await 时不会卡住事件循环，
+    不同聊天的数据库 I/O 可以相互重叠
+    """
+    _executor = None
+    _message_buffer = None
+    _command_counter = None
+    _leaderboard = None
+    _leaderboard_refreshed_at = None
+    _points_cache = None
+    _profile_cache = None
+    _activity_tracker = None
+    _sign_in_batcher = None
+    
+    # 消息写缓冲：达到条数阈值立即刷新，否则由定时任务按间隔刷新
+    MESSAGE_FLUSH_SIZE = int(os.environ.get('MESSAGE_FLUSH_SIZE', 200))
+    MESSAGE_FLUSH_INTERVAL = float(os.environ.get('MESSAGE_FLUSH_INTERVAL', 2))
+    # 数据库暂时不可用（断连、连接池耗尽或关闭）的异常，写缓冲遇到时整批重试而不是逐条写入
+    TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout, PoolError)
+    
+    # 排行榜模式：memory 为进程内索引（单实例），materialized 为数据库物化排行榜（多实例共享）
+    LEADERBOARD_MODE = os.environ.get('LEADERBOARD_MODE', 'memory')
+    LEADERBOARD_REFRESH_INTERVAL = float(os.environ.get('LEADERBOARD_REFRESH_INTERVAL', 30))
+    # 物化排行榜允许的最大陈旧时间（秒），超过后读取前先同步刷新
+    LEADERBOARD_MAX_STALENESS = float(os.environ.get('LEADERBOARD_MAX_STALENESS', 120))
+    # 清零已中断连续签到的间隔（秒）
+    STREAK_EXPIRE_INTERVAL = float(os.environ.get('STREAK_EXPIRE_INTERVAL', 600))
+    
+    # 用户积分快照缓存时间（秒）；积分变动时主动失效
+    POINTS_CACHE_TTL = float(os.environ.get('POINTS_CACHE_TTL', 60))
+    
+    # 最近见过的用户资料指纹数量；资料未变化时跳过 save_user 写入
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 50000))
+    
+    # 签到微批：每批最多的用户数、同时提交的批次数（即签到占用的连接数）；关闭后每次签到单独提交
+    SIGN_IN_BATCHING = os.environ.get('SIGN_IN_BATCHING', '1').lower() not in ('0', 'false', 'no')
+    SIGN_IN_BATCH_SIZE = int(os.environ.get('SIGN_IN_BATCH_SIZE', 500))
+    SIGN_IN_MAX_BATCHES = int(os.environ.get('SIGN_IN_MAX_BATCHES', 2))
+    
+    @classmethod
+    def initialize(cls, init_schema: bool = True):
+        """初始化数据库连接池和数据库线程池"""
+        DatabaseManager.initialize(init_schema)
+        cls._executor = ThreadPoolExecutor(
+            max_workers=DatabaseManager.POOL_MAX_CONN,
+            thread_name_prefix='db'
+        )
+        cls._message_buffer = MessageBuffer(
+            cls._write_messages, max_size=cls.MESSAGE_FLUSH_SIZE, transient_errors=cls.TRANSIENT_ERRORS
+        )
+        cls._command_counter = CommandCounter(cls._write_command_stats)
+        cls._points_cache = TTLCache(cls.POINTS_CACHE_TTL)
+        cls._profile_cache = LRUCache(cls.PROFILE_CACHE_SIZE)
+        cls._activity_tracker = ActivityTracker(cls._write_activity)
+        if cls.SIGN_IN_BATCHING:
+            cls._sign_in_batcher = SignInBatcher(
+                cls._commit_sign_ins, max_size=cls.SIGN_IN_BATCH_SIZE, max_batches=cls.SIGN_IN_MAX_BATCHES
+            )
+        
+        if cls.LEADERBOARD_MODE == 'materialized':
+            DatabaseManager.refresh_leaderboard()
+            cls._leaderboard_refreshed_at = time.monotonic()
+        else:
+            # 排行榜与排名查询由内存索引回答，启动时整表加载一次
+            cls._leaderboard = LeaderboardIndex()
+            cls._leaderboard.load(DatabaseManager.load_leaderboard())
+        logger.info(f"✅ 异步数据库层初始化成功（{DatabaseManager.POOL_MAX_CONN} 个工作线程）")
+    
+    @classmethod
+    async def _run(cls, func, *args, **kwargs):
+        """在数据库线程池中执行同步方法"""
+        if cls._executor is None:
+            raise RuntimeError("AsyncDatabaseManager 尚未初始化")
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(cls._executor, functools.partial(func, *args, **kwargs))
+        finally:
+            # 在事件循环线程中记录，耗时包含排队等待线程和连接的时间
+            elapsed = time.perf_counter() - started
+            DB_QUERY_DURATION.observe(elapsed, func.__name__)
+            record_db_time(elapsed)
+    
+    @classmethod
+    async def _write_messages(cls, rows: list):
+        """消息缓冲的落库回调：把单调时钟时间换算成距今秒数后批量写入"""
+        now = time.monotonic()
+        db_rows = [(telegram_id, chat_id, text, is_command, now - queued_at)
+                   for telegram_id, chat_id, text, is_command, queued_at in rows]
+        await cls._run(DatabaseManager.save_messages_batch, db_rows)
+    
+    @classmethod
+    async def _write_command_stats(cls, rows: list):
+        """命令计数器的落库回调"""
+        now = time.monotonic()
+        db_rows = [(telegram_id, command, count, now - queued_at)
+                   for telegram_id, command, count, queued_at in rows]
+        await cls._run(DatabaseManager.merge_command_stats, db_rows)
+    
+    @classmethod
+    async def _write_activity(cls, rows: list):
+        """活跃时间合并器的落库回调"""
+        now = time.monotonic()
+        db_rows = [(telegram_id, now - queued_at) for telegram_id, queued_at in rows]
+        await cls._run(DatabaseManager.touch_users, db_rows)
+    
+    @classmethod
+    async def flush(cls):
+        """把所有写缓冲刷入数据库（定时任务与关闭时调用）"""
+        # 先写消息：新用户的首条 /start 记录依赖 users 行已存在
+        if cls._message_buffer is not None:
+            await cls._message_buffer.flush()
+        if cls._command_counter is not None:
+            await cls._command_counter.flush()
+        if cls._activity_tracker is not None:
+            await cls._activity_tracker.flush()
+    
+    @classmethod
+    def pool_stats(cls):
+        return DatabaseManager.pool_stats()
+    
+    @classmethod
+    async def ping(cls) -> bool:
+        """数据库是否可用（供 /readyz 使用）"""
+        try:
+            return await cls._run(DatabaseManager.ping)
+        except Exception as e:
+            logger.warning(f"⚠️ 数据库就绪检查失败: {e}")
+            return False
+    
+    @classmethod
+    def close_all_connections(cls):
+        """等待进行中的查询结束后关闭线程池和所有连接"""
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=True)
+            cls._executor = None
+        DatabaseManager.close_all_connections()
+    
+    # 用户相关操作
+    @classmethod
+    async def save_user(cls, user_data: dict):
+        """资料与最近一次写入相同时只记录活跃时间，不写 users 表"""
+        fingerprint = (
+            user_data.get('username'),
+            user_data.get('first_name'),
+            user_data.get('last_name'),
+            user_data.get('language_code'),
+            user_data.get('is_bot', False),
+        )
+        cached = cls._profile_cache.get(user_data['id'])
+        if cached is not None and cached[0] == fingerprint:
+            cls._activity_tracker.touch(user_data['id'])
+            return cached[1]
+        
+        # 资料未变化的 upsert 不会改写 last_active，同样交给活跃时间合并器
+        user_id = await cls._run(DatabaseManager.save_user, user_data)
+        cls._profile_cache.put(user_data['id'], (fingerprint, user_id))
+        if not cls._materialized():
+            # 改名后排行榜显示的名字随之变化，渲染缓存按版本失效
+            cls._leaderboard.rename(user_data['id'], user_data.get('username'), user_data.get('first_name'))
+        cls._activity_tracker.touch(user_data['id'])
+        return user_id
+    
+    @classmethod
+    def _forget_stale_profile(cls, telegram_id: int, username: str, first_name: str):
+        """
+        签到等其他写入路径也会改写 users 的名字：与缓存的资料指纹不一致时丢弃缓存，
+        否则用户改回缓存中的旧名字时 save_user 会跳过写入，数据库里留下中间的名字
+        """
+        cached = cls._profile_cache.get(telegram_id)
+        if cached is not None and cached[0][:2] != (username, first_name):
+            cls._profile_cache.invalidate(telegram_id)
+    
+    @classmethod
+    async def save_message(cls, telegram_id: int, chat_id: int, text: str, is_command: bool = False):
+        """消息只进入写缓冲，不在回复路径上访问数据库"""
+        cls._message_buffer.add(telegram_id, chat_id, text, is_command)
+    
+    @classmethod
+    async def update_command_stats(cls, telegram_id: int, command: str):
+        """命令计数只在内存中累加，由定时任务批量合并"""
+        cls._command_counter.increment(telegram_id, command)
+    
+    @classmethod
+    async def get_user_stats(cls, telegram_id: int):
+        stats = await cls._run(DatabaseManager.get_user_stats, telegram_id)
+        if stats:
+            # 加上还在缓冲区里的消息和命令增量，保证计数准确
+            stats['message_count'] += cls._message_buffer.pending_count(telegram_id)
+            
+            now = time.monotonic()
+            command_counts = dict(stats['command_counts'])
+            for command, (count, queued_at) in cls._command_counter.pending_for_user(telegram_id).items():
+                command_counts[command] = command_counts.get(command, 0) + count
+                used_at = stats['db_now'] - timedelta(seconds=now - queued_at)
+                if stats['last_command_time'] is None or used_at > stats['last_command_time']:
+                    stats['last_command_used'] = command
+                    stats['last_command_time'] = used_at
+            stats['command_counts'] = command_counts
+        return stats
+    
+    @classmethod
+    async def get_bot_stats(cls):
+        return await cls._run(DatabaseManager.get_bot_stats)
+    
+    # 积分相关操作
+    # memory 模式：每次积分写入提交后同步更新排行榜索引，排名直接从索引读取
+    # materialized 模式：排名读取数据库中的物化排行榜
+    @classmethod
+    def _materialized(cls) -> bool:
+        return cls.LEADERBOARD_MODE == 'materialized'
+    
+    @classmethod
+    async def maintain_partitions(cls):
+        """消息分区维护（由定时任务调用）"""
+        return await cls._run(DatabaseManager.maintain_partitions)
+    
+    @classmethod
+    async def expire_sign_in_streaks(cls):
+        """清零已中断的连续签到（由定时任务调用），同步排行榜索引与积分快照"""
+        user_ids = await cls._run(DatabaseManager.expire_sign_in_streaks)
+        for user_id in user_ids:
+            if not cls._materialized():
+                cls._leaderboard.update(user_id, sign_in_streak=0)
+            cls._points_cache.invalidate(user_id)
+        if user_ids:
+            logger.info(f"✅ 已清零 {len(user_ids)} 个用户中断的连续签到")
+        return len(user_ids)
+    
+    @classmethod
+    async def refresh_leaderboard(cls):
+        """刷新物化排行榜（由定时任务调用）"""
+        if await cls._run(DatabaseManager.refresh_leaderboard):
+            cls._leaderboard_refreshed_at = time.monotonic()
+    
+    @classmethod
+    async def _ensure_leaderboard_fresh(cls):
+        """
+        保证物化排行榜不超过允许的陈旧时间
+        本进程刚刷新过时不查库；否则以数据库中的刷新时间为准（其他实例也可能刷新过）
+        没有刷新记录时视为最新，由定时任务负责刷新，不在读取路径上同步刷新
+        """
+        if (cls._leaderboard_refreshed_at is not None
+                and time.monotonic() - cls._leaderboard_refreshed_at <= cls.LEADERBOARD_MAX_STALENESS):
+            return
+        
+        age = await cls._run(DatabaseManager.get_leaderboard_age)
+        if age is not None and age > cls.LEADERBOARD_MAX_STALENESS:
+            await cls.refresh_leaderboard()
+        else:
+            cls._leaderboard_refreshed_at = time.monotonic() - (age or 0)
+    
+    @classmethod
+    def _sync_leaderboard(cls, state: dict):
+        """把已提交的积分状态同步到内存排行榜索引，并让该用户的积分快照失效"""
+        if state:
+            cls._points_cache.invalidate(state['user_id'])
+            if cls._leaderboard is not None:
+                cls._leaderboard.update(**state)
+    
+    @classmethod
+    async def _commit_sign_ins(cls, requests: list):
+        """
+        签到微批的提交回调；materialized 模式下排名随批次一起读取
+        提交路径上不检查排行榜是否陈旧，避免在签到批次中同步刷新物化视图
+        """
+        SIGN_IN_BATCH_USERS.observe(len(requests))
+        return await cls._run(
+            DatabaseManager.daily_sign_in_batch, requests, with_rank=cls._materialized()
+        )
+    
+    @classmethod
+    async def _sign_in(cls, telegram_id: int, username: str, first_name: str):
+        """经签到微批提交，返回值与 DatabaseManager.daily_sign_in 相同"""
+        try:
+            result = await cls._sign_in_batcher.submit(telegram_id, username, first_name)
+        except Exception as e:
+            return False, f"签到失败: {str(e)}", None
+        del result['user_id']
+        return DatabaseManager.sign_in_outcome(telegram_id, result)
+    
+    @classmethod
+    async def daily_sign_in(cls, telegram_id: int, username: str = None, first_name: str = None):
+        if cls._sign_in_batcher is not None:
+            success, message, result = await cls._sign_in(telegram_id, username, first_name)
+        else:
+            success, message, result = await cls._run(
+                DatabaseManager.daily_sign_in, telegram_id, username, first_name, with_rank=False
+            )
+        cls._forget_stale_profile(telegram_id, username, first_name)
+        cls._activity_tracker.touch(telegram_id)
+        if result:
+            if success:
+                cls._sync_leaderboard({
+                    'user_id': telegram_id,
+                    'username': username,
+                    'first_name': first_name,
+                    'total_points': result['total_points'],
+                    'sign_in_count': result['sign_in_count'],
+                    'sign_in_streak': result['current_streak'],
+                    'last_sign_in': result['last_sign_in'],
+                })
+            if result.get('rank') is None:
+                result['rank'] = (await cls.get_user_rank(telegram_id))['rank']
+        return success, message, result
+    
+    @classmethod
+    async def get_user_points_info(cls, telegram_id: int):
+        """
+        用户积分详情：优先读取快照缓存
+        memory 模式下快照不含排名，每次从索引读取最新排名
+        """
+        info = cls._points_cache.get(telegram_id)
+        if info is None:
+            generation = cls._points_cache.generation(telegram_id)
+            if cls._materialized():
+                await cls._ensure_leaderboard_fresh()
+                info = await cls._run(DatabaseManager.get_user_points_info, telegram_id, rank_source='materialized')
+            else:
+                info = await cls._run(DatabaseManager.get_user_points_info, telegram_id, rank_source=None)
+            if info is None:
+                return None
+            
+            # “今日已签到”等字段在数据库的午夜后失效，缓存不跨天；读取期间签到或积分变化过则不写入
+            day_remaining = info.pop('day_remaining', cls.POINTS_CACHE_TTL)
+            cls._points_cache.put(telegram_id, info, ttl=min(cls.POINTS_CACHE_TTL, day_remaining),
+                                  generation=generation)
+        
+        info = dict(info)
+        if not cls._materialized():
+            info['rank'] = cls._leaderboard.rank(telegram_id)
+        return info
+    
+    @classmethod
+    async def get_user_rank(cls, telegram_id: int):
+        """用户当前排名与积分（memory 模式不访问数据库）"""
+        if cls._materialized():
+            await cls._ensure_leaderboard_fresh()
+            return await cls._run(DatabaseManager.get_user_rank_materialized, telegram_id)
+        
+        entry = cls._leaderboard.get(telegram_id)
+        return {
+            'rank': cls._leaderboard.rank(telegram_id),
+            'total_points': entry['total_points'] if entry else 0,
+        }
+    
+    @classmethod
+    async def leaderboard_version(cls):
+        """
+        排行榜数据版本，版本不变时前N名不变，供渲染缓存使用
+        memory 模式为索引的变动计数；materialized 模式为最近一次刷新的时间
+        """
+        if cls._materialized():
+            await cls._ensure_leaderboard_fresh()
+            return ('materialized', cls._leaderboard_refreshed_at)
+        return ('memory', cls._leaderboard.version)
+    
+    @classmethod
+    async def get_top_users(cls, limit: int = 10):
+        if cls._materialized():
+            await cls._ensure_leaderboard_fresh()
+            return await cls._run(DatabaseManager.get_top_users_materialized, limit)
+        return cls._leaderboard.top(limit)
+    
+    @classmethod
+    async def add_points_to_user(cls, telegram_id: int, points: int, reason: str = "管理员调整"):
+        success, message, state = await cls._run(DatabaseManager.add_points_to_user, telegram_id, points, reason)
+        cls._sync_leaderboard(state)
+        return success, message, state
+    
+    @classmethod
+    async def set_user_points(cls, telegram_id: int, points: int):
+        success, message, state = await cls._run(DatabaseManager.set_user_points, telegram_id, points)
+        cls._sync_leaderboard(state)
+        return success, message, state
+
+
+# 连接池指标：抓取 /metrics 时读取
+def _pool_connection_metrics():
+    stats = DatabaseManager.pool_stats()
+    if stats is None:
+        return {}
+    return {(state,): stats[state] for state in ('in_use', 'idle', 'max', 'waiting')}
+
+
+def _pool_counter_metric(key):
+    def collect():
+        stats = DatabaseManager.pool_stats()
+        return {(): stats[key]} if stats else {}
+    return collect
+
+
+REGISTRY.register(CallbackMetric(
+    'bot_db_pool_connections', '连接池连接数（按状态）', _pool_connection_metrics, ['state']))
+REGISTRY.register(CallbackMetric(
+    'bot_db_pool_wait_seconds_total', '等待空闲连接的累计时间',
+    _pool_counter_metric('wait_time_total'), type='counter'))
+REGISTRY.register(CallbackMetric(
+    'bot_db_pool_timeouts_total', '等待连接超时次数',
+    _pool_counter_metric('timeouts'), type='counter'))
+
+
+# 签到微批指标
+SIGN_IN_BATCH_USERS = REGISTRY.register(Histogram(
+    'bot_sign_in_batch_size', '每批提交的签到用户数', buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)))
+
+
+def _sign_in_queue_metric():
+    batcher = AsyncDatabaseManager._sign_in_batcher
+    if batcher is None:
+        return {}
+    return {('queued',): len(batcher), ('committing',): batcher.in_flight()}
+
+
+REGISTRY.register(CallbackMetric(
+    'bot_sign_in_pending', '排队中的签到用户数与正在提交的批次数', _sign_in_queue_metric, ['state']))
@@ -0,0 +1,97 @@
+import logging
+import os
+import time
+
+from cache import TTLCache
+from metrics import REGISTRY, Counter
+from sender import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# 各命令消耗的令牌数：触发多次数据库查询的命令更贵；未列出的命令为 1，普通消息按 'message' 计
+DEFAULT_COSTS = {
+    'sign': 3,
+    'points': 2,
+    'calendar': 2,
+    'rank': 3,
+    'leaderboard': 3,
+    'stats': 2,
+    'admin': 2,
+    'message': 1,
+}
+
+
+def parse_costs(spec: str) -> dict:
+    """解析 "sign=3,rank=5" 形式的命令成本配置"""
+    costs = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        command, sep, cost = item.partition('=')
+        if not sep:
+            raise ValueError(f"无效的命令成本配置: {item}")
+        costs[command.strip().lstrip('/').lower()] = float(cost)
+    return costs
+
+
+class FloodGuard:
+    """
+    按用户的令牌桶限流，在所有处理器之前执行
+    每个用户每秒补充 RATE 个令牌、最多积累 BURST 个，每条更新按命令扣除对应成本；
+    令牌不足的更新直接丢弃，不做任何数据库操作。回满的令牌桶定期清理，内存只与活跃用户数相关
+    """
+
+    RATE = float(os.environ.get('FLOOD_RATE', 0.5))
+    BURST = float(os.environ.get('FLOOD_BURST', 10))
+    # 同一用户被限流后的提示间隔（秒），期间的超限更新静默丢弃
+    NOTICE_INTERVAL = float(os.environ.get('FLOOD_NOTICE_INTERVAL', 30))
+    # 覆盖默认命令成本，如 "sign=5,rank=4"
+    COSTS_SPEC = os.environ.get('FLOOD_COSTS', '')
+
+    # 每检查这么多条更新清理一次已回满的令牌桶
+    SWEEP_EVERY = 4096
+
+    def __init__(self):
+        self.costs = {**DEFAULT_COSTS, **parse_costs(self.COSTS_SPEC)}
+        too_expensive = {command: cost for command, cost in self.costs.items() if cost > self.BURST}
+        if too_expensive:
+            raise ValueError(f"命令成本不能超过 FLOOD_BURST={self.BURST:g}: {too_expensive}")
+        self._buckets = {}
+        self._noticed = TTLCache(self.NOTICE_INTERVAL)
+        self._checks = 0
+        logger.info(f"✅ 用户限流：每秒 {self.RATE:g} 个令牌，最多 {self.BURST:g} 个")
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def cost(self, command: str) -> float:
+        return self.costs.get(command, 1)
+
+    def allow(self, user_id: int, command: str) -> bool:
+        """扣除该用户的令牌；不足时返回 False"""
+        now = time.monotonic()
+        self._checks += 1
+        if self._checks % self.SWEEP_EVERY == 0:
+            self._sweep(now)
+
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = TokenBucket(self.RATE, self.BURST)
+        if bucket.try_take(now, self.cost(command)) == 0:
+            return True
+        FLOOD_SHED_TOTAL.inc(command)
+        return False
+
+    def should_notice(self, user_id: int) -> bool:
+        """限流提示每个用户每 NOTICE_INTERVAL 秒最多发一次"""
+        if self._noticed.get(user_id) is not None:
+            return False
+        self._noticed.put(user_id, True)
+        return True
+
+    def _sweep(self, now: float):
+        idle = [user_id for user_id, bucket in self._buckets.items() if bucket.idle(now)]
+        for user_id in idle:
+            del self._buckets[user_id]
+
+
+FLOOD_SHED_TOTAL = REGISTRY.register(Counter(
+    'bot_flood_shed_total', '被限流丢弃的更新数', ['command']))
@@ -0,0 +1,167 @@
+import json
+import logging
+import random
+import string
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['一', '二', '三', '四', '五', '六', '日']
+
+# 回复模板中可用的动态字段：只有模板用到时才计算
+FIELD_PROVIDERS = {
+    'time': lambda: datetime.now().strftime('%H:%M:%S'),
+    'date': lambda: datetime.now().strftime('%Y年%m月%d日'),
+    'weekday': lambda: WEEKDAYS[datetime.now().weekday()],
+}
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick 多模式匹配自动机
+    一次扫描找出文本中出现的全部关键词（允许重叠），耗时与关键词数量无关
+    """
+
+    def __init__(self, keywords: list):
+        # 状态转移、失败指针、每个状态命中的关键词编号
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for keyword_id, keyword in enumerate(keywords):
+            state = 0
+            for char in keyword:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = next_state
+            self._out[state] += (keyword_id,)
+
+        # 广度优先计算失败指针，并把失败链上的命中合并进来
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+                queue.append(next_state)
+
+    def find(self, text: str) -> set:
+        """返回文本中出现过的关键词编号"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        # 大多数闲聊不含任何关键词的首字符，先用集合运算整体排除
+        if goto[0].keys().isdisjoint(text):
+            return found
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class ReplyTemplate:
+    """预解析的回复模板：启动时确定需要哪些字段"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self.fields = {name for _, name, _, _ in string.Formatter().parse(template) if name}
+        unknown = self.fields - set(FIELD_PROVIDERS) - {'first_name', 'message'}
+        if unknown:
+            raise ValueError(f"回复模板包含未知字段 {sorted(unknown)}: {template}")
+
+    def render(self, first_name: str, message: str) -> str:
+        if not self.fields:
+            return self.template
+        values = {'first_name': first_name, 'message': message}
+        for name in self.fields & FIELD_PROVIDERS.keys():
+            values[name] = FIELD_PROVIDERS[name]()
+        return self.template.format(**values)
+
+
+class Intent:
+    """
+    一条意图规则，满足任一条件即命中：
+    - keywords：出现任一关键词
+    - all_of：每组关键词都至少出现一个
+    - exact：整条消息等于其中之一
+    """
+
+    def __init__(self, name: str, priority: int, replies: list, any_ids=frozenset(),
+                 groups=(), exact=frozenset()):
+        self.name = name
+        self.priority = priority
+        self.replies = [ReplyTemplate(reply) for reply in replies]
+        self.any_ids = any_ids
+        self.groups = groups
+        self.exact = exact
+
+    def matches(self, found: set, text: str) -> bool:
+        if self.any_ids and not self.any_ids.isdisjoint(found):
+            return True
+        if self.groups and all(not group.isdisjoint(found) for group in self.groups):
+            return True
+        return text in self.exact
+
+
+class IntentMatcher:
+    """
+    smart_reply 的关键词意图匹配器
+    规则来自配置文件，启动时把全部关键词编译成一个自动机，每条消息只扫描一遍，再按优先级判定意图
+    """
+
+    def __init__(self, config: dict):
+        keyword_ids = {}
+
+        def ids_for(words):
+            return frozenset(keyword_ids.setdefault(word.lower(), len(keyword_ids)) for word in words)
+
+        intents = []
+        for rule in config.get('intents', []):
+            if not rule.get('replies'):
+                raise ValueError(f"意图 {rule.get('name')} 没有回复")
+            intents.append(Intent(
+                name=rule['name'],
+                priority=rule.get('priority', 0),
+                replies=rule['replies'],
+                any_ids=ids_for(rule.get('keywords', [])),
+                groups=tuple(ids_for(group) for group in rule.get('all_of', [])),
+                exact=frozenset(word.lower() for word in rule.get('exact', [])),
+            ))
+        # 优先级高的先判定；同优先级保持配置中的顺序
+        self.intents = sorted(intents, key=lambda intent: -intent.priority)
+        self.fallback = [ReplyTemplate(reply) for reply in config.get('fallback', [])] or [ReplyTemplate('嗯，我记下了！')]
+        self._has_exact = any(intent.exact for intent in self.intents)
+        self._automaton = KeywordAutomaton(list(keyword_ids))
+        logger.info(f"✅ 意图规则加载完成：{len(self.intents)} 个意图，{len(keyword_ids)} 个关键词")
+
+    @classmethod
+    def from_file(cls, path: str):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def match(self, message: str):
+        """返回命中的意图，没有命中时返回 None"""
+        text = message.lower()
+        found = self._automaton.find(text)
+        if not found and not self._has_exact:
+            return None
+        for intent in self.intents:
+            if intent.matches(found, text):
+                return intent
+        return None
+
+    def reply(self, message: str, first_name: str) -> str:
+        intent = self.match(message)
+        templates = intent.replies if intent is not None else self.fallback
+        template = templates[0] if len(templates) == 1 else random.choice(templates)
+        return template.render(first_name, message)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import REGISTRY, CallbackMetric, Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class LaneUpdateProcessor(BaseUpdateProcessor):
+    """
+    并发处理更新，同一用户（或无用户时同一聊天）的更新按到达顺序串行
+    每个更新按键哈希到固定数量的通道之一，通道是一把先进先出的锁；不同通道的更新并行处理，
+    同时运行的更新数不超过 concurrency。
+    先取得通道再占用并发名额，排队等通道的更新不会占住名额挡住其他用户
+    """
+
+    CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 32))
+    LANES = int(os.environ.get('UPDATE_LANES', 1024))
+    # 同时进入通道排队或正在处理的更新上限。这不会让 Application 暂停分发：PTB 20.7 的 _update_fetcher
+    # 对每个更新先创建任务再等待这个信号量，超出上限的更新仍然各占一个任务，只是在信号量上等待，
+    # 不计入 bot_updates_in_flight。接收端的积压要靠 Telegram 侧的 getUpdates/webhook 节奏限制
+    MAX_PENDING = int(os.environ.get('UPDATE_MAX_PENDING', 4096))
+
+    # 正在运行的处理器，供 /metrics 读取
+    active = None
+
+    def __init__(self, concurrency: int = None, lanes: int = None, max_pending: int = None):
+        # 父类的信号量限制进入 do_process_update 的更新数；真正的并发上限在 do_process_update 中限制
+        super().__init__(max_pending or self.MAX_PENDING)
+        self.concurrency = concurrency or self.CONCURRENCY
+        self._running = asyncio.Semaphore(self.concurrency)
+        self._lanes = [asyncio.Lock() for _ in range(lanes or self.LANES)]
+        self.in_progress = 0
+        self.pending = 0
+
+    @staticmethod
+    def lane_key(update):
+        """同一个键的更新必须串行：优先按用户，其次按聊天；两者都没有时返回 None（不排队）"""
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.lane_key(update)
+        queued = time.perf_counter()
+        self.pending += 1
+        try:
+            if key is None:
+                async with self._running:
+                    await self._run(coroutine, queued)
+            else:
+                async with self._lanes[hash(key) % len(self._lanes)]:
+                    async with self._running:
+                        await self._run(coroutine, queued)
+        finally:
+            self.pending -= 1
+
+    async def _run(self, coroutine, queued: float):
+        UPDATE_QUEUE_WAIT.observe(time.perf_counter() - queued)
+        self.in_progress += 1
+        try:
+            await coroutine
+        finally:
+            self.in_progress -= 1
+
+    async def initialize(self):
+        LaneUpdateProcessor.active = self
+        logger.info(f"✅ 并发处理更新：最多 {self.concurrency} 个，{len(self._lanes)} 个顺序通道")
+
+    async def shutdown(self):
+        if LaneUpdateProcessor.active is self:
+            LaneUpdateProcessor.active = None
+
+
+UPDATE_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'bot_update_queue_wait_seconds', '更新等待通道与并发名额的时间'))
+
+
+def _update_state_metric():
+    processor = LaneUpdateProcessor.active
+    if processor is None:
+        return {}
+    return {
+        ('running',): processor.in_progress,
+        ('waiting',): processor.pending - processor.in_progress,
+    }
+
+
+REGISTRY.register(CallbackMetric(
+    'bot_updates_in_flight', '正在处理与排队中的更新数', _update_state_metric, labelnames=('state',)))
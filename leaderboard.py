@@ -0,0 +1,98 @@
+import logging
+from sortedcontainers import SortedList
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderboardIndex:
+    """
+    积分排行榜内存索引
+    按 (总积分降序, 连续签到降序) 维护有序表，前N名与任意用户排名都是 O(log n)
+    只能在事件循环线程中修改
+    """
+
+    def __init__(self):
+        # 有序键: (-total_points, -sign_in_streak, user_id)
+        self._sorted = SortedList()
+        # user_id -> 排行榜行（与 get_top_users 返回的字段一致）
+        self._entries = {}
+        # 每次变动加一，供渲染缓存判断排行榜是否变化
+        self.version = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(entry: dict):
+        return (-entry['total_points'], -entry['sign_in_streak'], entry['user_id'])
+
+    def load(self, rows):
+        """用数据库中的全部积分记录重建索引"""
+        self._entries = {}
+        for row in rows:
+            entry = {
+                'user_id': row['user_id'],
+                'username': row['username'],
+                'first_name': row['first_name'],
+                'total_points': row['total_points'] or 0,
+                'sign_in_count': row['sign_in_count'] or 0,
+                'sign_in_streak': row['sign_in_streak'] or 0,
+                'last_sign_in': row['last_sign_in'],
+            }
+            self._entries[entry['user_id']] = entry
+        self._sorted = SortedList(self._key(entry) for entry in self._entries.values())
+        self.version += 1
+        logger.info(f"✅ 排行榜索引加载完成，共 {len(self._entries)} 名用户")
+
+    def update(self, user_id: int, **fields):
+        """数据库提交后同步某个用户的积分状态；未提供的字段保持不变"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            entry = {
+                'user_id': user_id,
+                'username': None,
+                'first_name': None,
+                'total_points': 0,
+                'sign_in_count': 0,
+                'sign_in_streak': 0,
+                'last_sign_in': None,
+            }
+        else:
+            self._sorted.remove(self._key(entry))
+
+        for name, value in fields.items():
+            if name in entry and value is not None:
+                entry[name] = value
+
+        self._entries[user_id] = entry
+        self._sorted.add(self._key(entry))
+        self.version += 1
+
+    def rename(self, user_id: int, username: str, first_name: str):
+        """用户修改了资料：只更新榜上已有用户的显示名，名字有变化时才增加版本"""
+        entry = self._entries.get(user_id)
+        if entry is None or (entry['username'], entry['first_name']) == (username, first_name):
+            return
+        entry['username'] = username
+        entry['first_name'] = first_name
+        self.version += 1
+
+    def rank(self, user_id: int) -> int:
+        """用户排名：积分严格高于该用户的人数 + 1（同分同名次）"""
+        entry = self._entries.get(user_id)
+        points = entry['total_points'] if entry else 0
+        return self._sorted.bisect_left((-points,)) + 1
+
+    def get(self, user_id: int):
+        """某个用户的排行榜行，不在榜上时返回 None"""
+        entry = self._entries.get(user_id)
+        return dict(entry) if entry else None
+
+    def top(self, limit: int = 10) -> list:
+        """前 limit 名（带 rank 字段）"""
+        result = []
+        for position, (_, _, user_id) in enumerate(self._sorted.islice(0, limit), start=1):
+            row = dict(self._entries[user_id])
+            row['rank'] = position
+            result.append(row)
+        return result
@@ -1,43 +1,72 @@
 import os
+import sys
+import json
+import signal
+import asyncio
 import logging
-from datetime import datetime
-from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-import socket
-import threading
+from datetime import date, datetime, timedelta
+from telegram import Bot, Update
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, TypeHandler, filters, ContextTypes
 from dotenv import load_dotenv
+from webserver import HTTPServer, Response
+from metrics import REGISTRY, TimedRequest, instrumented, handler_report, monitor_event_loop_lag
+from intents import IntentMatcher
+from templates import TEMPLATES
+from sender import SendScheduler
+from lanes import LaneUpdateProcessor
+from floodguard import FloodGuard
+from cache import VersionedCache
+from signhistory import SignInHistory
 
 # 加载环境变量
 load_dotenv()
 
-# 在 main() 函数开始处添加：
-def tcp_health_check():
-    """简单的TCP健康检查服务器"""
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.bind(('0.0.0.0', 8080))
-    sock.listen(1)
-    print("🔌 TCP健康检查服务器启动在端口 8080")
-    
-    while True:
-        conn, addr = sock.accept()
-        conn.close()
-
-# 启动TCP服务器线程
-tcp_thread = threading.Thread(target=tcp_health_check, daemon=True)
-tcp_thread.start()
-
 # 1. 从环境变量获取Token和配置
 TOKEN = os.environ.get('TOKEN')
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
+# 运行模式：polling（默认）或 webhook；两种模式都在 PORT 上提供健康检查
+BOT_MODE = os.environ.get('BOT_MODE', 'polling').lower()
+PORT = int(os.environ.get('PORT', 8080))
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+
+# 自建 Bot API 服务器地址（如 http://localhost:8081/bot），默认使用官方 API
+BOT_API_URL = os.environ.get('BOT_API_URL')
+
+# 工作进程数：大于 1 时主进程只负责接收更新，按用户分发给各工作进程处理（见 workers.py）
+WORKERS = int(os.environ.get('WORKERS', 1))
+# 第 i 个工作进程在 127.0.0.1:WORKER_METRICS_PORT+i 提供指标，由主进程的 /metrics 汇总
+WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', PORT + 1000))
+
+# HTTP服务器（健康检查 + 指标 + webhook），在初始化数据库之前启动；工作进程中不启动
+HTTP_SERVER = None
+
+# 数据库初始化完成且机器人已启动后为 True，供 /readyz 使用
+READY = False
+
+# 事件循环延迟监控任务
+LOOP_LAG_TASK = None
+
 # 定义一个全局变量，用于存储数据库管理器
 DB_MANAGER = None
 
+# 智能回复的关键词意图规则
+INTENTS_FILE = os.environ.get('INTENTS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intents.json'))
+
+# 已注册的命令（不含斜杠），在 main() 中注册完处理器后填充
+TRACKED_COMMANDS = frozenset()
+
 if not TOKEN:
     print("❌ 错误：没有找到TOKEN环境变量！")
     print("请在Koyeb中设置TOKEN环境变量")
     exit(1)
 
+if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+    print("❌ 错误：webhook 模式需要设置 WEBHOOK_URL 环境变量！")
+    exit(1)
+
 if not DATABASE_URL:
     print("⚠️  警告：没有找到DATABASE_URL环境变量！")
     print("数据库功能将不可用，仅内存运行")
@@ -50,11 +79,58 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# 启动时编译一次意图规则，配置有误时直接退出
+try:
+    INTENTS = IntentMatcher.from_file(INTENTS_FILE)
+except (OSError, ValueError, KeyError) as e:
+    print(f"❌ 错误：加载意图规则 {INTENTS_FILE} 失败: {e}")
+    exit(1)
+
+try:
+    FLOOD_GUARD = FloodGuard()
+except ValueError as e:
+    print(f"❌ 错误：限流配置无效: {e}")
+    exit(1)
+
 print("=" * 50)
 print("🤖 机器人启动中...")
 print(f"📅 启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
 print("=" * 50)
 
+# 统计所有已注册命令的使用次数（group -1，先于各命令处理器执行）
+async def track_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """记录命令使用次数"""
+    if not DATABASE_URL or DB_MANAGER is None:
+        return
+    
+    # "/rank@MyBot 参数" -> "rank"
+    command = update.message.text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+    if command in TRACKED_COMMANDS:
+        await DB_MANAGER.update_command_stats(update.effective_user.id, f'/{command}')
+
+# 按用户限流：在所有处理器（包括命令统计）之前扣除令牌，超限的更新不进入任何处理器
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """丢弃超过频率限制的更新"""
+    user = update.effective_user
+    message = update.effective_message
+    if user is None or message is None or not message.text:
+        return
+    
+    if message.text.startswith('/'):
+        command = message.text.split(maxsplit=1)[0][1:].split('@', 1)[0].lower()
+        # 未注册的命令统一计为 other，避免指标标签无限增长
+        if command not in TRACKED_COMMANDS:
+            command = 'other'
+    else:
+        command = 'message'
+    
+    if FLOOD_GUARD.allow(user.id, command):
+        return
+    
+    if FLOOD_GUARD.should_notice(user.id):
+        await message.reply_text("⏳ 操作太频繁了，请稍后再试")
+    raise ApplicationHandlerStop
+
 # 3. 处理 /start 命令
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /start 命令"""
@@ -64,7 +140,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 保存用户信息到数据库
     if DATABASE_URL and DB_MANAGER is not None:
         try:
-            DB_MANAGER.save_user({  
+            await DB_MANAGER.save_user({  
                 'id': user.id,
                 'username': user.username,
                 'first_name': user.first_name,
@@ -74,34 +150,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             })
             
             # 保存消息记录
-            DB_MANAGER.save_message(user.id, chat_id, '/start', is_command=True)  
-            # 更新命令统计
-            DB_MANAGER.update_command_stats(user.id, '/start')  
+            await DB_MANAGER.save_message(user.id, chat_id, '/start', is_command=True)  
             
             logger.info(f"✅ 用户 {user.id} ({user.username}) 启动机器人")
         except Exception as e:
             logger.error(f"❌ 数据库操作失败: {e}")
     
     # 发送欢迎消息
-    welcome_text = f"""
-🎉 你好 {user.first_name}！
-
-欢迎使用我的机器人！我已经记住了你的信息。
-
-📊 你可以使用以下命令：
-/start - 显示此消息
-/help - 查看详细帮助
-/ping - 测试机器人响应
-/stats - 查看你的使用统计
-/admin - 管理员功能（如有权限）
-
-💰 积分命令：
-/sign - 每日签到获取1积分
-/points - 查看我的积分详情
-/rank - 查看积分排行榜
-
-💡 试试发送任意消息，我会回应你！
-    """
+    welcome_text = TEMPLATES.render('start', first_name=user.first_name)
     await update.message.reply_text(welcome_text)
 
 # 4. 处理 /help 命令
@@ -112,57 +168,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 统一使用 DB_MANAGER 和可用性检查
     if DATABASE_URL and DB_MANAGER is not None:
         try:
-            DB_MANAGER.save_message(user.id, chat_id, '/help', is_command=True)
-            DB_MANAGER.update_command_stats(user.id, '/help')
+            await DB_MANAGER.save_message(user.id, chat_id, '/help', is_command=True)
         except Exception as e:
             logger.error(f"❌ 数据库操作失败: {e}")
     
-    help_text = """
-🤖 *机器人命令手册*
-
-🎯 *基础命令*
-/start - 开始使用机器人
-/help - 查看此帮助信息
-/ping - 测试机器人是否在线
-
-💰 *积分签到系统*
-/sign - 每日签到获取积分（每天一次）
-/points - 查看我的积分详情
-/rank - 查看积分排行榜
-/leaderboard - 排行榜（/rank 的别名）
-
-📊 *统计命令*
-/stats - 查看你的使用统计
-
-🛠️ *功能命令*
-/echo <文本> - 回声测试
-/time - 显示当前时间
-
-👮 *管理员命令* (仅管理员可用)
-/addpoints <用户ID> <积分> [原因] - 调整用户积分
-/setpoints <用户ID> <积分> - 直接设置用户积分
-/admin - 查看机器人统计
-
-🎮 *积分规则*
-• 每日签到：+1 基础积分
-• 连续3天：额外 +1 积分
-• 连续7天：额外 +2 积分
-• 每天只能签到一次
-• 午夜后重置签到机会
-
-💬 *智能聊天*
-直接发送消息，我会智能回复：
-- 你好、hi、hello
-- 时间、几点
-- 日期、今天几号
-- 其他消息我会随机回复
-
-📞 *客服联系*
-@TelegranSheng
-@WIBSIBKB
-
-💡 *提示*：使用 /sign 开始你的签到之旅吧！
-    """
+    help_text = TEMPLATES.render('help')
     await update.message.reply_text(help_text, parse_mode='None')
 
 # 5. 处理 /ping 命令
@@ -172,8 +182,7 @@ async def ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if DATABASE_URL and DB_MANAGER is not None:
         try:
-            DB_MANAGER.save_message(user.id, chat_id, '/ping', is_command=True)
-            DB_MANAGER.update_command_stats(user.id, '/ping')
+            await DB_MANAGER.save_message(user.id, chat_id, '/ping', is_command=True)
         except Exception as e:
             logger.error(f"❌ 数据库操作失败: {e}")
     
@@ -189,38 +198,56 @@ async def user_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        stats = DB_MANAGER.get_user_stats(user.id)  
+        stats = await DB_MANAGER.get_user_stats(user.id)  
         
         if stats:
-            response = f"""
-📊 *{user.first_name} 的使用统计*
-
-👤 用户信息：
-- ID: `{stats['telegram_id']}`
-- 用户名: @{stats['username'] or '无'}
-- 加入时间: {stats['join_date'].strftime('%Y-%m-%d %H:%M')}
-
-📈 活跃度统计：
-- 总消息数: {stats['message_count']} 条
-- /start 使用次数: {stats['start_count']}
-- /help 使用次数: {stats['help_count']}
-- /ping 使用次数: {stats['ping_count']}
-
-🕐 最后命令: {stats['last_command_used'] or '无'}
-最后时间: {stats['last_command_time'].strftime('%Y-%m-%d %H:%M') if stats['last_command_time'] else '无'}
-            """
+            # 按使用次数列出所有用过的命令
+            command_counts = sorted(stats['command_counts'].items(), key=lambda item: item[1], reverse=True)
+            command_lines = "\n".join(
+                TEMPLATES.render('stats_command_line', command=command, count=count)
+                for command, count in command_counts
+            ) or "- 暂无命令记录"
+            
+            response = TEMPLATES.render(
+                'stats',
+                first_name=user.first_name,
+                telegram_id=stats['telegram_id'],
+                username=stats['username'] or '无',
+                join_date=stats['join_date'].strftime('%Y-%m-%d %H:%M'),
+                message_count=stats['message_count'],
+                command_lines=command_lines,
+                last_command=stats['last_command_used'] or '无',
+                last_command_time=stats['last_command_time'].strftime('%Y-%m-%d %H:%M') if stats['last_command_time'] else '无',
+            )
         else:
             response = "📭 还没有你的使用记录，请先使用一些命令吧！"
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
         # 记录此命令
-        DB_MANAGER.save_message(user.id, update.effective_chat.id, '/stats', is_command=True)  
+        await DB_MANAGER.save_message(user.id, update.effective_chat.id, '/stats', is_command=True)  
         
     except Exception as e:
         logger.error(f"❌ 获取统计失败: {e}")
         await update.message.reply_text("❌ 获取统计信息时出错")
 
+def format_handler_report(limit: int = 15) -> str:
+    """把各处理器的滚动分位数排成等宽表格：总耗时 p50/p95/p99，数据库与 Telegram 请求 p95"""
+    rows = handler_report()[:limit]
+    if not rows:
+        return ''
+    
+    lines = [f"{'handler':<14}{'count':>6}{'err':>4}{'p50':>6}{'p95':>6}{'p99':>6}{'DB95':>6}{'TG95':>6}"]
+    for row in rows:
+        p50, p95, p99 = (round(v * 1000) for v in row['wall'])
+        db95 = round(row['db'][1] * 1000)
+        send95 = round(row['send'][1] * 1000)
+        lines.append(
+            f"{row['handler'][:14]:<14}{row['count']:>6}{row['errors']:>4}"
+            f"{p50:>6}{p95:>6}{p99:>6}{db95:>6}{send95:>6}"
+        )
+    return '\n'.join(lines)
+
 # 处理 /admin 命令（基础版）
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """管理员查看机器人统计"""
@@ -236,23 +263,20 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        bot_stats = DB_MANAGER.get_bot_stats()  
+        bot_stats = await DB_MANAGER.get_bot_stats()  
         
-        response = f"""
-🤖 *机器人全局统计*
-
-👥 用户数据：
-- 总用户数: {bot_stats['total_users'] or 0}
-- 总消息数: {bot_stats['total_messages'] or 0}
-- 命令总数: {bot_stats['total_commands'] or 0}
-
-⏰ 最后活动: {bot_stats['last_message_time'].strftime('%Y-%m-%d %H:%M') if bot_stats['last_message_time'] else '无'}
-
-🛠️ 系统状态：
-- 启动时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-- 健康检查: ✅ 运行中 (端口 8080)
-- 数据库: {'✅ 已连接' if DATABASE_URL else '❌ 未配置'}
-        """
+        perf = format_handler_report()
+        response = TEMPLATES.render(
+            'admin',
+            total_users=bot_stats['total_users'] or 0,
+            total_messages=bot_stats['total_messages'] or 0,
+            total_commands=bot_stats['total_commands'] or 0,
+            last_message_time=bot_stats['last_message_time'].strftime('%Y-%m-%d %H:%M') if bot_stats['last_message_time'] else '无',
+            now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            port=PORT,
+            database='✅ 已连接' if DATABASE_URL else '❌ 未配置',
+            perf_section=TEMPLATES.render('admin_perf', perf=perf) if perf else '',
+        )
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
@@ -271,7 +295,7 @@ async def echo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         if DATABASE_URL and DB_MANAGER is not None:  
             try:
-                DB_MANAGER.save_message(user.id, update.effective_chat.id, f'/echo {text}', is_command=True)  
+                await DB_MANAGER.save_message(user.id, update.effective_chat.id, f'/echo {text}', is_command=True)  
             except Exception as e:
                 logger.error(f"❌ 数据库操作失败: {e}")
     else:
@@ -286,17 +310,15 @@ async def sign_in_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        # 执行签到
-        success, message, points_awarded = DB_MANAGER.daily_sign_in(
+        # 执行签到（签到后的积分状态随结果一并返回）
+        success, message, points_info = await DB_MANAGER.daily_sign_in(
             telegram_id=user.id,
             username=user.username,
             first_name=user.first_name
         )
+        points_awarded = points_info.get('points_awarded', 0) if points_info else 0
         
         if success:
-            # 获取签到后的详细信息
-            points_info = DB_MANAGER.get_user_points_info(user.id)
-            
             if points_info:
                 # 构建成功响应
                 from datetime import datetime
@@ -324,60 +346,36 @@ async def sign_in_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 base_points = 1
                 bonus_points = points_awarded - base_points
                 
-                response = f"""
-{streak_emoji} *签到成功！*
-
-👤 {user.first_name}，签到成功！
-
-💰 *积分详情*
-├ 基础奖励: +{base_points}分
-{f"├ 连续签到奖励: +{bonus_points}分" if bonus_points > 0 else ""}
-└ 本次获得: **+{points_awarded}分**
-
-📊 *签到统计*
-├ 当前积分: **{points_info.get('total_points', 0)}分**
-├ 连续签到: {streak}天 {streak_emoji}
-├ 总签到次数: {points_info.get('sign_in_count', 1)}次
-└ 今日排名: 第{points_info.get('rank', 1)}名
-
-⏰ *时间信息*
-├ 签到时间: {now.strftime('%Y-%m-%d %H:%M:%S')}
-└ 下次签到: 明天{now.strftime('%H:%M')}后
-
-{encouragement}
-
-💡 使用 /points 查看详细积分
-💎 使用 /rank 查看排行榜
-                """
+                response = TEMPLATES.render(
+                    'sign_success',
+                    streak_emoji=streak_emoji,
+                    first_name=user.first_name,
+                    base_points=base_points,
+                    bonus_line=TEMPLATES.render('sign_bonus_line', bonus_points=bonus_points) if bonus_points > 0 else '',
+                    points_awarded=points_awarded,
+                    total_points=points_info.get('total_points', 0),
+                    streak=streak,
+                    sign_in_count=points_info.get('sign_in_count', 1),
+                    rank=points_info.get('rank', 1),
+                    sign_time=now.strftime('%Y-%m-%d %H:%M:%S'),
+                    next_time=now.strftime('%H:%M'),
+                    encouragement=encouragement,
+                )
             else:
-                response = f"""
-✅ 签到成功！
-获得 {points_awarded} 积分！
-
-{message}
-
-使用 /points 查看你的积分详情。
-                """
+                response = TEMPLATES.render('sign_plain_success', points_awarded=points_awarded, message=message)
         else:
             # 签到失败（可能已经签到过）
-            points_info = DB_MANAGER.get_user_points_info(user.id)
-            
             if points_info and points_info.get('signed_in_today'):
                 last_sign = points_info.get('last_sign_in')
                 last_time = last_sign.strftime('%H:%M:%S') if last_sign else "未知时间"
                 
-                response = f"""
-⏰ *签到提醒*
-
-{user.first_name}，你今天已经签到过了哦！
-
-📅 签到时间: {last_time}
-💰 当前积分: **{points_info.get('total_points', 0)}分**
-🔥 连续签到: {points_info.get('current_streak', 0)}天
-
-💡 明天记得再来签到！
-⏳ 下次可签到: 明天 00:00 后
-                """
+                response = TEMPLATES.render(
+                    'sign_already',
+                    first_name=user.first_name,
+                    last_time=last_time,
+                    total_points=points_info.get('total_points', 0),
+                    current_streak=points_info.get('current_streak', 0),
+                )
             else:
                 response = f"❌ {message}"
         
@@ -388,7 +386,7 @@ async def sign_in_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # 保存消息记录
         if DB_MANAGER:
-            DB_MANAGER.save_message(user.id, update.effective_chat.id, '/sign', is_command=True)
+            await DB_MANAGER.save_message(user.id, update.effective_chat.id, '/sign', is_command=True)
         
     except Exception as e:
         logger.error(f"❌ 处理签到命令失败: {e}")
@@ -406,6 +404,13 @@ async def sign_in_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if 'e' in locals():
         await update.message.reply_text("❌ 签到失败，系统错误，请稍后重试")
         
+# 积分变动原因的显示名称
+POINTS_REASONS = {
+    'sign_in': '每日签到',
+    'sign_in_streak_3': '连续3天奖励',
+    'sign_in_streak_7': '连续7天奖励'
+}
+
 # 10. 处理 /points 命令 - 查看积分详情
 async def points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /points 命令 - 查看积分详情"""
@@ -417,96 +422,147 @@ async def points_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # 获取积分信息
-        points_info = DB_MANAGER.get_user_points_info(user.id)
+        points_info = await DB_MANAGER.get_user_points_info(user.id)
         
         if not points_info:
-            response = f"""
-💰 *积分详情*
-
-👤 {user.first_name}，你还没有积分记录。
-
-💡 使用 /sign 进行每日签到，获得积分！
-🎯 每天只能签到一次，每次获得1积分
-✨ 连续签到还有额外奖励！
-            """
+            response = TEMPLATES.render('points_empty', first_name=user.first_name)
         else:
             # 构建积分详情响应
             signed_today = "✅ 今日已签到" if points_info.get('signed_in_today') else "⏳ 今日未签到"
             last_sign = points_info.get('last_sign_in')
             last_sign_str = last_sign.strftime('%Y-%m-%d %H:%M') if last_sign else "从未签到"
             
-            # 构建最近7天签到日历
-            recent_sign_ins = points_info.get('recent_sign_ins', [])
-            week_calendar = []
-            for i in range(6, -1, -1):
-                sign_date = None
-                for sign_in in recent_sign_ins:
-                    if sign_in['display_date'] == 'today' and i == 0:
-                        sign_date = '✅'
-                        break
-                    elif sign_in['display_date'] == 'yesterday' and i == 1:
-                        sign_date = '✓'
-                        break
-                if not sign_date:
-                    sign_date = '○'
-                week_calendar.append(sign_date)
+            # 最近7天签到日历，直接读签到位图；“今天”以数据库日期为准，与签到一致
+            today = points_info.get('today') or date.today()
+            history = points_info.get('sign_in_history') or SignInHistory()
+            week = history.days(today - timedelta(days=6), today)
+            week_calendar = ['✓' if signed else '○' for signed in week[:-1]]
+            week_calendar.append('✅' if week[-1] else '○')
             
-            response = f"""
-💰 *积分详情*
-
-👤 **{user.first_name}** (@{user.username or '无用户名'})
-
-📊 *积分概览*
-├ 总积分: **{points_info.get('total_points', 0)} 分**
-├ 签到次数: {points_info.get('sign_in_count', 0)} 次
-├ 当前连胜: {points_info.get('current_streak', 0)} 天
-├ 最高连胜: {points_info.get('max_streak', 0)} 天
-├ 今日状态: {signed_today}
-└ 上次签到: {last_sign_str}
-
-📈 *最近7天签到日历*
-{" ".join(week_calendar)}
-← 最近7天
-✓=已签 ○=未签 ✅=今日
-
-🏆 *排行榜*
-当前排名: 第 {points_info.get('rank', 1)} 名
-
-📝 *最近积分变动*
-"""
-        
-            # 添加最近积分记录
-            recent_transactions = points_info.get('recent_transactions', [])
-            if recent_transactions:
-                for trans in recent_transactions:
-                    change = trans['points_change']
-                    change_str = f"+{change}" if change > 0 else f"{change}"
-                    reason_map = {
-                        'sign_in': '每日签到',
-                        'sign_in_streak_3': '连续3天奖励',
-                        'sign_in_streak_7': '连续7天奖励'
-                    }
-                    reason = reason_map.get(trans['reason'], trans.get('description', trans['reason']))
-                    response += f"• {trans['time_str']} {change_str} 分 ({reason})\n"
-            else:
-                response += "暂无积分记录\n"
-        
-            # 添加提示信息
-            if not points_info.get('signed_in_today'):
-                response += f"\n🎯 使用 /sign 进行今日签到，获得积分！"
-            else:
-                response += f"\n💡 每天坚持签到，积分越来越多！"
+            # 最近积分记录
+            transactions = ''.join(
+                TEMPLATES.render(
+                    'points_transaction',
+                    time_str=trans['time_str'],
+                    change=f"+{trans['points_change']}" if trans['points_change'] > 0 else trans['points_change'],
+                    reason=POINTS_REASONS.get(trans['reason'], trans.get('description', trans['reason'])),
+                )
+                for trans in points_info.get('recent_transactions', [])
+            ) or "暂无积分记录\n"
+            
+            response = TEMPLATES.render(
+                'points_detail',
+                first_name=user.first_name,
+                username=user.username or '无用户名',
+                total_points=points_info.get('total_points', 0),
+                sign_in_count=points_info.get('sign_in_count', 0),
+                current_streak=points_info.get('current_streak', 0),
+                max_streak=points_info.get('max_streak', 0),
+                signed_today=signed_today,
+                last_sign=last_sign_str,
+                calendar=" ".join(week_calendar),
+                rank=points_info.get('rank', 1),
+                transactions=transactions,
+                tip="💡 每天坚持签到，积分越来越多！" if points_info.get('signed_in_today') else "🎯 使用 /sign 进行今日签到，获得积分！",
+            )
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
         # 保存消息记录
         if DB_MANAGER:
-            DB_MANAGER.save_message(user.id, update.effective_chat.id, '/points', is_command=True)
+            await DB_MANAGER.save_message(user.id, update.effective_chat.id, '/points', is_command=True)
         
     except Exception as e:
         logger.error(f"❌ 查询积分失败: {e}")
         await update.message.reply_text("❌ 查询积分失败，请稍后再试")
 
+# 月历格子：已签、漏签、今天未签、尚未到来、月初补位
+CALENDAR_CELLS = {'signed': '🟩', 'missed': '⬜', 'today': '🟨', 'future': '▫️', 'pad': '\u3000'}
+
+def render_month_calendar(history: SignInHistory, year: int, month: int, today: date) -> str:
+    """按周一到周日排列的月历，每行一周"""
+    cells = [CALENDAR_CELLS['pad']] * date(year, month, 1).weekday()
+    for day, signed in enumerate(history.month(year, month), start=1):
+        current = date(year, month, day)
+        if signed:
+            cells.append(CALENDAR_CELLS['signed'])
+        elif current < today:
+            cells.append(CALENDAR_CELLS['missed'])
+        elif current == today:
+            cells.append(CALENDAR_CELLS['today'])
+        else:
+            cells.append(CALENDAR_CELLS['future'])
+    return '\n'.join(' '.join(cells[i:i + 7]) for i in range(0, len(cells), 7))
+
+# 10.1 处理 /calendar 命令 - 月度签到日历
+async def calendar_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理 /calendar 命令 - 查看本月（或 /calendar 年-月 指定月份）的签到日历"""
+    user = update.effective_user
+    
+    if not DATABASE_URL or DB_MANAGER is None:
+        await update.message.reply_text("❌ 数据库未配置，签到日历不可用")
+        return
+    
+    year = month = None
+    if context.args:
+        try:
+            year, month = map(int, context.args[0].split('-'))
+            date(year, month, 1)
+        except ValueError:
+            await update.message.reply_text("用法: /calendar [年-月]，例如 /calendar 2026-09")
+            return
+    
+    try:
+        # 与 /points 共用积分快照（含签到位图），任意月份都不需要额外查询
+        points_info = await DB_MANAGER.get_user_points_info(user.id) or {}
+        history = points_info.get('sign_in_history') or SignInHistory()
+        # “今天”以数据库日期为准，与签到一致
+        today = points_info.get('today') or date.today()
+        if year is None:
+            year, month = today.year, today.month
+        first = date(year, month, 1)
+        last = (first + timedelta(days=31)).replace(day=1) - timedelta(days=1)
+        
+        response = TEMPLATES.render(
+            'calendar',
+            year=year,
+            month=month,
+            first_name=user.first_name,
+            grid=render_month_calendar(history, year, month, today),
+            month_count=history.count(first, last),
+            month_days=last.day,
+            current_streak=points_info.get('current_streak', 0),
+            max_streak=points_info.get('max_streak', 0),
+            sign_in_count=points_info.get('sign_in_count', 0),
+            tip="💡 今日已签到，明天继续保持！" if points_info.get('signed_in_today') else "🎯 使用 /sign 进行今日签到，获得积分！",
+        )
+        await update.message.reply_text(response, parse_mode='Markdown')
+        
+        # 保存消息记录
+        if DB_MANAGER:
+            await DB_MANAGER.save_message(user.id, update.effective_chat.id, '/calendar', is_command=True)
+        
+    except Exception as e:
+        logger.error(f"❌ 查询签到日历失败: {e}")
+        await update.message.reply_text("❌ 查询签到日历失败，请稍后再试")
+
+# 渲染好的前10名，排行榜版本不变时直接复用
+LEADERBOARD_ROWS = VersionedCache()
+LEADERBOARD_MEDALS = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+
+def render_leaderboard_rows(top_users) -> str:
+    """渲染排行榜前N名，没有数据时返回空字符串"""
+    return ''.join(
+        TEMPLATES.render(
+            'rank_row',
+            medal=LEADERBOARD_MEDALS[i] if i < len(LEADERBOARD_MEDALS) else f"{i+1}.",
+            name=user_data['first_name'] or user_data['username'] or f"用户{user_data['user_id']}",
+            points=user_data['total_points'],
+            streak=f" (🔥{user_data['sign_in_streak']}天)" if user_data['sign_in_streak'] > 1 else '',
+        )
+        for i, user_data in enumerate(top_users)
+    )
+
 # 11. 处理 /rank 命令 - 查看积分排行榜
 async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """处理 /rank 命令 - 查看积分排行榜"""
@@ -517,59 +573,35 @@ async def rank_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     try:
-        # 获取排行榜
-        top_users = DB_MANAGER.get_top_users(limit=10)
+        # 前10名部分只依赖排行榜数据，按排行榜版本缓存渲染结果
+        version = await DB_MANAGER.leaderboard_version()
+        rows = LEADERBOARD_ROWS.get(version)
+        if rows is None:
+            rows = render_leaderboard_rows(await DB_MANAGER.get_top_users(limit=10))
+            LEADERBOARD_ROWS.put(version, rows)
         
-        if not top_users:
-            response = """
-🏆 *积分排行榜*
-
-暂无用户数据。
-
-💡 使用 /sign 开始签到，成为排行榜第一名！
-            """
+        if not rows:
+            response = TEMPLATES.render('rank_empty')
         else:
             # 获取当前用户排名
-            user_points_info = DB_MANAGER.get_user_points_info(user.id)
+            user_points_info = await DB_MANAGER.get_user_rank(user.id)
             user_rank_num = user_points_info.get('rank', 0) if user_points_info else 0
             
-            response = f"""
-🏆 *积分排行榜*
-
-🏅 *Top 10 签到达人*
-"""
-            
-            # 显示前10名
-            medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
-            for i, user_data in enumerate(top_users):
-                if i < len(medals):
-                    medal = medals[i]
-                else:
-                    medal = f"{i+1}."
-                
-                name = user_data['first_name'] or user_data['username'] or f"用户{user_data['user_id']}"
-                points = user_data['total_points']
-                streak = user_data['sign_in_streak']
-                
-                response += f"{medal} {name}: {points} 分"
-                if streak > 1:
-                    response += f" (🔥{streak}天)"
-                response += "\n"
-            
             # 显示当前用户排名（如果不在前10）
             if user_points_info and user_rank_num > 10:
-                user_points = user_points_info.get('total_points', 0)
-                response += f"\n📊 你的排名: 第 {user_rank_num} 名 ({user_points} 分)"
+                user_line = TEMPLATES.render('rank_user_outside', rank=user_rank_num,
+                                             points=user_points_info.get('total_points', 0))
             elif user_points_info:
-                response += f"\n📊 恭喜你在排行榜上！"
-        
-        response += "\n\n💡 每日签到可获得积分，连续签到有额外奖励！"
+                user_line = TEMPLATES.render('rank_user_inside')
+            else:
+                user_line = ''
+            response = TEMPLATES.render('rank_board', rows=rows, user_line=user_line)
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
         # 保存消息记录
         if DB_MANAGER:
-            DB_MANAGER.save_message(user.id, update.effective_chat.id, '/rank', is_command=True)
+            await DB_MANAGER.save_message(user.id, update.effective_chat.id, '/rank', is_command=True)
         
     except Exception as e:
         logger.error(f"❌ 查询排行榜失败: {e}")
@@ -606,34 +638,31 @@ async def add_points_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         reason = ' '.join(context.args[2:]) if len(context.args) > 2 else "管理员调整"
         
         # 调用积分修改方法
-        success, message = DB_MANAGER.add_points_to_user(target_user_id, points, reason)
+        success, message, _ = await DB_MANAGER.add_points_to_user(target_user_id, points, reason)
         
         if success:
             # 获取修改后的积分信息
-            points_info = DB_MANAGER.get_user_points_info(target_user_id)
+            points_info = await DB_MANAGER.get_user_points_info(target_user_id)
             
-            response = f"""
-✅ *积分调整成功*
-
-👤 目标用户ID: `{target_user_id}`
-💰 积分变动: **{points}** 分
-📝 原因: {reason}
-
-📊 *调整后状态*
-- 总积分: **{points_info.get('total_points', 0)}** 分
-- 签到次数: {points_info.get('sign_in_count', 0)} 次
-- 连续签到: {points_info.get('current_streak', 0)} 天
-
-⏰ 操作时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-👮 操作人: {user.first_name} (@{user.username})
-            """
+            response = TEMPLATES.render(
+                'addpoints_success',
+                target_user_id=target_user_id,
+                points=points,
+                reason=reason,
+                total_points=points_info.get('total_points', 0),
+                sign_in_count=points_info.get('sign_in_count', 0),
+                current_streak=points_info.get('current_streak', 0),
+                now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                first_name=user.first_name,
+                username=user.username,
+            )
         else:
             response = f"❌ {message}"
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
         # 记录操作日志
-        DB_MANAGER.save_message(user.id, chat_id, 
+        await DB_MANAGER.save_message(user.id, chat_id, 
                                f'/addpoints {target_user_id} {points} {reason}', 
                                is_command=True)
         
@@ -667,25 +696,23 @@ async def set_points_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         points = int(context.args[1])
         
         # 调用设置积分方法
-        success, message = DB_MANAGER.set_user_points(target_user_id, points)
+        success, message, _ = await DB_MANAGER.set_user_points(target_user_id, points)
         
         if success:
-            response = f"""
-✅ *积分设置成功*
-
-👤 目标用户ID: `{target_user_id}`
-🎯 设置积分: **{points}** 分
-
-⏰ 操作时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-👮 操作人: {user.first_name}
-            """
+            response = TEMPLATES.render(
+                'setpoints_success',
+                target_user_id=target_user_id,
+                points=points,
+                now=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                first_name=user.first_name,
+            )
         else:
             response = f"❌ {message}"
         
         await update.message.reply_text(response, parse_mode='Markdown')
         
         # 记录操作日志
-        DB_MANAGER.save_message(user.id, chat_id, 
+        await DB_MANAGER.save_message(user.id, chat_id, 
                                f'/setpoints {target_user_id} {points}', 
                                is_command=True)
         
@@ -705,50 +732,12 @@ async def smart_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 保存消息到数据库
     if DATABASE_URL and DB_MANAGER is not None:  # 修改点
         try:
-            DB_MANAGER.save_message(user.id, chat_id, user_message)  # 修改点
+            await DB_MANAGER.save_message(user.id, chat_id, user_message)  # 修改点
         except Exception as e:
             logger.error(f"❌ 保存消息失败: {e}")
     
-    # 智能回复逻辑
-    user_message_lower = user_message.lower()
-    
-    greetings = ['你好', 'hi', 'hello', 'hey', 'hola']
-    time_keywords = ['时间', 'time', '几点', '钟点']
-    date_keywords = ['日期', 'date', '今天几号', '年月日']
-    thanks = ['谢谢', 'thank', 'thanks', 'merci', 'gracias']
-    
-    if any(greet in user_message_lower for greet in greetings):
-        reply = f'👋 你好呀 {user.first_name}！'
-    
-    elif any(keyword in user_message_lower for keyword in time_keywords):
-        now = datetime.now().strftime('%H:%M:%S')
-        reply = f'🕐 当前时间：{now}'
-    
-    elif any(keyword in user_message_lower for keyword in date_keywords):
-        today = datetime.now().strftime('%Y年%m月%d日')
-        weekday = ['一', '二', '三', '四', '五', '六', '日'][datetime.now().weekday()]
-        reply = f'📅 今天是：{today} 星期{weekday}'
-    
-    elif any(thank in user_message_lower for thank in thanks):
-        reply = '😊 不客气！随时为你服务！'
-    
-    elif '天气' in user_message_lower:
-        reply = '🌤️ 天气功能正在开发中，敬请期待！'
-    
-    elif '谁' in user_message_lower and ('你' in user_message_lower or '谁' == user_message_lower):
-        reply = f'🤖 我是你的专属机器人，由 {user.first_name} 的好友打造！'
-    
-    else:
-        # 默认回复，可以更智能一些
-        replies = [
-            f'收到你的消息了，{user.first_name}！',
-            f'「{user_message}」... 有意思的观点！',
-            f'{user.first_name}，我在听呢！',
-            '嗯，我记下了！',
-            '继续说吧，我听着呢！'
-        ]
-        import random
-        reply = random.choice(replies)
+    # 智能回复：关键词规则已在启动时编译，一次扫描完成匹配
+    reply = INTENTS.reply(user_message, user.first_name)
     
     await update.message.reply_text(reply)
 
@@ -765,27 +754,225 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except:
             pass
 
-# 15. 主函数
-def main():
-    global DB_MANAGER  
+# 15. HTTP 路由：健康检查、指标与 webhook
+async def health_check(request):
+    """存活检查：事件循环能响应即可"""
+    return Response(200, 'OK')
+
+async def readiness_check(request):
+    """就绪检查：数据库初始化完成、机器人已启动，配置了数据库时还要求连接池可用"""
+    if not READY:
+        return Response(503, 'starting')
+    if DB_MANAGER is not None and not await DB_MANAGER.ping():
+        return Response(503, 'database unavailable')
+    return Response(200, 'OK')
+
+async def metrics_endpoint(request):
+    """Prometheus 文本格式指标"""
+    return Response(200, REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def telegram_webhook(application: Application, request):
+    """接收 Telegram 推送的更新并交给 Application 处理"""
+    if WEBHOOK_SECRET and request.headers.get('x-telegram-bot-api-secret-token') != WEBHOOK_SECRET:
+        return Response(403, 'Forbidden')
+    
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return Response(400, 'Bad Request')
+    
+    await application.update_queue.put(Update.de_json(data, application.bot))
+    return Response(200, 'OK')
 
-    print("🚀 正在启动机器人...")
+# 16. 定时任务与生命周期
+async def flush_db_buffers(context: ContextTypes.DEFAULT_TYPE):
+    """定时把写缓冲中的数据批量写入数据库"""
+    try:
+        await DB_MANAGER.flush()
+    except Exception as e:
+        logger.error(f"❌ 刷新写缓冲失败: {e}")
+
+async def maintain_partitions(context: ContextTypes.DEFAULT_TYPE):
+    """定时维护消息表分区"""
+    try:
+        await DB_MANAGER.maintain_partitions()
+    except Exception as e:
+        logger.error(f"❌ 维护消息分区失败: {e}")
+
+async def expire_sign_in_streaks(context: ContextTypes.DEFAULT_TYPE):
+    """定时清零已中断的连续签到"""
+    try:
+        await DB_MANAGER.expire_sign_in_streaks()
+    except Exception as e:
+        logger.error(f"❌ 清零中断的连续签到失败: {e}")
+
+async def refresh_leaderboard(context: ContextTypes.DEFAULT_TYPE):
+    """定时刷新物化排行榜"""
+    try:
+        await DB_MANAGER.refresh_leaderboard()
+    except Exception as e:
+        logger.error(f"❌ 刷新排行榜失败: {e}")
+
+def create_http_server() -> HTTPServer:
+    """创建带健康检查与指标路由的 HTTP 服务器"""
+    server = HTTPServer(port=PORT)
+    server.route('GET', '/', health_check)
+    server.route('GET', '/health', health_check)
+    server.route('GET', '/healthz', health_check)
+    server.route('GET', '/readyz', readiness_check)
+    server.route('GET', '/metrics', metrics_endpoint)
+    return server
+
+async def on_startup(application: Application):
+    """机器人启动后启动事件循环延迟监控"""
+    global LOOP_LAG_TASK
+    
+    LOOP_LAG_TASK = asyncio.create_task(monitor_event_loop_lag())
+
+async def on_shutdown(application: Application):
+    """机器人停止时关闭 HTTP 服务器，并确保写缓冲全部落库"""
+    if HTTP_SERVER is not None:
+        await HTTP_SERVER.stop()
+    
+    if LOOP_LAG_TASK is not None:
+        LOOP_LAG_TASK.cancel()
+    
+    if DB_MANAGER is not None:
+        await DB_MANAGER.flush()
+        logger.info("✅ 写缓冲已全部落库")
+
+async def run_application(application: Application):
+    """
+    在 HTTP 服务器所在的事件循环中运行机器人
+    polling 模式由 Updater 拉取更新；webhook 模式更新由 HTTP 服务器接收后放入 update_queue
+    生命周期与 run_polling 一致：initialize → post_init → start → stop → shutdown → post_shutdown
+    """
+    global READY
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    
+    if BOT_MODE == 'webhook':
+        HTTP_SERVER.route('POST', WEBHOOK_PATH, 
+                          lambda request: telegram_webhook(application, request))
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True
+        )
+    else:
+        await application.updater.start_polling(
+            drop_pending_updates=True,
+            allowed_updates=Update.ALL_TYPES
+        )
+    await application.start()
+    READY = True
+    if BOT_MODE == 'webhook':
+        print(f"🌐 webhook 模式运行中: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    
+    try:
+        await stop_event.wait()
+    finally:
+        READY = False
+        # 先停止接收新的更新，再停止处理
+        if BOT_MODE == 'webhook':
+            await HTTP_SERVER.stop()
+        elif application.updater.running:
+            await application.updater.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+# 17. 主函数
+def init_database(init_schema: bool = True, required: bool = False):
+    """
+    初始化数据库；失败时以无数据库模式运行
+    required 为 True 时（工作进程）失败即以非零状态退出，由主进程重启
+    """
+    global DB_MANAGER
     
-    # 初始化数据库
     if DATABASE_URL:
         try:
-            from database import DatabaseManager
-            DatabaseManager.initialize()
-            DB_MANAGER = DatabaseManager  
+            from database import AsyncDatabaseManager
+            AsyncDatabaseManager.initialize(init_schema)
+            DB_MANAGER = AsyncDatabaseManager  
             print("✅ 数据库连接成功")
         except Exception as e:
             print(f"❌ 数据库初始化失败: {e}")
+            if required:
+                sys.exit(1)
             print("⚠️  机器人将以无数据库模式运行")
     else:
         print("⚠️  未配置DATABASE_URL，机器人将以无数据库模式运行")
+
+def build_application(primary: bool = True, updater: bool = True) -> Application:
+    """
+    创建并配置 Application：定时任务、处理器、耗时统计与限流
+    primary 为 False 时不运行全局维护任务（多进程时只由 0 号工作进程运行）；
+    updater 为 False 时不创建 Updater，更新由调用方放入 update_queue
+    """
+    global TRACKED_COMMANDS
     
     # 创建应用
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .request(TimedRequest(connection_pool_size=256))
+        .rate_limiter(SendScheduler())
+        .concurrent_updates(LaneUpdateProcessor())
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if BOT_API_URL:
+        builder = builder.base_url(BOT_API_URL)
+    if not updater:
+        builder = builder.updater(None)
+    application = builder.build()
+    
+    # 定时刷新数据库写缓冲
+    if DB_MANAGER is not None:
+        application.job_queue.run_repeating(
+            flush_db_buffers,
+            interval=DB_MANAGER.MESSAGE_FLUSH_INTERVAL,
+            first=DB_MANAGER.MESSAGE_FLUSH_INTERVAL,
+            name='flush_db_buffers'
+        )
+        
+    # 全局维护任务只需一个进程运行
+    if DB_MANAGER is not None and primary:
+        # 每天维护消息分区：预建未来月份、删除过期月份
+        application.job_queue.run_repeating(
+            maintain_partitions,
+            interval=24 * 60 * 60,
+            first=60,
+            name='maintain_partitions'
+        )
+        
+        # 清零已中断的连续签到，排行榜上的连胜天数不再停留在中断前
+        application.job_queue.run_repeating(
+            expire_sign_in_streaks,
+            interval=DB_MANAGER.STREAK_EXPIRE_INTERVAL,
+            first=60,
+            name='expire_sign_in_streaks'
+        )
+        
+        # 多实例部署：定时刷新数据库中的物化排行榜
+        if DB_MANAGER.LEADERBOARD_MODE == 'materialized':
+            application.job_queue.run_repeating(
+                refresh_leaderboard,
+                interval=DB_MANAGER.LEADERBOARD_REFRESH_INTERVAL,
+                first=DB_MANAGER.LEADERBOARD_REFRESH_INTERVAL,
+                name='refresh_leaderboard'
+            )
     
     # 添加处理
     application.add_handler(CommandHandler("start", start))
@@ -802,6 +989,7 @@ def main():
     # 新增积分命令
     application.add_handler(CommandHandler("sign", sign_in_command))
     application.add_handler(CommandHandler("points", points_command))
+    application.add_handler(CommandHandler("calendar", calendar_command))
     application.add_handler(CommandHandler("rank", rank_command))
     application.add_handler(CommandHandler("leaderboard", rank_command))  # 别名
 
@@ -812,20 +1000,98 @@ def main():
     # 消息处理（放在最后，因为它是兜底的）
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, smart_reply))
     
+    # 命令统计覆盖所有已注册的 CommandHandler
+    TRACKED_COMMANDS = frozenset(
+        command
+        for handler in application.handlers.get(0, [])
+        if isinstance(handler, CommandHandler)
+        for command in handler.commands
+    )
+    application.add_handler(
+        MessageHandler(filters.COMMAND & filters.UpdateType.MESSAGE, track_command),
+        group=-1
+    )
+    
+    # 为所有处理器记录处理次数与耗时（命令按命令名，其余按函数名）
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, CommandHandler):
+                name = sorted(handler.commands)[0]
+            else:
+                name = handler.callback.__name__
+            handler.callback = instrumented(name, handler.callback)
+    
+    # 限流放在最前面的分组；它通过 ApplicationHandlerStop 截断更新，不计入处理器耗时与异常
+    application.add_handler(TypeHandler(Update, flood_guard), group=-2)
+    
     # 错误处理
     application.add_error_handler(error_handler)
+    return application
+
+def run_worker(index: int, updates, ready):
+    """
+    多进程模式下工作进程的入口（由 workers.py 以 spawn 方式启动）
+    有独立的数据库连接池和 Application，只处理主进程分发来的更新；建表只由 0 号进程执行
+    """
+    from workers import serve_updates
     
-    print("=" * 50)
-    print("✅ 机器人启动完成！")
-    print(f"📊 运行模式: {'数据库模式' if DATABASE_URL and DB_MANAGER is not None else '内存模式'}")
-    print("=" * 50)
+    # Ctrl+C 会发给整个进程组，停止由主进程统一协调
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
     
-    # 启动机器人
-    application.run_polling(
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES,
-        close_loop=False
-    )
+    init_database(init_schema=index == 0, required=True)
+    application = build_application(primary=index == 0, updater=False)
+    
+    # 指标只在本机端口提供，由主进程抓取汇总
+    http_server = HTTPServer(host='127.0.0.1', port=WORKER_METRICS_PORT + index)
+    http_server.route('GET', '/healthz', health_check)
+    http_server.route('GET', '/metrics', metrics_endpoint)
+    print(f"✅ 工作进程 {index} 启动完成（PID {os.getpid()}）")
+    
+    asyncio.run(serve_updates(application, updates, ready, http_server))
+    
+    if DB_MANAGER is not None:
+        DB_MANAGER.close_all_connections()
+
+async def serve():
+    """
+    单进程模式：先启动 HTTP 服务器再初始化数据库
+    建表与加载排行榜期间 /healthz 已能响应，/readyz 在机器人启动前返回 503
+    """
+    global HTTP_SERVER
+    HTTP_SERVER = create_http_server()
+    await HTTP_SERVER.start()
+    try:
+        # 初始化是同步的，放到线程中执行，事件循环继续响应健康检查
+        await asyncio.to_thread(init_database)
+        application = build_application()
+        
+        print("=" * 50)
+        print("✅ 机器人启动完成！")
+        print(f"📊 运行模式: {'数据库模式' if DATABASE_URL and DB_MANAGER is not None else '内存模式'}")
+        print(f"📡 接收方式: {BOT_MODE}")
+        print("=" * 50)
+        
+        await run_application(application)
+    finally:
+        await HTTP_SERVER.stop()
+
+def main():
+    print("🚀 正在启动机器人...")
+    
+    # 多进程模式：本进程只接收并分发更新，数据库与处理器都在工作进程中
+    if WORKERS > 1:
+        from workers import run_ingress
+        bot = Bot(TOKEN, base_url=BOT_API_URL or 'https://api.telegram.org/bot')
+        asyncio.run(run_ingress(
+            WORKERS, run_worker, bot, create_http_server(),
+            metrics_port=WORKER_METRICS_PORT,
+            webhook_url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH if BOT_MODE == 'webhook' else None,
+            webhook_path=WEBHOOK_PATH,
+            webhook_secret=WEBHOOK_SECRET
+        ))
+        return
+    
+    asyncio.run(serve())
     
     # 机器人停止时关闭数据库连接
     if DB_MANAGER is not None:  
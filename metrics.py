@@ -0,0 +1,333 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import time
+from collections import deque
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# 默认延迟分桶（秒）
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    """单调递增计数器"""
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self):
+        for labelvalues, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Gauge:
+    """可增可减的瞬时值"""
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def set(self, value: float, *labelvalues):
+        self._values[labelvalues] = value
+
+    def render(self):
+        for labelvalues, value in self._values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class CallbackMetric:
+    """抓取时才计算的指标（如连接池占用），callback 返回 {labelvalues: value}"""
+
+    def __init__(self, name: str, documentation: str, callback, labelnames=(), type: str = 'gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.type = type
+        self._callback = callback
+
+    def render(self):
+        try:
+            values = self._callback() or {}
+        except Exception as e:
+            logger.error(f"❌ 采集指标 {self.name} 失败: {e}")
+            return
+        for labelvalues, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Histogram:
+    """累计分桶直方图"""
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labelvalues -> [各分桶计数, 总和, 总数]
+        self._values = {}
+
+    def observe(self, value: float, *labelvalues):
+        series = self._values.get(labelvalues)
+        if series is None:
+            series = self._values[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        for labelvalues, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Registry:
+    """指标注册表，输出 Prometheus 文本格式"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def _add_labels(sample: str, extra) -> str:
+    """在一行样本的标签最前面加上 extra 标签"""
+    labels = ','.join(f'{name}="{_escape(value)}"' for name, value in extra)
+    brace, space = sample.find('{'), sample.find(' ')
+    if 0 <= brace < space:
+        return f"{sample[:brace + 1]}{labels},{sample[brace + 1:]}"
+    return f"{sample[:space]}{{{labels}}}{sample[space:]}"
+
+
+def merge_expositions(sources) -> str:
+    """
+    合并多个进程输出的 Prometheus 文本：sources 为 [(附加标签, 文本)]，附加标签如 [('worker', '0')]
+    同一指标族只保留一份 HELP/TYPE，各进程的样本依次排在下面
+    """
+    # 指标名 -> [HELP 行, TYPE 行, 样本]
+    families = {}
+    for extra, text in sources:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = families.setdefault(line.split(' ', 3)[2], [None, None, []])
+                slot = 0 if line.startswith('# HELP ') else 1
+                if family[slot] is None:
+                    family[slot] = line
+            elif line and not line.startswith('#') and family is not None:
+                family[2].append(_add_labels(line, extra) if extra else line)
+
+    lines = []
+    for help_line, type_line, samples in families.values():
+        lines.extend(line for line in (help_line, type_line) if line is not None)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class RollingWindow:
+    """保留最近 size 个样本，用于计算滚动分位数"""
+
+    def __init__(self, size: int = 1024):
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value: float):
+        self._samples.append(value)
+
+    def percentiles(self, *quantiles) -> list:
+        """最近样本的分位数（最近秩法），没有样本时全部为 0"""
+        if not self._samples:
+            return [0.0] * len(quantiles)
+        ordered = sorted(self._samples)
+        last = len(ordered) - 1
+        return [ordered[min(last, int(q * len(ordered)))] for q in quantiles]
+
+
+class HandlerTiming:
+    """一次处理器调用中累计的数据库与 Telegram 请求耗时"""
+
+    __slots__ = ('db', 'send', 'active')
+
+    def __init__(self):
+        self.db = 0.0
+        self.send = 0.0
+        self.active = True
+
+
+# 当前处理器调用的耗时累加器；处理器之外（定时任务等）为 None
+_current_timing = contextvars.ContextVar('handler_timing', default=None)
+
+
+def record_db_time(seconds: float):
+    """由数据库层调用：把耗时计入当前处理器"""
+    timing = _current_timing.get()
+    # 处理器结束后才完成的后台任务（如缓冲刷新）会继承上下文，不再计入
+    if timing is not None and timing.active:
+        timing.db += seconds
+
+
+def record_send_time(seconds: float):
+    """由 Telegram 请求层调用：把耗时计入当前处理器"""
+    timing = _current_timing.get()
+    if timing is not None and timing.active:
+        timing.send += seconds
+
+
+# 全局指标（只在事件循环线程中更新）
+REGISTRY = Registry()
+
+UPDATES_TOTAL = REGISTRY.register(Counter(
+    'bot_updates_total', '各处理器处理的更新数', ['handler']))
+HANDLER_ERRORS_TOTAL = REGISTRY.register(Counter(
+    'bot_handler_errors_total', '各处理器抛出的异常数', ['handler']))
+HANDLER_DURATION = REGISTRY.register(Histogram(
+    'bot_handler_duration_seconds', '处理器耗时', ['handler']))
+HANDLER_DB_DURATION = REGISTRY.register(Histogram(
+    'bot_handler_db_seconds', '处理器内等待数据库的时间', ['handler']))
+HANDLER_SEND_DURATION = REGISTRY.register(Histogram(
+    'bot_handler_send_seconds', '处理器内等待 Telegram 请求的时间', ['handler']))
+DB_QUERY_DURATION = REGISTRY.register(Histogram(
+    'bot_db_query_duration_seconds', 'DatabaseManager 各方法耗时（含等待线程与连接）', ['method']))
+EVENT_LOOP_LAG = REGISTRY.register(Gauge(
+    'bot_event_loop_lag_seconds', '事件循环最近一次调度延迟'))
+EVENT_LOOP_LAG_HISTOGRAM = REGISTRY.register(Histogram(
+    'bot_event_loop_lag_distribution_seconds', '事件循环调度延迟分布'))
+
+
+TELEGRAM_REQUEST_DURATION = REGISTRY.register(Histogram(
+    'bot_telegram_request_seconds', 'Bot API 请求耗时（不含 getUpdates 长轮询）'))
+
+
+class TimedRequest(HTTPXRequest):
+    """记录每个 Bot API 请求耗时的请求类，耗时同时计入当前处理器"""
+
+    async def do_request(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().do_request(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            TELEGRAM_REQUEST_DURATION.observe(elapsed)
+            record_send_time(elapsed)
+
+
+# 处理器名 -> {'wall' | 'db' | 'send': RollingWindow}，供 /admin 展示
+HANDLER_WINDOWS = {}
+
+
+def instrumented(name: str, callback):
+    """包装处理器：记录处理次数、异常数、总耗时以及其中的数据库与 Telegram 请求耗时"""
+    windows = HANDLER_WINDOWS.setdefault(
+        name, {'wall': RollingWindow(), 'db': RollingWindow(), 'send': RollingWindow()})
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        timing = HandlerTiming()
+        token = _current_timing.set(timing)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS_TOTAL.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            timing.active = False
+            _current_timing.reset(token)
+
+            UPDATES_TOTAL.inc(name)
+            HANDLER_DURATION.observe(elapsed, name)
+            HANDLER_DB_DURATION.observe(timing.db, name)
+            HANDLER_SEND_DURATION.observe(timing.send, name)
+            windows['wall'].add(elapsed)
+            windows['db'].add(timing.db)
+            windows['send'].add(timing.send)
+
+    return wrapper
+
+
+def handler_report() -> list:
+    """各处理器的调用次数、异常数和滚动 p50/p95/p99（秒），按调用次数降序"""
+    report = []
+    for name, windows in HANDLER_WINDOWS.items():
+        count = UPDATES_TOTAL.get(name)
+        if not count:
+            continue
+        report.append({
+            'handler': name,
+            'count': int(count),
+            'errors': int(HANDLER_ERRORS_TOTAL.get(name)),
+            'wall': windows['wall'].percentiles(0.5, 0.95, 0.99),
+            'db': windows['db'].percentiles(0.5, 0.95, 0.99),
+            'send': windows['send'].percentiles(0.5, 0.95, 0.99),
+        })
+    report.sort(key=lambda row: row['count'], reverse=True)
+    return report
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """定期睡眠 interval 秒，实际多睡的时间即事件循环被阻塞的时间"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        EVENT_LOOP_LAG.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
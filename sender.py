@@ -0,0 +1,244 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import REGISTRY, CallbackMetric, Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# 发送优先级：交互回复优先于批量推送
+# 用法: await bot.send_message(chat_id, text, rate_limit_args=BULK)
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITY_RANKS = {INTERACTIVE: 0, BULK: 1}
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个"""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float, cost: float = 1) -> float:
+        """令牌足够时取走 cost 个并返回 0，否则返回还需等待的秒数"""
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def reserve(self, now: float) -> float:
+        """预订一个令牌（允许欠账），返回轮到自己前需要等待的秒数；同一个桶上的请求按预订顺序发出"""
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class PriorityGate:
+    """
+    全局令牌桶前的优先级队列
+    令牌充足且无人排队时直接放行；否则按 (优先级, 入队顺序) 排队，由一个后台任务按令牌速率逐个放行
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self._bucket = bucket
+        self._waiters = []
+        self._pump_task = None
+        # 收到 retry_after 后全局暂停到这个时间点
+        self.paused_until = 0.0
+
+    def __len__(self):
+        return len(self._waiters)
+
+    def depth(self) -> dict:
+        """各优先级排队数"""
+        counts = dict.fromkeys(PRIORITY_RANKS, 0)
+        for _, _, priority, future in self._waiters:
+            if not future.done():
+                counts[priority] += 1
+        return counts
+
+    async def acquire(self, priority: str, seq: int):
+        now = time.monotonic()
+        if not self._waiters and now >= self.paused_until and self._bucket.try_take(now) == 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY_RANKS[priority], seq, priority, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    def pause(self, seconds: float):
+        """暂停放行；多个 429 的等待时间合并成一个窗口，而不是各自叠加"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def _pump(self):
+        while self._waiters:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            wait = self._bucket.try_take(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            # 跳过已取消的等待者，令牌留给下一个
+            while self._waiters:
+                *_, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+            else:
+                self._bucket.tokens += 1
+
+    async def close(self):
+        if self._pump_task is not None:
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+            self._pump_task = None
+
+
+class SendScheduler(BaseRateLimiter):
+    """
+    Bot API 发送调度器（作为 Application 的 rate_limiter）
+    带 chat_id 的请求先过该聊天的令牌桶（私聊约 1 条/秒，群组约 20 条/分钟），
+    再过全局令牌桶（默认 25 条/秒，低于 Telegram 约 30 条/秒的上限），全局排队时交互回复优先于批量推送。
+    收到 429 时全局暂停 retry_after 秒，暂停期间的所有请求在同一个窗口结束后重试。
+    其他请求（getMe、setWebhook、answerCallbackQuery 等）不受限制
+    """
+
+    GLOBAL_RATE = float(os.environ.get('SEND_GLOBAL_RATE', 25))
+    GLOBAL_BURST = float(os.environ.get('SEND_GLOBAL_BURST', 5))
+    CHAT_RATE = float(os.environ.get('SEND_CHAT_RATE', 1))
+    CHAT_BURST = float(os.environ.get('SEND_CHAT_BURST', 1))
+    GROUP_RATE = float(os.environ.get('SEND_GROUP_RATE', 20 / 60))
+    GROUP_BURST = float(os.environ.get('SEND_GROUP_BURST', 1))
+    MAX_RETRIES = int(os.environ.get('SEND_MAX_RETRIES', 3))
+
+    # 每处理这么多请求清理一次已回满的聊天令牌桶
+    SWEEP_EVERY = 4096
+
+    # 正在运行的调度器，供 /metrics 读取排队数
+    active = None
+
+    def __init__(self):
+        self._gate = PriorityGate(TokenBucket(self.GLOBAL_RATE, self.GLOBAL_BURST))
+        self._chats = {}
+        self._seq = itertools.count()
+        # 等待聊天令牌桶的请求数（全局队列中的由 PriorityGate 统计）
+        self._chat_waiting = dict.fromkeys(PRIORITY_RANKS, 0)
+
+    async def initialize(self):
+        SendScheduler.active = self
+        logger.info(
+            f"✅ 发送调度器已启用：全局 {self.GLOBAL_RATE:g} 条/秒，"
+            f"私聊 {self.CHAT_RATE:g} 条/秒，群组 {self.GROUP_RATE * 60:g} 条/分钟"
+        )
+
+    async def shutdown(self):
+        if SendScheduler.active is self:
+            SendScheduler.active = None
+        await self._gate.close()
+
+    def queue_depth(self) -> dict:
+        """各优先级仍在调度器中等待的请求数"""
+        depth = self._gate.depth()
+        for priority, count in self._chat_waiting.items():
+            depth[priority] += count
+        return depth
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # 频道用户名（str）与负数 ID 都是群组/频道
+            if isinstance(chat_id, str) or int(chat_id) < 0:
+                bucket = TokenBucket(self.GROUP_RATE, self.GROUP_BURST)
+            else:
+                bucket = TokenBucket(self.CHAT_RATE, self.CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _sweep(self):
+        now = time.monotonic()
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def _acquire(self, chat_id, priority: str, seq: int):
+        wait = self._chat_bucket(chat_id).reserve(time.monotonic())
+        if wait:
+            self._chat_waiting[priority] += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._chat_waiting[priority] -= 1
+        await self._gate.acquire(priority, seq)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            return await callback(*args, **kwargs)
+
+        priority = BULK if rate_limit_args == BULK else INTERACTIVE
+        # 重试沿用首次入队的顺序号，排在同优先级的新请求之前
+        seq = next(self._seq)
+        if seq % self.SWEEP_EVERY == 0:
+            self._sweep()
+
+        started = time.perf_counter()
+        try:
+            for attempt in range(self.MAX_RETRIES + 1):
+                queued = time.perf_counter()
+                await self._acquire(chat_id, priority, seq)
+                SEND_QUEUE_WAIT.observe(time.perf_counter() - queued, priority)
+                try:
+                    return await callback(*args, **kwargs)
+                except RetryAfter as e:
+                    SEND_RETRY_AFTER_TOTAL.inc(endpoint)
+                    self._gate.pause(float(e.retry_after))
+                    if attempt == self.MAX_RETRIES:
+                        raise
+                    logger.warning(f"⚠️ {endpoint} 触发限流，{e.retry_after} 秒后重试（第 {attempt + 1} 次）")
+        finally:
+            SEND_LATENCY.observe(time.perf_counter() - started, priority)
+
+
+SEND_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'bot_send_queue_wait_seconds', '发送请求在调度器中的排队时间', ['priority']))
+SEND_LATENCY = REGISTRY.register(Histogram(
+    'bot_send_latency_seconds', '发送请求从入队到完成的总耗时（含重试）', ['priority']))
+SEND_RETRY_AFTER_TOTAL = REGISTRY.register(Counter(
+    'bot_send_retry_after_total', '收到 429 retry_after 的次数', ['endpoint']))
+
+
+def _queue_depth_metric():
+    scheduler = SendScheduler.active
+    if scheduler is None:
+        return {}
+    return {(priority,): count for priority, count in scheduler.queue_depth().items()}
+
+
+REGISTRY.register(CallbackMetric(
+    'bot_send_queue_depth', '调度器中等待发送的请求数', _queue_depth_metric, labelnames=('priority',)))
@@ -0,0 +1,64 @@
+import calendar
+from datetime import date, timedelta
+
+
+class SignInHistory:
+    """
+    用户签到历史位图（user_points.sign_in_bits / sign_in_bits_end）
+    最低位是 end 当天，往高位每一位早一天，1 表示那天签到过；一年的历史只占 46 字节。
+    连续天数、最长连续、今日是否已签到以及任意一周或一个月的日历都由位运算得到，不再查询 daily_sign_ins
+    """
+
+    __slots__ = ('bits', 'end')
+
+    def __init__(self, bits: int = 0, end: date = None):
+        self.bits = bits if end is not None else 0
+        self.end = end
+
+    @classmethod
+    def from_row(cls, bits: str, end: date):
+        """psycopg2 把 varbit 读成 '1011' 形式的字符串；从未签到时两列都为空"""
+        if not bits or end is None:
+            return cls()
+        return cls(int(bits, 2), end)
+
+    def __bool__(self):
+        return self.bits != 0
+
+    def signed(self, day: date) -> bool:
+        """某一天是否签到过"""
+        if self.end is None or day > self.end:
+            return False
+        return bool(self.bits >> (self.end - day).days & 1)
+
+    def streak(self, today: date) -> int:
+        """当前连续签到天数：截至今天，今天还没签到时截至昨天；更早中断的为 0"""
+        if self.end is None or (today - self.end).days > 1:
+            return 0
+        # 最低位起连续 1 的个数
+        return (self.bits ^ (self.bits + 1)).bit_length() - 1
+
+    def max_streak(self) -> int:
+        """历史最长连续签到天数：每与自身右移一位相与一次，最长的一串 1 缩短一位"""
+        bits, longest = self.bits, 0
+        while bits:
+            bits &= bits >> 1
+            longest += 1
+        return longest
+
+    def count(self, first: date, last: date) -> int:
+        """[first, last] 内的签到天数"""
+        if self.end is None or first > self.end or last < first:
+            return 0
+        last = min(last, self.end)
+        window = self.bits >> (self.end - last).days
+        return (window & ((1 << ((last - first).days + 1)) - 1)).bit_count()
+
+    def days(self, first: date, last: date) -> list:
+        """[first, last] 内每天是否签到，按日期从早到晚"""
+        return [self.signed(first + timedelta(days=i)) for i in range((last - first).days + 1)]
+
+    def month(self, year: int, month: int) -> list:
+        """某个月每天是否签到，下标 0 为 1 号"""
+        first = date(year, month, 1)
+        return self.days(first, first.replace(day=calendar.monthrange(year, month)[1]))
@@ -0,0 +1,368 @@
+import logging
+import string
+import time
+
+from metrics import REGISTRY, CallbackMetric
+
+logger = logging.getLogger(__name__)
+
+
+class Template:
+    """
+    预编译的回复模板
+    启动时把模板拆成「文本段 + 字段」序列，渲染时逐段取值后一次 join；
+    没有字段的模板直接返回启动时生成的文本
+    """
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        self.fields = []
+        # 第一段文本，之后每项为 (字段名, 转换函数, 字段后的文本)
+        self._head = ''
+        self._steps = []
+        self.renders = 0
+        self.render_time = 0.0
+
+        for literal, field, spec, conversion in string.Formatter().parse(source):
+            if self._steps:
+                field_name, convert, tail = self._steps[-1]
+                self._steps[-1] = (field_name, convert, tail + literal)
+            else:
+                self._head += literal
+            if field is None:
+                continue
+            if not field.isidentifier():
+                raise ValueError(f"模板 {name} 的字段 {{{field}}} 只能是简单名称")
+            self.fields.append(field)
+            self._steps.append((field, self._converter(conversion, spec), ''))
+
+        self.static = not self._steps
+
+    @staticmethod
+    def _converter(conversion, spec):
+        if conversion not in (None, 's', 'r'):
+            raise ValueError(f"不支持的转换 !{conversion}")
+        if not conversion and not spec:
+            return str
+        prepare = repr if conversion == 'r' else str if conversion == 's' else None
+        if prepare is None:
+            return lambda value: format(value, spec)
+        return lambda value: format(prepare(value), spec)
+
+    def render(self, values: dict) -> str:
+        if self.static:
+            return self._head
+        parts = [self._head]
+        for field, convert, tail in self._steps:
+            value = values[field]
+            parts.append(value if type(value) is str else convert(value))
+            parts.append(tail)
+        return ''.join(parts)
+
+
+class TemplateRegistry:
+    """
+    回复模板注册表：启动时编译全部模板，模板有误时立即失败
+    记录每个模板的渲染次数与累计耗时，通过 /metrics 导出
+    """
+
+    def __init__(self, sources: dict):
+        self._templates = {name: Template(name, source) for name, source in sources.items()}
+        static = sum(template.static for template in self._templates.values())
+        logger.info(f"✅ 回复模板编译完成：{len(self._templates)} 个（静态 {static} 个）")
+
+    def __getitem__(self, name: str) -> Template:
+        return self._templates[name]
+
+    def __iter__(self):
+        return iter(self._templates.values())
+
+    def render(self, name: str, /, **values) -> str:
+        template = self._templates[name]
+        start = time.perf_counter()
+        try:
+            return template.render(values)
+        except KeyError as e:
+            raise KeyError(f"模板 {name} 缺少字段 {e}") from None
+        finally:
+            template.renders += 1
+            template.render_time += time.perf_counter() - start
+
+
+# 回复模板（Markdown 文本与原处理器中的完全一致）
+SOURCES = {
+    'start': """
+🎉 你好 {first_name}！
+
+欢迎使用我的机器人！我已经记住了你的信息。
+
+📊 你可以使用以下命令：
+/start - 显示此消息
+/help - 查看详细帮助
+/ping - 测试机器人响应
+/stats - 查看你的使用统计
+/admin - 管理员功能（如有权限）
+
+💰 积分命令：
+/sign - 每日签到获取1积分
+/points - 查看我的积分详情
+/calendar - 查看本月签到日历
+/rank - 查看积分排行榜
+
+💡 试试发送任意消息，我会回应你！
+    """,
+
+    'help': """
+🤖 *机器人命令手册*
+
+🎯 *基础命令*
+/start - 开始使用机器人
+/help - 查看此帮助信息
+/ping - 测试机器人是否在线
+
+💰 *积分签到系统*
+/sign - 每日签到获取积分（每天一次）
+/points - 查看我的积分详情
+/calendar [年-月] - 查看月度签到日历
+/rank - 查看积分排行榜
+/leaderboard - 排行榜（/rank 的别名）
+
+📊 *统计命令*
+/stats - 查看你的使用统计
+
+🛠️ *功能命令*
+/echo <文本> - 回声测试
+/time - 显示当前时间
+
+👮 *管理员命令* (仅管理员可用)
+/addpoints <用户ID> <积分> [原因] - 调整用户积分
+/setpoints <用户ID> <积分> - 直接设置用户积分
+/admin - 查看机器人统计
+
+🎮 *积分规则*
+• 每日签到：+1 基础积分
+• 连续3天：额外 +1 积分
+• 连续7天：额外 +2 积分
+• 每天只能签到一次
+• 午夜后重置签到机会
+
+💬 *智能聊天*
+直接发送消息，我会智能回复：
+- 你好、hi、hello
+- 时间、几点
+- 日期、今天几号
+- 其他消息我会随机回复
+
+📞 *客服联系*
+@TelegranSheng
+@WIBSIBKB
+
+💡 *提示*：使用 /sign 开始你的签到之旅吧！
+    """,
+
+    'stats': """
+📊 *{first_name} 的使用统计*
+
+👤 用户信息：
+- ID: `{telegram_id}`
+- 用户名: @{username}
+- 加入时间: {join_date}
+
+📈 活跃度统计：
+- 总消息数: {message_count} 条
+{command_lines}
+
+🕐 最后命令: {last_command}
+最后时间: {last_command_time}
+            """,
+
+    'stats_command_line': "- {command} 使用次数: {count}",
+
+    'admin': """
+🤖 *机器人全局统计*
+
+👥 用户数据：
+- 总用户数: {total_users}
+- 总消息数: {total_messages}
+- 命令总数: {total_commands}
+
+⏰ 最后活动: {last_message_time}
+
+🛠️ 系统状态：
+- 启动时间: {now}
+- 健康检查: ✅ 运行中 (端口 {port})
+- 数据库: {database}
+        {perf_section}""",
+
+    'admin_perf': "\n⏱️ *处理器耗时（最近样本，毫秒）*\n```\n{perf}\n```",
+
+    'sign_success': """
+{streak_emoji} *签到成功！*
+
+👤 {first_name}，签到成功！
+
+💰 *积分详情*
+├ 基础奖励: +{base_points}分
+{bonus_line}
+└ 本次获得: **+{points_awarded}分**
+
+📊 *签到统计*
+├ 当前积分: **{total_points}分**
+├ 连续签到: {streak}天 {streak_emoji}
+├ 总签到次数: {sign_in_count}次
+└ 今日排名: 第{rank}名
+
+⏰ *时间信息*
+├ 签到时间: {sign_time}
+└ 下次签到: 明天{next_time}后
+
+{encouragement}
+
+💡 使用 /points 查看详细积分
+💎 使用 /rank 查看排行榜
+                """,
+
+    'sign_bonus_line': "├ 连续签到奖励: +{bonus_points}分",
+
+    'sign_plain_success': """
+✅ 签到成功！
+获得 {points_awarded} 积分！
+
+{message}
+
+使用 /points 查看你的积分详情。
+                """,
+
+    'sign_already': """
+⏰ *签到提醒*
+
+{first_name}，你今天已经签到过了哦！
+
+📅 签到时间: {last_time}
+💰 当前积分: **{total_points}分**
+🔥 连续签到: {current_streak}天
+
+💡 明天记得再来签到！
+⏳ 下次可签到: 明天 00:00 后
+                """,
+
+    'points_empty': """
+💰 *积分详情*
+
+👤 {first_name}，你还没有积分记录。
+
+💡 使用 /sign 进行每日签到，获得积分！
+🎯 每天只能签到一次，每次获得1积分
+✨ 连续签到还有额外奖励！
+            """,
+
+    'points_detail': """
+💰 *积分详情*
+
+👤 **{first_name}** (@{username})
+
+📊 *积分概览*
+├ 总积分: **{total_points} 分**
+├ 签到次数: {sign_in_count} 次
+├ 当前连胜: {current_streak} 天
+├ 最高连胜: {max_streak} 天
+├ 今日状态: {signed_today}
+└ 上次签到: {last_sign}
+
+📈 *最近7天签到日历*
+{calendar}
+← 最近7天
+✓=已签 ○=未签 ✅=今日
+
+🏆 *排行榜*
+当前排名: 第 {rank} 名
+
+📝 *最近积分变动*
+{transactions}
+{tip}""",
+
+    'points_transaction': "• {time_str} {change} 分 ({reason})\n",
+
+    'calendar': """
+📅 *{year}年{month}月签到日历*
+
+👤 **{first_name}**
+
+一 二 三 四 五 六 日
+{grid}
+
+🟩=已签 ⬜=漏签 🟨=今日待签 ▫️=未到
+
+📊 本月签到: **{month_count}/{month_days} 天**
+🔥 当前连胜: {current_streak} 天
+🏆 最长连胜: {max_streak} 天
+📆 累计签到: {sign_in_count} 次
+
+{tip}""",
+
+    'rank_empty': """
+🏆 *积分排行榜*
+
+暂无用户数据。
+
+💡 使用 /sign 开始签到，成为排行榜第一名！
+            
+
+💡 每日签到可获得积分，连续签到有额外奖励！""",
+
+    'rank_board': """
+🏆 *积分排行榜*
+
+🏅 *Top 10 签到达人*
+{rows}{user_line}
+
+💡 每日签到可获得积分，连续签到有额外奖励！""",
+
+    'rank_row': "{medal} {name}: {points} 分{streak}\n",
+
+    'rank_user_outside': "\n📊 你的排名: 第 {rank} 名 ({points} 分)",
+
+    'rank_user_inside': "\n📊 恭喜你在排行榜上！",
+
+    'addpoints_success': """
+✅ *积分调整成功*
+
+👤 目标用户ID: `{target_user_id}`
+💰 积分变动: **{points}** 分
+📝 原因: {reason}
+
+📊 *调整后状态*
+- 总积分: **{total_points}** 分
+- 签到次数: {sign_in_count} 次
+- 连续签到: {current_streak} 天
+
+⏰ 操作时间: {now}
+👮 操作人: {first_name} (@{username})
+            """,
+
+    'setpoints_success': """
+✅ *积分设置成功*
+
+👤 目标用户ID: `{target_user_id}`
+🎯 设置积分: **{points}** 分
+
+⏰ 操作时间: {now}
+👮 操作人: {first_name}
+            """,
+}
+
+TEMPLATES = TemplateRegistry(SOURCES)
+
+
+# 模板渲染耗时：抓取 /metrics 时读取
+REGISTRY.register(CallbackMetric(
+    'bot_template_renders_total', '各回复模板的渲染次数',
+    lambda: {(template.name,): template.renders for template in TEMPLATES},
+    labelnames=('template',), type='counter',
+))
+REGISTRY.register(CallbackMetric(
+    'bot_template_render_seconds_total', '各回复模板的累计渲染耗时（秒）',
+    lambda: {(template.name,): template.render_time for template in TEMPLATES},
+    labelnames=('template',), type='counter',
+))
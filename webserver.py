@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from urllib.parse import urlsplit, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# 请求体上限：Telegram 的单个更新远小于这个值
+MAX_BODY_SIZE = 1024 * 1024
+
+STATUS_TEXT = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
+
+class Request:
+    """一个已解析的 HTTP 请求"""
+
+    def __init__(self, method: str, target: str, headers: dict, body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = parse_qs(parts.query)
+        # 头部名统一为小写
+        self.headers = headers
+        self.body = body
+
+
+class Response:
+    """HTTP 响应"""
+
+    def __init__(self, status: int = 200, body=b'', content_type: str = 'text/plain; charset=utf-8'):
+        self.status = status
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.content_type = content_type
+
+
+class HTTPServer:
+    """
+    基于 asyncio 的极简 HTTP/1.1 服务器
+    与机器人运行在同一个事件循环中，负责健康检查和 webhook 等少量路由，支持长连接
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8080):
+        self.host = host
+        self.port = port
+        # (method, path) -> async handler(request) -> Response
+        self._routes = {}
+        self._server = None
+
+    def route(self, method: str, path: str, handler):
+        """注册路由"""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info(f"🔌 HTTP服务器启动在端口 {self.port}")
+
+    async def stop(self):
+        """停止接受新连接（可重复调用）"""
+        if self._server is not None:
+            self._server.close()
+            try:
+                # 新版本 Python 会等待长连接全部断开，这里不无限等待
+                await asyncio.wait_for(self._server.wait_closed(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
+            self._server = None
+            logger.info("✅ HTTP服务器已停止")
+
+    async def _dispatch(self, request: Request) -> Response:
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                return Response(405, 'Method Not Allowed')
+            return Response(404, 'Not Found')
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"❌ 处理HTTP请求失败 {request.method} {request.path}: {e}")
+            return Response(500, 'Internal Server Error')
+
+    async def _read_request(self, reader):
+        """读取一个请求；连接关闭时返回 None"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ValueError("无效的请求行")
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get('content-length', 0) or 0)
+        if length > MAX_BODY_SIZE:
+            raise OverflowError("请求体过大")
+        body = await reader.readexactly(length) if length else b''
+        return Request(method.upper(), target, headers, body)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except OverflowError:
+                    await self._write_response(writer, Response(413, 'Payload Too Large'), keep_alive=False)
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    await self._write_response(writer, Response(400, 'Bad Request'), keep_alive=False)
+                    break
+                if request is None:
+                    break
+
+                response = await self._dispatch(request)
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, response, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _write_response(writer, response: Response, keep_alive: bool):
+        head = (
+            f"HTTP/1.1 {response.status} {STATUS_TEXT.get(response.status, '')}\r\n"
+            f"Content-Type: {response.content_type}\r\n"
+            f"Content-Length: {len(response.body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode('latin-1') + response.body)
+        await writer.drain()
@@ -0,0 +1,382 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+from telegram import Update
+from telegram.error import TelegramError
+
+from lanes import LaneUpdateProcessor
+from metrics import REGISTRY, CallbackMetric, Counter, merge_expositions
+from sender import SendScheduler
+from webserver import Response
+
+logger = logging.getLogger(__name__)
+
+# 工作进程启动就绪的最长等待时间（秒，含数据库初始化）
+WORKER_START_TIMEOUT = float(os.environ.get('WORKER_START_TIMEOUT', 120))
+# 停止时等待工作进程处理完已分发更新的时间（秒），超时后强制结束
+WORKER_STOP_TIMEOUT = float(os.environ.get('WORKER_STOP_TIMEOUT', 30))
+# 工作进程崩溃后的重启间隔：从 1 秒开始翻倍，最长 MAX_RESTART_DELAY 秒；稳定运行一分钟后复位
+MAX_RESTART_DELAY = float(os.environ.get('WORKER_MAX_RESTART_DELAY', 30))
+STABLE_AFTER = 60
+
+# 主进程抓取工作进程指标的超时（秒）
+METRICS_SCRAPE_TIMEOUT = 2
+
+# 工作进程从队列取更新时的空闲标记
+_IDLE = object()
+
+
+class Worker:
+    """主进程中对一个工作进程的记录"""
+
+    def __init__(self, index: int, context, target):
+        self.index = index
+        self._context = context
+        self._target = target
+        self.updates = context.Queue()
+        self.ready = context.Event()
+        self.process = None
+        self.started_at = 0.0
+        self.restart_delay = 1.0
+        self.restart_at = None
+
+    def start(self):
+        self.ready.clear()
+        self.process = self._context.Process(
+            target=self._target, args=(self.index, self.updates, self.ready),
+            name=f'bot-worker-{self.index}', daemon=False
+        )
+        self.process.start()
+        self.started_at = time.monotonic()
+        logger.info(f"🚀 工作进程 {self.index} 已启动（PID {self.process.pid}）")
+
+    def replace_queue(self):
+        """
+        进程异常退出时可能还持有队列的内部锁，换一个新队列；
+        旧队列中能取出的更新按原顺序转入新队列
+        """
+        old, self.updates = self.updates, self._context.Queue()
+        moved = 0
+        while True:
+            try:
+                self.updates.put(old.get_nowait())
+                moved += 1
+            except (queue.Empty, OSError, EOFError):
+                break
+        return moved
+
+    def depth(self) -> int:
+        try:
+            return self.updates.qsize()
+        except NotImplementedError:
+            return 0
+
+
+class Ingress:
+    """
+    接收更新并按用户哈希分发到固定的工作进程，同一用户的更新总是进入同一个进程的同一个队列，
+    再由工作进程中的 LaneUpdateProcessor 保证顺序。
+    群组中不同用户的更新会落到不同进程，群组发送速率因此按进程数平分（见 run_ingress）
+    """
+
+    def __init__(self, count: int, target, bot, http_server, metrics_port=None, webhook_url=None,
+                 webhook_path='/telegram', webhook_secret=None):
+        context = multiprocessing.get_context('spawn')
+        self.workers = [Worker(index, context, target) for index in range(count)]
+        self.bot = bot
+        self.http_server = http_server
+        # 第 i 个工作进程的指标端口为 metrics_port + i
+        self.metrics_port = metrics_port
+        self.webhook_url = webhook_url
+        self.webhook_path = webhook_path
+        self.webhook_secret = webhook_secret
+        self._stopping = asyncio.Event()
+        self._round_robin = 0
+
+    def shard(self, update: Update) -> int:
+        key = LaneUpdateProcessor.lane_key(update)
+        if key is None:
+            # 没有用户和聊天的更新（如投票状态）不需要保证顺序
+            self._round_robin += 1
+            return self._round_robin % len(self.workers)
+        return key % len(self.workers)
+
+    def dispatch(self, update: Update, data: dict):
+        worker = self.workers[self.shard(update)]
+        worker.updates.put(data)
+        INGRESS_UPDATES_TOTAL.inc(str(worker.index))
+
+    async def _wait_ready(self, worker: Worker):
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + WORKER_START_TIMEOUT
+        while not await loop.run_in_executor(None, worker.ready.wait, 1):
+            if not worker.process.is_alive():
+                raise RuntimeError(f"工作进程 {worker.index} 启动失败（退出码 {worker.process.exitcode}）")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"工作进程 {worker.index} 在 {WORKER_START_TIMEOUT:g} 秒内没有就绪")
+
+    async def start_workers(self):
+        # 0 号进程先启动并完成建表，其余进程再并行启动，避免并发执行 DDL
+        first, *others = self.workers
+        first.start()
+        await self._wait_ready(first)
+        for worker in others:
+            worker.start()
+        await asyncio.gather(*(self._wait_ready(worker) for worker in others))
+        logger.info(f"✅ {len(self.workers)} 个工作进程已就绪")
+
+    async def supervise(self):
+        """工作进程意外退出时按退避间隔重启"""
+        while not self._stopping.is_set():
+            now = time.monotonic()
+            for worker in self.workers:
+                if worker.process.is_alive():
+                    if now - worker.started_at > STABLE_AFTER:
+                        worker.restart_delay = 1.0
+                    continue
+                if worker.restart_at is None:
+                    logger.error(f"❌ 工作进程 {worker.index} 已退出（退出码 {worker.process.exitcode}），"
+                                 f"{worker.restart_delay:g} 秒后重启")
+                    worker.restart_at = now + worker.restart_delay
+                    worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+                elif now >= worker.restart_at:
+                    worker.restart_at = None
+                    moved = worker.replace_queue()
+                    if moved:
+                        logger.info(f"↪️ 工作进程 {worker.index} 的 {moved} 条待处理更新已转入新队列")
+                    worker.start()
+                    WORKER_RESTARTS_TOTAL.inc(str(worker.index))
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        """polling：长轮询 getUpdates 并分发"""
+        await self.bot.delete_webhook(drop_pending_updates=True)
+        offset = None
+        while not self._stopping.is_set():
+            try:
+                updates = await self.bot.get_updates(
+                    offset=offset, timeout=30, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning(f"⚠️ 获取更新失败: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update, update.to_dict())
+                offset = update.update_id + 1
+
+    async def receive_webhook(self, request):
+        """webhook：校验后原样转发给工作进程"""
+        if self.webhook_secret and request.headers.get('x-telegram-bot-api-secret-token') != self.webhook_secret:
+            return Response(403, 'Forbidden')
+        try:
+            data = json.loads(request.body)
+            update = Update.de_json(data, self.bot)
+        except (ValueError, KeyError, TypeError):
+            return Response(400, 'Bad Request')
+        self.dispatch(update, data)
+        return Response(200, 'OK')
+
+    async def readiness_check(self, request):
+        """就绪检查：主进程没有数据库，要求所有工作进程都存活且已就绪"""
+        waiting = [
+            str(worker.index) for worker in self.workers
+            if worker.process is None or not worker.process.is_alive() or not worker.ready.is_set()
+        ]
+        if waiting:
+            return Response(503, f"workers not ready: {', '.join(waiting)}")
+        return Response(200, 'OK')
+
+    async def _fetch_metrics(self, worker: Worker):
+        """读取一个工作进程的 /metrics，失败时返回 None"""
+        async def fetch():
+            reader, writer = await asyncio.open_connection('127.0.0.1', self.metrics_port + worker.index)
+            try:
+                writer.write(b"GET /metrics HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                data = await reader.read()
+            finally:
+                writer.close()
+            head, _, body = data.partition(b'\r\n\r\n')
+            if not head.startswith(b'HTTP/1.1 200'):
+                raise ValueError(head.split(b'\r\n', 1)[0].decode('latin-1'))
+            return body.decode('utf-8')
+
+        try:
+            return await asyncio.wait_for(fetch(), timeout=METRICS_SCRAPE_TIMEOUT)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            logger.warning(f"⚠️ 读取工作进程 {worker.index} 的指标失败: {e}")
+            return None
+
+    async def metrics_endpoint(self, request):
+        """主进程自身的指标，加上带 worker 标签的各工作进程指标"""
+        sources = [((), REGISTRY.render())]
+        if self.metrics_port is not None:
+            texts = await asyncio.gather(*(self._fetch_metrics(worker) for worker in self.workers))
+            sources.extend(
+                ((('worker', str(worker.index)),), text)
+                for worker, text in zip(self.workers, texts) if text is not None
+            )
+        return Response(200, merge_expositions(sources), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    async def stop_workers(self):
+        """发送停止标记，等待工作进程处理完已分发的更新后退出，超时则强制结束"""
+        for worker in self.workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.updates.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await loop.run_in_executor(None, worker.process.join, max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning(f"⚠️ 工作进程 {worker.index} 未在时限内退出，强制结束")
+                worker.process.terminate()
+                await loop.run_in_executor(None, worker.process.join, 5)
+        logger.info("✅ 工作进程已全部停止")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stopping.set)
+
+        # 先启动 HTTP 服务器：工作进程启动期间 /healthz 可以响应，/readyz 返回 503
+        self.http_server.route('GET', '/readyz', self.readiness_check)
+        self.http_server.route('GET', '/metrics', self.metrics_endpoint)
+        if self.webhook_url:
+            self.http_server.route('POST', self.webhook_path, self.receive_webhook)
+        await self.http_server.start()
+
+        await self.bot.initialize()
+        try:
+            await self.start_workers()
+            supervisor = asyncio.create_task(self.supervise())
+
+            if self.webhook_url:
+                await self.bot.set_webhook(
+                    url=self.webhook_url,
+                    secret_token=self.webhook_secret,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=True
+                )
+                print(f"🌐 webhook 模式运行中: {self.webhook_url}（{len(self.workers)} 个工作进程）")
+                await self._stopping.wait()
+            else:
+                print(f"📡 polling 模式运行中（{len(self.workers)} 个工作进程）")
+                poller = asyncio.create_task(self.poll())
+                await self._stopping.wait()
+                poller.cancel()
+                try:
+                    await poller
+                except asyncio.CancelledError:
+                    pass
+
+            # 先停止接收新的更新，再让工作进程处理完剩余更新
+            await self.http_server.stop()
+            await supervisor
+        finally:
+            self._stopping.set()
+            await self.http_server.stop()
+            await self.stop_workers()
+            await self.bot.shutdown()
+
+
+async def run_ingress(count: int, target, bot, http_server, **options):
+    """
+    多进程模式的主进程入口
+    工作进程各自维护内存状态，排行榜必须使用数据库物化模式。
+    全局发送速率和每个群组的发送速率按进程数平分：同一群组的回复可能由任意进程发出，
+    各进程的令牌桶之和不超过 Telegram 的限制。私聊只有一个用户，总在同一个进程，不需要平分
+    """
+    if os.environ.get('LEADERBOARD_MODE', 'memory') != 'materialized':
+        logger.info("ℹ️ 多进程模式下排行榜使用 materialized 模式")
+    os.environ['LEADERBOARD_MODE'] = 'materialized'
+    os.environ['SEND_GLOBAL_RATE'] = str(SendScheduler.GLOBAL_RATE / count)
+    os.environ['SEND_GLOBAL_BURST'] = str(max(1.0, SendScheduler.GLOBAL_BURST / count))
+    os.environ['SEND_GROUP_RATE'] = str(SendScheduler.GROUP_RATE / count)
+    os.environ['SEND_GROUP_BURST'] = str(max(1.0, SendScheduler.GROUP_BURST / count))
+
+    global INGRESS
+    INGRESS = Ingress(count, target, bot, http_server, **options)
+    await INGRESS.run()
+
+
+async def serve_updates(application, updates, ready, http_server=None):
+    """
+    工作进程的主循环：把队列中的更新交给 Application，收到 None 时处理完剩余更新后退出
+    生命周期与 run_polling 一致：initialize → post_init → start → stop → shutdown → post_shutdown
+    http_server 为只监听本机的指标服务器，与 Application 同时运行
+    """
+    if http_server is not None:
+        await http_server.start()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    ready.set()
+
+    loop = asyncio.get_running_loop()
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            data = await loop.run_in_executor(None, _next_update, updates)
+            if data is _IDLE:
+                # 主进程异常退出时不会再发送停止标记
+                if parent is not None and not parent.is_alive():
+                    logger.warning("⚠️ 主进程已退出，工作进程停止")
+                    break
+                continue
+            if data is None:
+                break
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        if http_server is not None:
+            await http_server.stop()
+
+
+def _next_update(updates):
+    try:
+        return updates.get(timeout=1)
+    except queue.Empty:
+        return _IDLE
+
+
+# 主进程中的分发器，供 /metrics 读取
+INGRESS = None
+
+INGRESS_UPDATES_TOTAL = REGISTRY.register(Counter(
+    'bot_ingress_updates_total', '分发给各工作进程的更新数', ['worker']))
+WORKER_RESTARTS_TOTAL = REGISTRY.register(Counter(
+    'bot_worker_restarts_total', '工作进程崩溃后的重启次数', ['worker']))
+
+
+def _worker_metric(collect):
+    def callback():
+        if INGRESS is None:
+            return {}
+        return {(str(worker.index),): collect(worker) for worker in INGRESS.workers}
+    return callback
+
+
+REGISTRY.register(CallbackMetric(
+    'bot_ingress_queue_depth', '各工作进程队列中待处理的更新数',
+    _worker_metric(Worker.depth), labelnames=('worker',)))
+REGISTRY.register(CallbackMetric(
+    'bot_worker_up', '工作进程是否存活',
+    _worker_metric(lambda worker: int(worker.process is not None and worker.process.is_alive())),
+    labelnames=('worker',)))